@@ -82,6 +82,22 @@ class AffineTransformation(object):
         '''
         return np.dot(self.invA,self.affineVec(vec))[0:3]
 
+    def tgtToSrcArray(self,pts):
+        '''
+        Same as tgtToSrc for an array of points of shape (N,3), with one
+        matrix product.
+        '''
+        pts = np.asarray(pts,dtype=float)
+        return np.dot(pts,self.A[0:3,0:3].T)+self.A[0:3,3]
+
+    def srcToTgtArray(self,pts):
+        '''
+        Same as srcToTgt for an array of points of shape (N,3), with one
+        matrix product.
+        '''
+        pts = np.asarray(pts,dtype=float)
+        return np.dot(pts,self.invA[0:3,0:3].T)+self.invA[0:3,3]
+
 
 class LinearTransformation(object):
     '''
@@ -99,4 +115,59 @@ class LinearTransformation(object):
          
     def srcToTgt(self,vec):
         return np.dot(self.invA,vec)
+
+    def tgtToSrcArray(self,vecs):
+        '''
+        Same as tgtToSrc for an array of vectors of shape (N,3) or a
+        stack of arrays (T,N,3), with one matrix product.
+        '''
+        return np.dot(np.asarray(vecs,dtype=float),self.A.T)
+
+    def srcToTgtArray(self,vecs):
+        '''
+        Same as srcToTgt for an array of vectors of shape (N,3) or a
+        stack of arrays (T,N,3), with one matrix product.
+        '''
+        return np.dot(np.asarray(vecs,dtype=float),self.invA.T)
+
+    def tgtToSrcSymmTensorArray(self,stens):
+        '''
+        Transformation A*T*A^T of an array of symmetric tensors T stored as
+        lines (N,6) or of a stack (T,N,6), from the target to the source
+        basis. The components are xx,xy,xz,yy,yz,zz.
+        '''
+        return _rotateSymmTensors(self.A,stens)
+
+    def srcToTgtSymmTensorArray(self,stens):
+        '''
+        Transformation invA*T*invA^T of an array of symmetric tensors T
+        stored as lines (N,6) or of a stack (T,N,6), from the source to the
+        target basis. The components are xx,xy,xz,yy,yz,zz.
+        '''
+        return _rotateSymmTensors(self.invA,stens)
+
+
+# index of the components of a symmTensor line in the 3x3 matrix, and of the
+# upper triangle of the 3x3 matrix in the line
+_symmToMat = np.array([[0,1,2],[1,3,4],[2,4,5]])
+_matToSymm = (np.array([0,0,0,1,1,2]),np.array([0,1,2,1,2,2]))
+
+def symmTensorToMat(stens):
+    '''
+    Convert symmetric tensors stored as lines (...,6) to matrices (...,3,3).
+    '''
+    return np.asarray(stens,dtype=float)[...,_symmToMat]
+
+def matToSymmTensor(mats):
+    '''
+    Convert symmetric matrices (...,3,3) to lines (...,6).
+    '''
+    return np.asarray(mats)[...,_matToSymm[0],_matToSymm[1]]
+
+def _rotateSymmTensors(R,stens):
+    '''
+    R*T*R^T for all the symmetric tensors T (...,6), with one einsum.
+    '''
+    mats = np.einsum('ij,...jk,lk->...il',R,symmTensorToMat(stens),R)
+    return matToSymmTensor(mats)
         
\ No newline at end of file
@@ -1,8 +1,75 @@
 import numpy as np
 import modred
-import scipy.signal as sp
 import h5py
 
+import pyFlowStat.Surface as sr
+import pyFlowStat.SurfaceFilter as sf
+
+def getSnapshotArray(surfaceList,subslice=None,stereo=True):
+    '''
+    Assemble the snapshot array of shape (N,nComp,surfY,surfX) from a list of
+    Surfaces or from a SurfaceTimeSeries. The array is allocated once and
+    filled from views of the velocity fields (no intermediate copy of the
+    frames).
+    
+    Arguments:
+        *surfaceList*: numpy array of Surfaces (N) or SurfaceTimeSeries.
+        
+        *subslice*: numpy index tuples, created wit np.s_, or rect object.
+         Region of interest. Default=None (full surface).
+         
+        *stereo*: python bool.
+         If True, use the 3 velocity components (nComp=3), else Ux and Uy
+         only (nComp=2). Default=True.
+         
+    Returns:
+        *FourD*: numpy array of shape (N,nComp,surfY,surfX).
+    '''
+    comps=getComponentViews(surfaceList,subslice,stereo)
+    if isinstance(surfaceList,sr.SurfaceTimeSeries):
+        FourD=np.empty((comps[0].shape[0],len(comps))+comps[0].shape[1:])
+        for c,comp in enumerate(comps):
+            FourD[:,c]=comp
+    else:
+        FourD=np.empty((len(surfaceList),len(comps))+comps[0].shape)
+        for i,s in enumerate(surfaceList):
+            for c,comp in enumerate(getComponentViews(s,subslice,stereo)):
+                FourD[i,c]=comp
+    return FourD
+
+def getComponentViews(source,subslice=None,stereo=True):
+    '''
+    Return the list of the velocity components [Ux,Uy(,Uz)] of source, a
+    Surface or a SurfaceTimeSeries, restricted to subslice. The components
+    are numpy views. If source is a list of Surfaces, the components of the
+    first Surface are returned.
+    '''
+    if isinstance(source,sr.SurfaceTimeSeries):
+        if subslice is not None:
+            source=source.getView(subslice)
+        comps=[source.vx,source.vy,source.vz]
+    else:
+        if not isinstance(source,sr.Surface):
+            source=source[0]
+        if isinstance(subslice,sr.rect):
+            subslice=subslice.getSlice(source)
+        comps=[source.data['Ux'],source.data['Uy'],source.data['Uz']]
+        if subslice is not None:
+            comps=[comp[subslice] for comp in comps]
+    if stereo:
+        return comps
+    else:
+        return comps[:2]
+
+def getNumberOfFrames(surfaceList):
+    '''
+    Return the number of frames of a list of Surfaces or of a
+    SurfaceTimeSeries.
+    '''
+    if isinstance(surfaceList,sr.SurfaceTimeSeries):
+        return len(surfaceList.vx)
+    return len(surfaceList)
+
 class POD(object):
     def __init__(self,vecs):
         '''
@@ -42,7 +109,8 @@ class POD(object):
         self.result['nMode']=nMode
         self.result['nSnap']=nSnap
         
-        if np.any(self.vecs):
+        # nan_to_num copies the snapshots, only call it if needed
+        if not np.all(np.isfinite(self.vecs)):
             self.vecs = np.nan_to_num(self.vecs)
         
         if subtractMean:
@@ -151,14 +219,11 @@ class PODPiv(POD):
     def __init__(self,surfaceList,subslice=None):
         '''
         Arguments:
-            *surfaceList*: numpy array of Surfaces (N).
+            *surfaceList*: numpy array of Surfaces (N) or SurfaceTimeSeries.
             *dt*: float, timestep
-            *subslice*: numpy index tuples, created wit np.s_
+            *subslice*: numpy index tuples, created wit np.s_, or rect object
         '''
-        if subslice is None:
-            FourD=np.array([[s.data['Ux'],s.data['Uy'],s.data['Uz']] for s in surfaceList])
-        else:
-            FourD=np.array([[s.data['Ux'][subslice],s.data['Uy'][subslice],s.data['Uz'][subslice]] for s in surfaceList])
+        FourD=getSnapshotArray(surfaceList,subslice=subslice,stereo=True)
         inputShape=FourD.shape
         vecs = FourD.reshape((inputShape[0],np.prod(inputShape[1:]))).T
         
@@ -248,7 +313,8 @@ class DMD(object):
         if nMode>nVecs:
             nMode=nVecs
         
-        if np.any(self.vecs):
+        # nan_to_num copies the snapshots, only call it if needed
+        if not np.all(np.isfinite(self.vecs)):
             self.vecs = np.nan_to_num(self.vecs)
         
         if subtractMean:
@@ -512,29 +578,15 @@ class DMDPiv(DMD):
     def __init__(self,surfaceList,dt,subslice=None,filter_kernel_size=0,stereo=True):
         '''
         Arguments:
-            *surfaceList*: numpy array of Surfaces (N).
+            *surfaceList*: numpy array of Surfaces (N) or SurfaceTimeSeries.
             *dt*: float, timestep
-            *subslice*: numpy index tuples, created wit np.s_
+            *subslice*: numpy index tuples, created wit np.s_, or rect object
         '''
-        
-        if subslice is None:
-            if stereo:
-                FourD=np.array([[s.data['Ux'],s.data['Uy'],s.data['Uz']] for s in surfaceList])
-            else:
-                FourD=np.array([[s.data['Ux'],s.data['Uy']] for s in surfaceList])
-        else:
-            if stereo:            
-                FourD=np.array([[s.data['Ux'][subslice],s.data['Uy'][subslice],s.data['Uz'][subslice]] for s in surfaceList])
-            else:
-                FourD=np.array([[s.data['Ux'][subslice],s.data['Uy'][subslice]] for s in surfaceList])
+        FourD=getSnapshotArray(surfaceList,subslice=subslice,stereo=stereo)
             
         if filter_kernel_size>0:
             print 'start smoothing'
-            for s in FourD:
-                s[0]=sp.medfilt(s[0],kernel_size=filter_kernel_size)
-                s[1]=sp.medfilt(s[1],kernel_size=filter_kernel_size)
-                if stereo:
-                    s[2]=sp.medfilt(s[2],kernel_size=filter_kernel_size)
+            FourD=sf.medianFilter(FourD,kernelSize=filter_kernel_size)
             print 'stop'
         inputShape=FourD.shape
         vecs = FourD.reshape((inputShape[0],np.prod(inputShape[1:]))).T
@@ -554,71 +606,41 @@ class DMDPivEnsemble(DMD):
     def __init__(self,surfaceList,dt,chunckLength,nChuncks=None,subslice=None,filter_kernel_size=0,stereo=True):
         '''
         Arguments:
-            *surfaceList*: numpy array of Surfaces (N).
+            *surfaceList*: numpy array of Surfaces (N) or SurfaceTimeSeries.
             *dt*: float, timestep
-            *subslice*: numpy index tuples, created wit np.s_
+            *subslice*: numpy index tuples, created wit np.s_, or rect object
         '''
-        if surfaceList==[]:
+        nFrames=getNumberOfFrames(surfaceList)
+        if nFrames==0:
             super(DMDPivEnsemble,self).__init__([],dt)
             return
         
         if nChuncks==None:
-            nChuncks=surfaceList.shape[0]//chunckLength
+            nChuncks=nFrames//chunckLength
         print nChuncks*chunckLength
-        print surfaceList.shape[0]
-        assert surfaceList.shape[0]>nChuncks*chunckLength
-        
-        s_shape=surfaceList[0].data['Ux'].shape
-        
-        
-        if subslice is None:
-            s_shape=surfaceList[0].data['Ux'].shape
-            if stereo:
-                nComp=3
-                FourD=np.zeros(shape=(chunckLength,nComp,nChuncks,s_shape[0],s_shape[1]))
-                for i in range(chunckLength):
-                    for k in range(nChuncks):
-                        s=surfaceList[k*chunckLength+i]
-                        FourD[i,0,k,:,:]=s.data['Ux']
-                        FourD[i,1,k,:,:]=s.data['Uy']
-                        FourD[i,2,k,:,:]=s.data['Uz']
-            else:
-                nComp=2
-                FourD=np.zeros(shape=(chunckLength,nComp,nChuncks,s_shape[0],s_shape[1]))
-                for i in range(chunckLength):
-                    for k in range(nChuncks):
-                        s=surfaceList[k*chunckLength+i]
-                        FourD[i,0,k,:,:]=s.data['Ux']
-                        FourD[i,1,k,:,:]=s.data['Uy']
+        print nFrames
+        assert nFrames>nChuncks*chunckLength
+        
+        comps=getComponentViews(surfaceList,subslice,stereo)
+        nComp=len(comps)
+        nUsed=nChuncks*chunckLength
+        if isinstance(surfaceList,sr.SurfaceTimeSeries):
+            s_shape=comps[0].shape[1:]
+            FourD=np.empty(shape=(chunckLength,nComp,nChuncks,s_shape[0],s_shape[1]))
+            # frame k*chunckLength+i goes to FourD[i,:,k]
+            for c,comp in enumerate(comps):
+                FourD[:,c]=comp[:nUsed].reshape((nChuncks,chunckLength)+s_shape).transpose((1,0,2,3))
         else:
-            s_shape=surfaceList[0].data['Ux'][subslice].shape
-            if stereo:
-                nComp=3
-                FourD=np.zeros(shape=(chunckLength,nComp,nChuncks,s_shape[0],s_shape[1]))
-                for i in range(chunckLength):
-                    for k in range(nChuncks):
-                        s=surfaceList[k*chunckLength+i]
-                        FourD[i,0,k,:,:]=s.data['Ux'][subslice]
-                        FourD[i,1,k,:,:]=s.data['Uy'][subslice]
-                        FourD[i,2,k,:,:]=s.data['Uz'][subslice]
-            else:
-                nComp=2
-                FourD=np.zeros(shape=(chunckLength,nComp,nChuncks,s_shape[0],s_shape[1]))
-                for i in range(chunckLength):
-                    for k in range(nChuncks):
-                        s=surfaceList[k*chunckLength+i]
-                        FourD[i,0,k,:,:]=s.data['Ux'][subslice]
-                        FourD[i,1,k,:,:]=s.data['Uy'][subslice]
-        '''    
+            s_shape=comps[0].shape
+            FourD=np.empty(shape=(chunckLength,nComp,nChuncks,s_shape[0],s_shape[1]))
+            for n in range(nUsed):
+                k,i=divmod(n,chunckLength)
+                for c,comp in enumerate(getComponentViews(surfaceList[n],subslice,stereo)):
+                    FourD[i,c,k]=comp
         if filter_kernel_size>0:
             print 'start smoothing'
-            for s in FourD:
-                s[0]=sp.medfilt(s[0],kernel_size=filter_kernel_size)
-                s[1]=sp.medfilt(s[1],kernel_size=filter_kernel_size)
-                if stereo:
-                    s[2]=sp.medfilt(s[2],kernel_size=filter_kernel_size)
+            FourD=sf.medianFilter(FourD,kernelSize=filter_kernel_size)
             print 'stop'
-        '''
         inputShape=FourD.shape
         vecs = FourD.reshape((inputShape[0],np.prod(inputShape[1:]))).T
 
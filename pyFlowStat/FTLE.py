@@ -0,0 +1,346 @@
+'''
+FTLE.py
+
+Finite-time Lyapunov exponent (FTLE) fields of a time resolved
+SurfaceTimeSeries, for the detection of Lagrangian coherent structures.
+
+The particles seeded on the cell centers of the grid (Surface.getMeshgrid) are
+advected with a 4th order Runge-Kutta scheme through the velocity fields,
+which are interpolated (bilinear in space, linear in time) for all the
+particles at once. The advection between two consecutive frames gives the
+one-step flow maps of the grid. They are computed once and cached: the flow
+map of any window is the composition of the one-step maps of its frames, so
+that sliding windows (FTLE time series) reuse the integration of the
+overlapping frames. The windows can be composed in a process pool: the
+one-step maps are written once to a temporary numpy.memmap read by the
+processes, and only the indices of the maps of a window are sent to them.
+'''
+
+#=============================================================================#
+# load modules
+#=============================================================================#
+import os
+import tempfile
+import multiprocessing
+
+#scientific modules
+import numpy as np
+
+import pyFlowStat.Surface as sr
+
+
+class FTLE(object):
+    '''
+    FTLE of a time resolved SurfaceTimeSeries.
+
+    The positions are in the unit of the grid (mm), the velocity in m/s and
+    the time step sts.data['dt'] in s, as in the other pyFlowStat classes.
+    A positive number of steps gives the forward FTLE (repelling
+    structures), a negative one the backward FTLE (attracting structures).
+    Particles leaving the field of view (or reaching a NaN velocity) are NaN.
+
+    Usage:
+        >>> ftle = FTLE(sts,subSteps=2)
+        >>> f = ftle.computeFTLE(seedFrame=100,nSteps=-50)
+        >>> fSeries = ftle.computeSlidingFTLE(range(50,1000),nSteps=-50,nProcs=4)
+    '''
+
+    # constructors #
+    #--------------#
+    def __init__(self,sts,subSteps=1):
+        '''
+        base constructor.
+
+        Arguments:
+            *sts*: SurfaceTimeSeries object.
+             Time resolved velocity fields, with the time step in
+             sts.data['dt'].
+
+            *subSteps*: python int.
+             Number of Runge-Kutta steps between two frames. Default=1.
+        '''
+        self.sts = sts
+        self.subSteps = subSteps
+        self.dt = sts.data['dt']
+        self.nFrames = len(sts.vx)
+        self.dx = sts.dx
+        self.dy = sts.dy
+        self.minX = sts.minX
+        self.maxY = sts.maxY
+        self.X,self.Y = getSeedGrid(sts)
+
+        # one-step flow maps, key (frame,direction)
+        self.stepMaps = dict()
+
+
+    # class methods #
+    #---------------#
+    def velocity(self,x,y,frame,alpha):
+        '''
+        Velocity (m/s) at the positions x,y, at the time
+        (frame+alpha)*dt, alpha in [0,1] (linear interpolation in time).
+        '''
+        frames = [int(frame)]
+        if alpha>0.0:
+            frames.append(int(frame)+1)
+        uv = []
+        for f in frames:
+            uv.append(bilinear(np.array([self.sts.vx[f],self.sts.vy[f]]),x,y,self.minX,self.maxY,self.dx,self.dy))
+        if alpha>0.0:
+            return (1.0-alpha)*uv[0]+alpha*uv[1]
+        return uv[0]
+
+    def advect(self,x,y,frame,direction=1):
+        '''
+        Advect particles from frame to frame+direction with subSteps
+        Runge-Kutta (RK4) steps.
+
+        Arguments:
+            *x*, *y*: numpy arrays (any shape).
+             Positions of the particles at frame.
+
+            *frame*: python int.
+
+            *direction*: python int.
+             1 (forward) or -1 (backward). Default=1.
+
+        Returns:
+            *x*, *y*: positions at frame+direction.
+        '''
+        # the time of the step is measured from the earliest frame
+        f0 = min(frame,frame+direction)
+        h = direction*self.dt/self.subSteps
+        # velocity in m/s, positions in mm
+        k = h*1000.0
+        pos = np.array([x,y],dtype=float)
+        for s in range(self.subSteps):
+            a = float(s)/self.subSteps
+            if direction<0:
+                a = 1.0-a
+            da = float(direction)/self.subSteps
+            k1 = self.velocity(pos[0],pos[1],f0,a)
+            p = pos+0.5*k*k1
+            k2 = self.velocity(p[0],p[1],f0,a+0.5*da)
+            p = pos+0.5*k*k2
+            k3 = self.velocity(p[0],p[1],f0,a+0.5*da)
+            p = pos+k*k3
+            k4 = self.velocity(p[0],p[1],f0,a+da)
+            pos = pos+k/6.0*(k1+2.0*k2+2.0*k3+k4)
+        return pos[0],pos[1]
+
+    def getStepMap(self,frame,direction=1):
+        '''
+        One-step flow map of the seed grid, from frame to frame+direction.
+        Computed once and cached.
+
+        Returns:
+            *map*: numpy array of shape (2,ny,nx). Positions x,y at
+             frame+direction of the particles seeded at the cell centers.
+        '''
+        key = (frame,direction)
+        if key not in self.stepMaps:
+            self.stepMaps[key] = np.array(self.advect(self.X,self.Y,frame,direction))
+        return self.stepMaps[key]
+
+    def computeStepMaps(self,start,stop,direction=1):
+        '''
+        Compute and cache the one-step flow maps of the frames start:stop.
+        '''
+        for frame in range(start,stop):
+            self.getStepMap(frame,direction)
+
+    def flowMap(self,seedFrame,nSteps):
+        '''
+        Flow map of the seed grid from seedFrame to seedFrame+nSteps,
+        composition of the cached one-step flow maps.
+
+        Returns:
+            *map*: numpy array of shape (2,ny,nx).
+        '''
+        direction,frames = self._windowFrames(seedFrame,nSteps)
+        maps = [self.getStepMap(f,direction) for f in frames]
+        return composeFlowMaps(maps,self.minX,self.maxY,self.dx,self.dy)
+
+    def computeFTLE(self,seedFrame,nSteps):
+        '''
+        FTLE field (1/s) of the particles seeded at seedFrame and integrated
+        over nSteps frames (nSteps<0: backward FTLE).
+
+        Returns:
+            *ftle*: numpy array of shape (ny,nx).
+        '''
+        return ftleFromFlowMap(self.flowMap(seedFrame,nSteps),self.dx,self.dy,abs(nSteps)*self.dt)
+
+    def computeSlidingFTLE(self,seedFrames,nSteps,nProcs=1):
+        '''
+        FTLE fields of a list of seed frames (sliding window of nSteps
+        frames). The one-step flow maps of all the windows are computed once
+        and removed from the cache (stepMaps) when no remaining window uses
+        them. With nProcs>1, the maps are stored in a temporary
+        numpy.memmap and the windows are composed in a pool of nProcs
+        processes.
+
+        Arguments:
+            *seedFrames*: python list of int.
+
+            *nSteps*: python int.
+             Length of the windows (nSteps<0: backward FTLE).
+
+            *nProcs*: python int.
+             Number of processes. Default=1.
+
+        Returns:
+            *ftle*: numpy array of shape (len(seedFrames),ny,nx).
+        '''
+        windows = [self._windowFrames(seed,nSteps) for seed in seedFrames]
+        T = abs(nSteps)*self.dt
+        # last window using each one-step map
+        lastUse = dict()
+        for w,(direction,frames) in enumerate(windows):
+            for f in frames:
+                lastUse[(f,direction)] = w
+
+        if nProcs<=1 or len(windows)==0:
+            res = []
+            for w,(direction,frames) in enumerate(windows):
+                maps = [self.getStepMap(f,direction) for f in frames]
+                res.append(ftleFromFlowMap(composeFlowMaps(maps,self.minX,self.maxY,self.dx,self.dy),self.dx,self.dy,T))
+                for f in frames:
+                    if lastUse[(f,direction)]==w:
+                        del self.stepMaps[(f,direction)]
+            return np.array(res)
+
+        keys = sorted(lastUse.keys())
+        index = dict([(key,i) for i,key in enumerate(keys)])
+        shape = (len(keys),2)+self.X.shape
+        fd,path = tempfile.mkstemp(suffix='.dat')
+        os.close(fd)
+        try:
+            maps = np.memmap(path,dtype=float,mode='w+',shape=shape)
+            for key in keys:
+                if key in self.stepMaps:
+                    maps[index[key]] = self.stepMaps.pop(key)
+                else:
+                    maps[index[key]] = self.advect(self.X,self.Y,key[0],key[1])
+            maps.flush()
+            del maps
+            tasks = [[index[(f,direction)] for f in frames] for direction,frames in windows]
+            pool = multiprocessing.Pool(nProcs,
+                                        initializer=_initFTLEWorker,
+                                        initargs=(path,shape,self.minX,self.maxY,self.dx,self.dy,T))
+            try:
+                res = pool.map(_ftleWindow,tasks)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            os.remove(path)
+        return np.array(res)
+
+    def _windowFrames(self,seedFrame,nSteps):
+        '''
+        Direction and ordered list of the frames of the one-step maps of a
+        window.
+        '''
+        if nSteps==0:
+            raise ValueError('nSteps must not be 0.')
+        if seedFrame+nSteps<0 or seedFrame+nSteps>self.nFrames-1 or seedFrame<0 or seedFrame>self.nFrames-1:
+            raise ValueError('window '+str(seedFrame)+' to '+str(seedFrame+nSteps)+
+                             ' is outside of the '+str(self.nFrames)+' frames.')
+        if nSteps>0:
+            return 1,range(seedFrame,seedFrame+nSteps)
+        return -1,range(seedFrame,seedFrame+nSteps,-1)
+
+
+#=============================================================================#
+# functions
+#=============================================================================#
+def getSeedGrid(grid):
+    '''
+    Cell centers X,Y (Surface.getMeshgrid) of the grid of a Surface or a
+    SurfaceTimeSeries.
+    '''
+    s = sr.Surface()
+    s.dx = grid.dx
+    s.dy = grid.dy
+    s.minX = grid.minX
+    s.maxX = grid.maxX
+    s.minY = grid.minY
+    s.maxY = grid.maxY
+    return s.getMeshgrid()
+
+def bilinear(fields,x,y,minX,maxY,dx,dy):
+    '''
+    Bilinear interpolation of fields of shape (n,ny,nx) (Surface orientation)
+    at the positions x,y (arrays of any shape). NaN outside of the grid.
+
+    Returns:
+        *res*: numpy array of shape (n,)+x.shape.
+    '''
+    ny,nx = fields.shape[-2:]
+    col = (np.asarray(x,dtype=float)-minX)/dx
+    row = (maxY-np.asarray(y,dtype=float))/dy
+    with np.errstate(invalid='ignore'):
+        outside = ~((col>=0) & (col<=nx-1) & (row>=0) & (row<=ny-1))
+    col = np.where(outside,0.0,col)
+    row = np.where(outside,0.0,row)
+    j0 = np.minimum(np.floor(col).astype(int),max(nx-2,0))
+    i0 = np.minimum(np.floor(row).astype(int),max(ny-2,0))
+    tx = col-j0
+    ty = row-i0
+    j1 = np.minimum(j0+1,nx-1)
+    i1 = np.minimum(i0+1,ny-1)
+    res = ((1.0-ty)*((1.0-tx)*fields[:,i0,j0]+tx*fields[:,i0,j1])
+           +ty*((1.0-tx)*fields[:,i1,j0]+tx*fields[:,i1,j1]))
+    res[:,outside] = np.nan
+    return res
+
+def composeFlowMaps(maps,minX,maxY,dx,dy):
+    '''
+    Composition of one-step flow maps (list of arrays of shape (2,ny,nx), in
+    the order of the integration). The positions reached after each step are
+    located in the next map by bilinear interpolation.
+    '''
+    pos = maps[0]
+    for m in maps[1:]:
+        pos = bilinear(m,pos[0],pos[1],minX,maxY,dx,dy)
+    return pos
+
+def ftleFromFlowMap(flowMap,dx,dy,T):
+    '''
+    FTLE field from a flow map of shape (2,ny,nx) over the time T (s):
+        ftle = log(sqrt(lambdaMax(C)))/T
+    with C the right Cauchy-Green tensor of the flow map gradient.
+    '''
+    dXdy,dXdx = np.gradient(flowMap[0],-dy,dx)
+    dYdy,dYdx = np.gradient(flowMap[1],-dy,dx)
+    C11 = dXdx**2+dYdx**2
+    C12 = dXdx*dXdy+dYdx*dYdy
+    C22 = dXdy**2+dYdy**2
+    tr = C11+C22
+    det = C11*C22-C12**2
+    with np.errstate(invalid='ignore',divide='ignore'):
+        lamMax = 0.5*(tr+np.sqrt(np.maximum(tr**2-4.0*det,0.0)))
+        return np.log(np.sqrt(lamMax))/T
+
+def _initFTLEWorker(path,shape,minX,maxY,dx,dy,T):
+    '''
+    Initializer of the processes of FTLE.computeSlidingFTLE: opens the
+    memmap of the one-step maps (read-only) once per process.
+    '''
+    _ftleWorker['maps'] = np.memmap(path,dtype=float,mode='r',shape=shape)
+    _ftleWorker['args'] = (minX,maxY,dx,dy,T)
+
+def _ftleWindow(indices):
+    '''
+    FTLE of one window, from the indices of its one-step maps in the memmap
+    of the process (see _initFTLEWorker). Module level function, usable by
+    a process pool.
+    '''
+    minX,maxY,dx,dy,T = _ftleWorker['args']
+    maps = [_ftleWorker['maps'][i] for i in indices]
+    return ftleFromFlowMap(composeFlowMaps(maps,minX,maxY,dx,dy),dx,dy,T)
+
+
+# one-step maps and grid of a worker process of FTLE.computeSlidingFTLE
+_ftleWorker = dict()
@@ -3,35 +3,37 @@ import numpy as np
 def sortNumStrList(numStrList,minVal=None,maxVal=None,step=1):
     '''
     Sort a list of number stored as a list of string. StrNumList is the list of
-    number as string.
+    number as string. The strings which are not a number are ignored.
     
     Arguments:
-        *numStrList*
+        *numStrList*: python list of string.
+        
+        *minVal*, *maxVal*: python float.
+         Keep only the numbers in [minVal,maxVal]. No limit if None.
+         Default=None.
+         
+        *step*: python int.
+         Keep one number out of step, after sorting and filtering.
+         Default=1.
+         
+    Returns:
+        *numStrList_sort*: python list of string.
     '''
-    #tsListNum=[]
-    if len(numStrList)==1:
-        return numStrList
-    numFltList = []
-    for nb in numStrList:
-        if is_number(nb)==True:
-            numFltList.append(float(nb))
-    numFltList = np.array(numFltList)
-    numStrList_idx = np.argsort(numFltList)
-    #numFltList_sorted = np.sort(numFltList)
+    numStrList = [nb for nb in numStrList if is_number(nb)==True]
+    numFltList = np.array([float(nb) for nb in numStrList])
+    numStrList_idx = np.argsort(numFltList,kind='mergesort')
     
-    if minVal and maxVal:
-        numStrList_idx_filt=[]
-        for idx in numStrList_idx:
-            f=numFltList[idx]
-            if f>=minVal and f<=maxVal:
-                numStrList_idx_filt.append(idx)
-    else:
-        numStrList_idx_filt=numStrList_idx
+    keep = np.ones(len(numStrList_idx),dtype=bool)
+    if minVal is not None:
+        keep = keep & (numFltList[numStrList_idx]>=minVal)
+    if maxVal is not None:
+        keep = keep & (numFltList[numStrList_idx]<=maxVal)
+    numStrList_idx_filt = numStrList_idx[keep]
     
     if not step:
-        step=1.0
+        step=1
     
-    numStrList_sort = [numStrList[idx] for idx in numStrList_idx_filt][::step]
+    numStrList_sort = [numStrList[idx] for idx in numStrList_idx_filt][::int(step)]
     return numStrList_sort
 
 
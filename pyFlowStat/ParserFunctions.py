@@ -6,8 +6,12 @@ Collection of parser for pyFlowStat.
 Import of pyFlowStat classes is not allowed in the file!
 '''
 
-import numpy as np
+import io
+import os
 import re
+from collections import OrderedDict
+
+import numpy as np
 
 
 def parseFoamFile_sampledSurface(foamFile):
@@ -41,10 +45,17 @@ def parseFoamFile_sampledSurface(foamFile):
         * for a list of constant vector v:
             N{(vx vy vz)}
     
+    The file is read at once. The header "FoamFile{...}" and the c++ comments
+    before the list are optional. The body of an ASCII list is converted in
+    one call of numpy.fromstring, after the parenthesis are replaced by
+    spaces. If the header defines "format binary", the body of the list of
+    scalars, vectors, symmTensors or tensors (or labels) is read without
+    copy with numpy.frombuffer (see getFoamBinaryType).
+    
     Note:
-        * It's a primitiv parser, do not add header in your foamFile!
-        * Inline comment are allowed only from line start. c++ comment style.
-        * It's REALLY a primitive parser!!!
+        * A list of faces, as "3(p0 p1 p2)", is returned with the size of
+          each face in the first column: shape=(N,4) for triangles.
+        * A binary list of faces is not supported.
         
     Arguments:
         *foamFile*: python string
@@ -52,37 +63,155 @@ def parseFoamFile_sampledSurface(foamFile):
 
     Returns:
         *output*: numpy array
-         Data store in foamFile.
-    '''
-    output = []
-    catchFirstNb = False
-    istream = open(foamFile, 'r')
-    for line in istream: 
-        # This regex finds all numbers in a given string.
-        # It can find floats and integers writen in normal mode (10000) or
-        # with power of 10 (10e3).
-        match = re.findall('[-+]?\d*\.?\d+e*[-+]?\d*', line)
-        if (line.startswith('//')):
-            pass
-        # chatch the firt number and it is alone: non constant field (normal case)
-        if (catchFirstNb==False and len(match)==1):
-            catchFirstNb = True
-        # chatch the firt number and it is NOT alone: the field is constant and only one line is write in the file (OF standard)
-        elif (catchFirstNb==False and len(match)>1):   
-            catchFirstNb = True
-            matchfloat = [float(nb) for nb in match]
-            output = [matchfloat[1:]  for i in range(int(matchfloat[0])) ]
-        # catch the remainding numbers
-        elif (catchFirstNb==True and len(match)>0):
-            matchfloat = [float(nb) for nb in match]
-            if len(matchfloat)==1:
-                output.append(matchfloat[0])
-            else:
-                output.append(matchfloat)
+         Data store in foamFile. Shape=(N,) for scalars, (N,d) otherwise.
+    '''
+    istream = io.open(foamFile,'rb')
+    try:
+        data = bytearray(os.fstat(istream.fileno()).st_size)
+        n = istream.readinto(data)
+    finally:
+        istream.close()
+    del data[n:]
+    return parseFoamList(data)
+
+
+def parseFoamList(data):
+    '''
+    Parse the content of a foamFile holding a list (see
+    parseFoamFile_sampledSurface). Binary lists (header "format binary")
+    must have a class with contiguous elements (see getFoamBinaryType), for
+    example a labelList, scalarField or vectorField: a ValueError is raised
+    for the other classes (faceList...) or if the size of the binary data
+    does not match the list.
+    
+    Arguments:
+        *data*: python bytearray or bytes.
+         Content of the foamFile.
+         
+    Returns:
+        *output*: numpy array
+    '''
+    header,offset = parseFoamHeader(data)
+    match = _foamListStart.search(data,offset)
+    if match==None:
+        raise ValueError('No list "N(" or "N{" found in the foamFile.')
+    N = int(match.group(1))
+    start = match.end()
+    binary = header.get('format','ascii')=='binary'
+    if binary:
+        dtype,nComp = getFoamBinaryType(header)
+        if nComp==None:
+            raise ValueError('Unsupported binary list of class "'+header.get('class','')+
+                             '" in the foamFile.')
+        nBytes = nComp*dtype.itemsize
+    
+    # uniform list N{value}
+    if match.group(2)==b'{':
+        if binary:
+            if data[start+nBytes:start+nBytes+1]!=b'}':
+                raise ValueError('The uniform value of the binary list does not have '
+                                 +str(nBytes)+' bytes.')
+            value = np.frombuffer(data,dtype=dtype,count=nComp,offset=start).astype(float)
         else:
-            pass
-    istream.close()
-    return np.array(output)
+            end = data.find(b'}',start)
+            value = _parseFoamAscii(data[start:end])
+        if value.size==1:
+            return value[0]*np.ones(N)
+        return np.tile(value,(N,1))
+        
+    if N==0:
+        return np.array([])
+        
+    # binary list N(...)
+    if binary:
+        if data.rfind(b')')-start!=N*nBytes:
+            raise ValueError('The binary list does not have '+str(N)+' elements of '
+                             +str(nBytes)+' bytes.')
+        output = np.frombuffer(data,dtype=dtype,count=N*nComp,offset=start)
+        if nComp==1:
+            return output
+        return output.reshape(N,nComp)
+        
+    # ascii list N(...)
+    end = data.rfind(b')')
+    output = _parseFoamAscii(data[start:end])
+    nComp = output.size//N
+    if nComp*N!=output.size:
+        raise ValueError('The '+str(N)+' elements of the list do not have '
+                         'the same number of components.')
+    if nComp==1:
+        return output
+    return output.reshape(N,nComp)
+    
+    
+def parseFoamHeader(data):
+    '''
+    Parse the header "FoamFile{key value; ...}" of the content of a foamFile.
+    
+    Arguments:
+        *data*: python bytearray or bytes.
+         Content of the foamFile.
+         
+    Returns:
+        *header*: python dict.
+         Entries of the header (strings). Empty if there is no header.
+         
+        *offset*: python int.
+         Position of the end of the header in data.
+    '''
+    match = _foamHeaderStart.search(data)
+    if match==None:
+        return dict(),0
+    end = data.find(b'}',match.end())
+    header = dict()
+    for key,value in _foamHeaderEntry.findall(bytes(data[match.end():end])):
+        header[key.decode('ascii')] = value.strip().strip(b'"').decode('ascii')
+    return header,end+1
+    
+    
+def getFoamBinaryType(header):
+    '''
+    Numpy dtype and number of components of a binary list, from the class and
+    the arch entries of the foamFile header. The default arch is
+    "LSB;label=32;scalar=64".
+    
+    Returns:
+        *dtype*: numpy dtype.
+        
+        *nComp*: python int, or None if the class is unknown.
+    '''
+    arch = header.get('arch','')
+    endian = '>' if 'MSB' in arch else '<'
+    labelSize = 8 if 'label=64' in arch else 4
+    scalarSize = 4 if 'scalar=32' in arch else 8
+    cls = header.get('class','')
+    if cls.startswith('label'):
+        return np.dtype(endian+'i'+str(labelSize)),1
+    nComp = None
+    for prefix,n in [('scalar',1),('vector',3),('symmTensor',6),
+                     ('sphericalTensor',1),('tensor',9)]:
+        if cls.startswith(prefix):
+            nComp = n
+            break
+    return np.dtype(endian+'f'+str(scalarSize)),nComp
+    
+    
+def _parseFoamAscii(body):
+    '''
+    Convert the body of an ASCII list to a 1D numpy array, the parenthesis
+    being ignored.
+    '''
+    return np.fromstring(bytes(body).translate(_parenthesisToSpace),sep=' ')
+
+
+# regex and translation table of the foamFile parser
+_foamHeaderStart = re.compile(br'FoamFile\s*\{')
+_foamHeaderEntry = re.compile(br'(\w+)\s+([^;]*);')
+_foamListStart = re.compile(br'^[ \t]*(\d+)\s*([({])',re.MULTILINE)
+_parenthesisTable = bytearray(range(256))
+_parenthesisTable[ord('(')] = ord(' ')
+_parenthesisTable[ord(')')] = ord(' ')
+_parenthesisToSpace = bytes(_parenthesisTable)
    
    
 def parseVTK_ugly_sampledSurface(vtkfile):
@@ -91,9 +220,8 @@ def parseVTK_ugly_sampledSurface(vtkfile):
     surface has N grid points and M triangles. The data stored at each grid
     points has a dimension D.
     
-    Warnings: This is a VERY primitive and ugly parser!! the python-to-vtk
-    binding should be used instead of the following shitty code! 
-    Nevertheless, this shit works :-)!!
+    Kept for compatibility, only the first POINT_DATA array is returned. Use
+    parseVTK_sampledSurface to get all the fields.
     
     Arguments:
         *vtkfile*: python string
@@ -110,83 +238,305 @@ def parseVTK_ugly_sampledSurface(vtkfile):
         *pointData* numpy array of shape (N,D)
          List of data associate with each point of the grid.
     '''
-    pointsOut = []
-    polyOut = []
-    pointDataOut = []
+    points, polygons, pointData, cellData = parseVTK_sampledSurface(vtkfile)
+    return points, polygons, getVTKField(pointData)
     
-    istream = open(vtkfile, 'r')
-    line = istream.readline()
-
-    # catch the begin of the list of points
-    # -------------------------------------
-    catchLine = False
-    while catchLine==False:
-        if (line.startswith('DATASET POLYDATA')):
-            catchLine = True
-        line = istream.readline()
-        
-    # catch the number of points
-    nbpoints = int(re.findall('[-+]?\d*\.?\d+e*[-+]?\d*', line)[0])
-    pti = 0
-    line = istream.readline()
-    
-    #store the points in pointsOut
-    while (pti<nbpoints):
-        match = re.findall('[-+]?\d*\.?\d+e*[-+]?\d*', line)
-        pointsOut.append(match)
-        line = istream.readline()
-        pti = pti+1
-    pointsOut = np.asarray(pointsOut,dtype=float)
-    
-    # catch the begin of the list of polygons and the number of polygon
-    # -----------------------------------------------------------------
-    catchLine = False
-    nbpoly = 0
-    while catchLine==False:
-        if (line.startswith('POLYGONS')):
-            catchLine = True
-            nbpoly = int(re.findall('[-+]?\d*\.?\d+e*[-+]?\d*', line)[0])
-        line = istream.readline()
-    polyi = 0
-    
-    #store the polygons in polyOut
-    while polyi<nbpoly:
-        match = re.findall('[-+]?\d*\.?\d+e*[-+]?\d*', line)
-        polyOut.append(match[1:])
-        line = istream.readline()
-        polyi = polyi+1
-    polyOut = np.asarray(polyOut,dtype=float)
-    
-    # catch the begin of the list of point data
-    # -----------------------------------------
-    catchLine = False
-    nbptdata = 0
-    while catchLine==False:
-        if (line.startswith('POINT_DATA')):
-            catchLine = True
-            nbptdata = int(re.findall('[-+]?\d*\.?\d+e*[-+]?\d*', line)[0])
-        line = istream.readline()
-    ptdatai = 0
-    
-    # jump the line starting with "FIELD attributes"
-    line = istream.readline()
-    
-    # catch the dimension of point data and the number of point data
-    match = re.findall('[-+]?\d*\.?\d+e*[-+]?\d*', line)
-    dimptdata = int(match[0])
-    line = istream.readline()
-    
-    #store the point data in pointDataOut
-    if dimptdata==1:
-        pointDataOut = re.findall('[-+]?\d*\.?\d+e*[-+]?\d*', line)
-    else: 
-        while ptdatai<nbptdata:
-            match = re.findall('[-+]?\d*\.?\d+e*[-+]?\d*', line)
-            pointDataOut.append(match)
-            line = istream.readline()
-            ptdatai = ptdatai+1
-    pointDataOut = np.asarray(pointDataOut,dtype=float)
-    
-    istream.close()
-    
-    return pointsOut, polyOut, pointDataOut
+    
+def parseVTK_sampledSurface(vtkfile,cache=True):
+    '''
+    Parse a legacy VTK file (ASCII or binary) generated by the surface
+    sampling tool of OpenFOAM. The surface has N grid points and M polygons.
+    The file is read at once and parsed in one pass: the POINTS, the
+    POLYGONS and all the arrays of the POINT_DATA and CELL_DATA sections
+    (FIELD, SCALARS, VECTORS, NORMALS and TENSORS) are converted with one
+    numpy.fromstring (ASCII) or numpy.frombuffer (big-endian binary) call
+    each.
+    
+    The results are cached (see vtkCacheSize), so that the mesh and the
+    fields of the same file are read only once, for example by
+    TriSurfaceMesh.readFromVTK and TriSurfaceVector.readFromVTK. The cached
+    arrays are read-only and the returned arrays are copies of them, which
+    the caller can modify. A file modified since it was cached is read
+    again.
+    
+    Arguments:
+        *vtkfile*: python string
+         Path to the vtk file
+         
+        *cache*: python bool
+         Use and fill the cache. Default=True.
+         
+    Returns:
+        *points*: numpy array of shape (N,3)
+         List of points composing the grid.
+         
+        *polygons*: numpy array of shape (M,K)
+         List of polygons (triangles: K=3). All the polygons must have the
+         same number of points.
+ 
+        *pointData*: python OrderedDict
+         Arrays of the POINT_DATA section, with the shape (N,) for a scalar
+         and (N,D) otherwise, in the order of the file.
+         
+        *cellData*: python OrderedDict
+         Arrays of the CELL_DATA section, with the shape (M,) or (M,D).
+    '''
+    key = None
+    if cache==True:
+        st = os.stat(vtkfile)
+        key = (os.path.abspath(vtkfile),st.st_mtime,st.st_size)
+        if key in _vtkCache:
+            # move the entry to the end (most recently used)
+            res = _vtkCache.pop(key)
+            _vtkCache[key] = res
+            return _copyVTKResult(res)
+            
+    istream = io.open(vtkfile,'rb')
+    try:
+        data = bytearray(os.fstat(istream.fileno()).st_size)
+        n = istream.readinto(data)
+    finally:
+        istream.close()
+    del data[n:]
+    res = parseVTK(data)
+    
+    if cache==True:
+        for arr in [res[0],res[1]]+list(res[2].values())+list(res[3].values()):
+            if arr is not None:
+                arr.flags.writeable = False
+        _vtkCache[key] = res
+        while len(_vtkCache)>max(vtkCacheSize,0):
+            _vtkCache.popitem(last=False)
+        return _copyVTKResult(res)
+    return res
+    
+    
+def parseVTK(data):
+    '''
+    Parse the content of a legacy VTK file of POLYDATA. See
+    parseVTK_sampledSurface. The FIELD block of the dataset (e.g. the
+    TimeValue written by OpenFOAM before the POINTS) is skipped.
+    
+    Arguments:
+        *data*: python bytearray or bytes.
+         Content of the VTK file.
+         
+    Returns:
+        *points*, *polygons*, *pointData*, *cellData*
+    '''
+    pos = 0
+    line,pos = _nextLine(data,pos)
+    if not line.startswith('# vtk'):
+        raise ValueError('Not a legacy VTK file.')
+    title,pos = _nextLine(data,pos)
+    fmt,pos = _nextLine(data,pos)
+    binary = fmt.strip().upper()=='BINARY'
+    
+    points = None
+    polygons = None
+    pointData = OrderedDict()
+    cellData = OrderedDict()
+    # dataset attributes (FIELD before POINT_DATA/CELL_DATA), not returned
+    fieldData = OrderedDict()
+    current = fieldData
+    nTuples = 0
+    while pos<len(data):
+        line,pos = _nextLine(data,pos)
+        words = line.split()
+        if len(words)==0:
+            continue
+        keyword = words[0].upper()
+        if keyword=='DATASET':
+            if words[1].upper()!='POLYDATA':
+                raise ValueError('Unsupported VTK dataset "'+words[1]+'".')
+        elif keyword=='POINTS':
+            n = int(words[1])
+            arr,pos = _readVTKArray(data,pos,3*n,words[2],binary)
+            points = arr.reshape(n,3)
+        elif keyword in ['POLYGONS','LINES','VERTICES','TRIANGLE_STRIPS']:
+            nCells = int(words[1])
+            size = int(words[2])
+            nextLine,nextPos = _nextLine(data,pos)
+            if nextLine.startswith('OFFSETS'):
+                # file format 5.x: nCells is the number of offsets
+                offsets,pos = _readVTKArray(data,nextPos,nCells,nextLine.split()[1],binary)
+                line,pos = _nextLine(data,pos)
+                conn,pos = _readVTKArray(data,pos,size,line.split()[1],binary)
+                cells = _cellsFromOffsets(offsets,conn)
+            else:
+                arr,pos = _readVTKArray(data,pos,size,'int',binary)
+                cells = _cellsFromLegacy(arr,nCells)
+            if keyword=='POLYGONS':
+                polygons = cells
+        elif keyword=='POINT_DATA':
+            current = pointData
+            nTuples = int(words[1])
+        elif keyword=='CELL_DATA':
+            current = cellData
+            nTuples = int(words[1])
+        elif keyword=='FIELD':
+            for i in range(int(words[2])):
+                line,pos = _nextLine(data,pos)
+                while len(line.split())==0:
+                    line,pos = _nextLine(data,pos)
+                name,nComp,nT,vtkType = line.split()[:4]
+                arr,pos = _readVTKArray(data,pos,int(nComp)*int(nT),vtkType,binary)
+                current[name] = _shapeVTKArray(arr,int(nT),int(nComp))
+        elif keyword=='SCALARS':
+            nComp = 1
+            if len(words)>3:
+                nComp = int(words[3])
+            line,nextPos = _nextLine(data,pos)
+            if line.startswith('LOOKUP_TABLE'):
+                pos = nextPos
+            arr,pos = _readVTKArray(data,pos,nComp*nTuples,words[2],binary)
+            current[words[1]] = _shapeVTKArray(arr,nTuples,nComp)
+        elif keyword in ['VECTORS','NORMALS','TENSORS']:
+            nComp = 9 if keyword=='TENSORS' else 3
+            arr,pos = _readVTKArray(data,pos,nComp*nTuples,words[2],binary)
+            current[words[1]] = _shapeVTKArray(arr,nTuples,nComp)
+        elif keyword=='LOOKUP_TABLE':
+            # color table, ignored
+            vtkType = 'unsigned_char' if binary else 'float'
+            arr,pos = _readVTKArray(data,pos,4*int(words[2]),vtkType,binary)
+        elif keyword=='METADATA':
+            # ignored until the next empty line
+            while pos<len(data) and len(line.split())>0:
+                line,pos = _nextLine(data,pos)
+        else:
+            raise ValueError('Unsupported VTK keyword "'+words[0]+'".')
+    return points, polygons, pointData, cellData
+    
+    
+def getVTKField(fields,name=None):
+    '''
+    Get the array "name" of the dict of fields returned by
+    parseVTK_sampledSurface. If name is None, the first array is returned.
+    '''
+    if len(fields)==0:
+        raise ValueError('The VTK file holds no data array.')
+    if name==None:
+        return list(fields.values())[0]
+    if name not in fields:
+        raise ValueError('No array "'+str(name)+'" in the VTK file. Arrays: '
+                         +', '.join(fields.keys()))
+    return fields[name]
+    
+    
+def clearVTKCache():
+    '''
+    Empty the cache of parseVTK_sampledSurface.
+    '''
+    _vtkCache.clear()
+    
+    
+def _copyVTKResult(res):
+    '''
+    Writable copies of the (read-only) cached result of parseVTK.
+    '''
+    points,polygons,pointData,cellData = res
+    if points is not None:
+        points = points.copy()
+    if polygons is not None:
+        polygons = polygons.copy()
+    pointData = OrderedDict([(k,v.copy()) for k,v in pointData.items()])
+    cellData = OrderedDict([(k,v.copy()) for k,v in cellData.items()])
+    return points,polygons,pointData,cellData
+    
+    
+def _nextLine(data,pos):
+    '''
+    Line of data starting at pos (python string) and position of the next
+    line.
+    '''
+    end = data.find(b'\n',pos)
+    if end<0:
+        end = len(data)
+    return bytes(data[pos:end]).decode('ascii','replace').strip(),end+1
+    
+    
+def _readVTKArray(data,pos,count,vtkType,binary):
+    '''
+    Read an array of count values of type vtkType starting at pos. An ASCII
+    array ends at the next line starting with a keyword (or an array name).
+    Returns the 1D numpy array and the position after the array.
+    '''
+    vtkType = vtkType.lower()
+    if vtkType not in _vtkTypes:
+        raise ValueError('Unsupported VTK data type "'+vtkType+'".')
+    dtype = np.dtype('>'+_vtkTypes[vtkType])
+    if binary==True:
+        nbytes = count*dtype.itemsize
+        if pos+nbytes>len(data):
+            raise ValueError('Unexpected end of the VTK file.')
+        arr = np.frombuffer(data,dtype=dtype,count=count,offset=pos)
+        pos = pos+nbytes
+        if data[pos:pos+1]==b'\n':
+            pos = pos+1
+        return arr,pos
+    match = _vtkKeyword.search(data,pos)
+    end = len(data) if match==None else match.start()
+    if dtype.kind=='f':
+        arr = np.fromstring(bytes(data[pos:end]),dtype=float,sep=' ')
+    else:
+        arr = np.fromstring(bytes(data[pos:end]),dtype=int,sep=' ')
+    if arr.size<count:
+        raise ValueError('Expected '+str(count)+' values in the VTK file, '
+                         'found '+str(arr.size)+'.')
+    return arr[:count],end
+    
+    
+def _shapeVTKArray(arr,nTuples,nComp):
+    '''
+    Shape (nTuples,) or (nTuples,nComp) of a VTK array.
+    '''
+    if nComp==1:
+        return arr
+    return arr.reshape(nTuples,nComp)
+    
+    
+def _cellsFromLegacy(arr,nCells):
+    '''
+    Cells (nCells,K) from the legacy cell list "K p0 ... pK-1" of cells of
+    the same size K.
+    '''
+    if nCells==0:
+        return np.zeros((0,3),dtype=int)
+    K = int(arr[0])
+    if arr.size!=nCells*(K+1) or np.any(arr[::K+1]!=K):
+        raise ValueError('Only polygons with the same number of points are supported.')
+    return arr.reshape(nCells,K+1)[:,1:]
+    
+    
+def _cellsFromOffsets(offsets,conn):
+    '''
+    Cells (nCells,K) from the offsets and the connectivity of the file
+    format 5.x, for cells of the same size K.
+    '''
+    sizes = np.diff(offsets)
+    if len(sizes)==0:
+        return np.zeros((0,3),dtype=int)
+    if np.any(sizes!=sizes[0]):
+        raise ValueError('Only polygons with the same number of points are supported.')
+    return conn.reshape(len(sizes),int(sizes[0]))
+    
+    
+# number of files kept in the cache of parseVTK_sampledSurface
+vtkCacheSize = 4
+_vtkCache = OrderedDict()
+_vtkTypes = {'bit':'u1',
+             'unsigned_char':'u1',
+             'char':'i1',
+             'unsigned_short':'u2',
+             'short':'i2',
+             'unsigned_int':'u4',
+             'int':'i4',
+             'unsigned_long':'u8',
+             'long':'i8',
+             'vtkidtype':'i4',
+             'vtktypeint32':'i4',
+             'vtktypeint64':'i8',
+             'float':'f4',
+             'double':'f8'}
+# line starting with a letter (keyword or array name, not nan or inf)
+_vtkKeyword = re.compile(br'^[ \t]*(?![nN][aA][nN]\b|[iI][nN][fF])[A-Za-z_]',re.MULTILINE)
@@ -0,0 +1,353 @@
+'''
+PressureSolver.py
+
+Pressure reconstruction from PIV velocity fields with the pressure Poisson
+equation. The pressure gradient is given by the momentum equation (viscous
+term neglected):
+    grad(p) = -rho*Du/Dt = -rho*(du/dt + u*du/dx + v*du/dy)
+Its divergence is the source term of the Poisson equation
+    laplacian(p) = div(grad(p))
+which is discretized with finite volumes on the cells of the Surface grid.
+The Laplacian is built and factorized (scipy.sparse.linalg.splu) once. The
+pressure of any number of frames is then obtained with batched solves of
+the factorized system, the frames of a chunk being the right hand sides.
+'''
+
+#=============================================================================#
+# load modules
+#=============================================================================#
+#scientific modules
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg as splinalg
+import scipy.ndimage as ndimage
+
+import pyFlowStat.Surface as sr
+
+
+class PressureSolver(object):
+    '''
+    Pressure Poisson solver on the grid of a Surface.
+
+    The unknowns are the valid cells of the grid (see mask). The faces
+    between a valid cell and an invalid cell (NaN region) or the border of
+    the grid are boundary faces:
+        * boundary="neumann": the normal pressure gradient of the boundary
+          cell is imposed. The pressure is defined up to a constant in each
+          connected region of valid cells: the pressure of the reference
+          cell refCell (and of the first cell of each other region) is set
+          to 0.
+        * boundary="dirichlet": the pressure of the boundary cells (valid
+          cells with at least one boundary face) is imposed (argument
+          boundaryPressure of solve()).
+
+    The grid spacing dx, dy is in mm (as the gradients of Surface), the
+    velocity in m/s and rho in kg/m^3, so that the pressure is in Pa.
+
+    Usage:
+        >>> ps = PressureSolver(sts,boundary='neumann',rho=1000.0)
+        >>> p = ps.pressureFromTimeSeries(sts,chunkSize=200)
+        >>> pMean = ps.pressureFromSurface(meanSurface)
+    '''
+
+    # constructors #
+    #--------------#
+    def __init__(self,grid,mask=None,boundary='neumann',rho=1.0,refCell=None):
+        '''
+        base constructor. Builds and factorizes the Laplacian.
+
+        Arguments:
+            *grid*: Surface or SurfaceTimeSeries object.
+             Object defining the grid (dx, dy, minX, maxX, minY, maxY) and,
+             if mask is None, the valid cells.
+
+            *mask*: numpy bool array of shape (ny,nx).
+             True for the cells where the pressure is computed. If None, the
+             cells where vx, vy and their gradients (numpy.gradient, as in
+             Surface) are finite, in all the frames for a SurfaceTimeSeries.
+             Default=None.
+
+            *boundary*: python string.
+             "neumann" or "dirichlet". Default="neumann".
+
+            *rho*: python float.
+             Density of the fluid. Default=1.0.
+
+            *refCell*: python tuple (row,col).
+             Reference cell of the Neumann problem. If None, the first valid
+             cell. The other connected regions of valid cells are pinned at
+             their first cell. Default=None.
+        '''
+        if boundary not in ['neumann','dirichlet']:
+            raise ValueError('boundary "'+str(boundary)+'" is not "neumann" or "dirichlet".')
+        if mask is None:
+            mask = getValidMask(grid.vx,grid.vy)
+        self.mask = np.asarray(mask,dtype=bool)
+        self.shape = self.mask.shape
+        self.boundary = boundary
+        self.rho = rho
+        self.dx = grid.dx
+        self.dy = grid.dy
+
+        nValid = int(np.sum(self.mask))
+        if nValid==0:
+            raise ValueError('no valid cell in mask.')
+        self.nValid = nValid
+        cellIdx = -np.ones(self.shape,dtype=int)
+        cellIdx[self.mask] = np.arange(nValid)
+        self.cellIdx = cellIdx
+
+        hx = self.dx/1000.0
+        hy = self.dy/1000.0
+        # (row shift, col shift, spacing, outward normal (nx,ny))
+        directions = [(0,1,hx,(1.0,0.0)),
+                      (0,-1,hx,(-1.0,0.0)),
+                      (-1,0,hy,(0.0,1.0)),
+                      (1,0,hy,(0.0,-1.0))]
+
+        rows,cols = np.nonzero(self.mask)
+        i = cellIdx[rows,cols]
+        L = [[],[],[]]
+        Dx = [[],[],[]]
+        Dy = [[],[],[]]
+        isBoundary = np.zeros(nValid,dtype=bool)
+        for dr,dc,h,n in directions:
+            nr = rows+dr
+            nc = cols+dc
+            inside = (nr>=0) & (nr<self.shape[0]) & (nc>=0) & (nc<self.shape[1])
+            j = -np.ones(nValid,dtype=int)
+            j[inside] = cellIdx[nr[inside],nc[inside]]
+            interior = j>=0
+            bnd = ~interior
+
+            # interior faces: (p_j-p_i)/h^2 = (g_i+g_j)/2*n/h
+            ii = i[interior]
+            jj = j[interior]
+            _append(L,ii,ii,-1.0/h**2)
+            _append(L,ii,jj,1.0/h**2)
+            for D,nk in [(Dx,n[0]),(Dy,n[1])]:
+                if nk!=0.0:
+                    _append(D,ii,ii,0.5*nk/h)
+                    _append(D,ii,jj,0.5*nk/h)
+
+            # boundary faces. neumann: the imposed normal gradient g_i*n/h
+            # is on both sides of the equation and cancels out.
+            isBoundary[bnd] = True
+
+        L = _toCsr(L,nValid)
+        self.Dx = _toCsr(Dx,nValid)
+        self.Dy = _toCsr(Dy,nValid)
+
+        # cells whose equation is replaced by an imposed pressure
+        self.refIdx = None
+        if boundary=='neumann':
+            if refCell is None:
+                self.refIdx = 0
+            else:
+                self.refIdx = cellIdx[refCell[0],refCell[1]]
+                if self.refIdx<0:
+                    raise ValueError('refCell '+str(refCell)+' is not a valid cell.')
+            # one reference cell per connected region (4 neighbours, as the
+            # Laplacian), else the system is singular
+            labels,nRegions = ndimage.label(self.mask)
+            cellLabels = labels[self.mask]
+            imposed = np.zeros(nValid,dtype=bool)
+            imposed[self.refIdx] = True
+            firstCells = np.unique(cellLabels,return_index=True)[1]
+            firstCells = firstCells[cellLabels[firstCells]!=cellLabels[self.refIdx]]
+            imposed[firstCells] = True
+            self.nRegions = nRegions
+        else:
+            imposed = isBoundary
+        self.imposed = imposed
+        K = sparse.diags(np.where(imposed,0.0,1.0),0)
+        L = K*L+sparse.diags(imposed.astype(float),0)
+        self.Dx = K*self.Dx
+        self.Dy = K*self.Dy
+
+        self.laplacian = L.tocsc()
+        self.lu = splinalg.splu(self.laplacian)
+
+
+    # class methods #
+    #---------------#
+    def solve(self,gx,gy,boundaryPressure=None):
+        '''
+        Solve the Poisson equation for the pressure gradient (gx,gy).
+
+        Arguments:
+            *gx*, *gy*: numpy arrays of shape (ny,nx) or (T,ny,nx).
+             Components of the pressure gradient, in Pa/m. They must be
+             finite in the valid cells (see mask).
+
+            *boundaryPressure*: numpy array of shape (ny,nx) or (T,ny,nx).
+             Pressure of the boundary cells, required if boundary is
+             "dirichlet". Default=None.
+
+        Returns:
+            *p*: numpy array of shape (ny,nx) or (T,ny,nx).
+             Pressure, NaN outside of the valid cells.
+        '''
+        gx = np.asarray(gx,dtype=float)
+        oneFrame = gx.ndim==2
+        gx = self._toColumns(gx)
+        gy = self._toColumns(gy)
+        if not (np.all(np.isfinite(gx)) and np.all(np.isfinite(gy))):
+            raise ValueError('the pressure gradient is not finite in all the '
+                             'valid cells. Exclude these cells from the mask.')
+        rhs = self.Dx*gx+self.Dy*gy
+        if self.boundary=='dirichlet':
+            if boundaryPressure is None:
+                raise ValueError('boundaryPressure is required with boundary="dirichlet".')
+            pb = np.asarray(boundaryPressure,dtype=float)
+            if pb.ndim==2 and not oneFrame:
+                pb = np.tile(pb[np.newaxis],(gx.shape[0],1,1))
+            pb = self._toColumns(pb)
+            if not np.all(np.isfinite(pb[self.imposed])):
+                raise ValueError('boundaryPressure is not finite in all the boundary cells.')
+            if pb.ndim==2:
+                rhs[self.imposed,:] = pb[self.imposed,:]
+            else:
+                rhs[self.imposed] = pb[self.imposed]
+        res = self.lu.solve(rhs)
+        return self._toFrames(res,oneFrame)
+
+    def pressureFromSurface(self,surface):
+        '''
+        Pressure of a (mean) Surface, with the convective acceleration only:
+            grad(p) = -rho*(u*du/dx + v*du/dy)
+        See solve() for the boundary conditions.
+        '''
+        gx,gy = self.getPressureGradient(surface.vx,surface.vy,surface.dx,surface.dy)
+        return self.solve(gx,gy)
+
+    def pressureFromTimeSeries(self,sts,chunkSize=100,boundaryPressure=None):
+        '''
+        Pressure of the frames of a time resolved SurfaceTimeSeries. The
+        time derivative of the velocity is computed with central differences
+        (numpy.gradient with the time step sts.data['dt']). The frames are
+        solved by chunks of chunkSize frames with the factorized Laplacian.
+
+        Arguments:
+            *sts*: SurfaceTimeSeries object.
+
+            *chunkSize*: python int.
+             Number of frames solved at once. Default=100.
+
+            *boundaryPressure*: numpy array of shape (ny,nx) or (T,ny,nx).
+             See solve(). Default=None.
+
+        Returns:
+            *p*: numpy array of shape (T,ny,nx).
+        '''
+        nFrames = len(sts.vx)
+        dt = sts.data['dt']
+        p = np.empty((nFrames,)+self.shape)
+        for start in range(0,nFrames,chunkSize):
+            stop = min(start+chunkSize,nFrames)
+            # one extra frame on each side for the central differences
+            a = max(start-1,0)
+            b = min(stop+1,nFrames)
+            vx = np.asarray(sts.vx[a:b],dtype=float)
+            vy = np.asarray(sts.vy[a:b],dtype=float)
+            if b-a>1:
+                dudt = np.gradient(vx,dt,axis=0)[start-a:stop-a]
+                dvdt = np.gradient(vy,dt,axis=0)[start-a:stop-a]
+            else:
+                dudt = np.zeros(vx.shape)
+                dvdt = np.zeros(vy.shape)
+            gx,gy = self.getPressureGradient(vx[start-a:stop-a],vy[start-a:stop-a],sts.dx,sts.dy)
+            pb = boundaryPressure
+            if pb is not None and np.ndim(pb)==3:
+                pb = pb[start:stop]
+            p[start:stop] = self.solve(gx-self.rho*dudt,gy-self.rho*dvdt,boundaryPressure=pb)
+        return p
+
+    def getPressureGradient(self,vx,vy,dx,dy):
+        '''
+        Convective part of the pressure gradient, -rho*(u.grad)u, of a frame
+        (ny,nx) or a stack of frames (T,ny,nx). The velocity gradients are
+        the derived fields 'dudx', 'dudy', 'dvdx' and 'dvdy' of Surface.
+
+        Returns:
+            *gx*, *gy*: numpy arrays of the shape of vx.
+        '''
+        data = {'Ux':np.asarray(vx,dtype=float),'Uy':np.asarray(vy,dtype=float),'dx':dx,'dy':dy}
+        for key in ['dudx','dudy','dvdx','dvdy']:
+            if key not in data:
+                sr.computeDerivedField(data,key)
+        u = data['Ux']
+        v = data['Uy']
+        gx = -self.rho*(u*data['dudx']+v*data['dudy'])
+        gy = -self.rho*(u*data['dvdx']+v*data['dvdy'])
+        return gx,gy
+
+    def _toColumns(self,field):
+        '''
+        Values of the valid cells of a frame (nValid,) or of a stack of
+        frames (nValid,T).
+        '''
+        field = np.asarray(field,dtype=float)
+        if field.ndim==2:
+            return field[self.mask]
+        return field[:,self.mask].T
+
+    def _toFrames(self,values,oneFrame):
+        '''
+        Inverse of _toColumns, NaN outside of the valid cells.
+        '''
+        if oneFrame:
+            res = np.empty(self.shape)
+            res[:] = np.nan
+            res[self.mask] = values
+            return res
+        res = np.empty((values.shape[1],)+self.shape)
+        res[:] = np.nan
+        res[:,self.mask] = values.T
+        return res
+
+
+#=============================================================================#
+# functions
+#=============================================================================#
+def getValidMask(vx,vy):
+    '''
+    Cells where vx, vy and their gradients are finite, for a frame (ny,nx)
+    or in all the frames of a stack (T,ny,nx). The gradient of a cell
+    (numpy.gradient, as the derived fields of Surface) is finite if the
+    velocity of the cells of its stencil is finite.
+
+    Returns:
+        *mask*: numpy bool array of shape (ny,nx).
+    '''
+    vx = np.asarray(vx,dtype=float)
+    vy = np.asarray(vy,dtype=float)
+    finite = np.isfinite(vx) & np.isfinite(vy)
+    if finite.ndim==3:
+        finite = np.all(finite,axis=0)
+    indicator = np.where(finite,0.0,np.nan)
+    mask = finite.copy()
+    for axis in range(2):
+        if indicator.shape[axis]>1:
+            mask &= np.isfinite(np.gradient(indicator,axis=axis))
+    return mask
+
+def _append(coo,i,j,value):
+    '''
+    Append the entries (i,j,value) to the lists [rows,cols,values] of a
+    sparse matrix in coordinate format.
+    '''
+    coo[0].append(i)
+    coo[1].append(j)
+    coo[2].append(value*np.ones(len(i)))
+
+def _toCsr(coo,n):
+    '''
+    Create a (n,n) csr matrix from the lists of _append. Duplicates are
+    summed.
+    '''
+    if len(coo[0])==0:
+        return sparse.csr_matrix((n,n))
+    return sparse.coo_matrix((np.concatenate(coo[2]),
+                              (np.concatenate(coo[0]),np.concatenate(coo[1]))),
+                             shape=(n,n)).tocsr()
@@ -3,6 +3,7 @@
 #===========================================================================#
 #standard modules
 #import sys
+import collections
 
 #scientific modules
 import numpy as np
@@ -13,6 +14,7 @@ from pyFlowStat.TriSurfaceMesh import TriSurfaceMesh
 from pyFlowStat.TriSurfaceVector import TriSurfaceVector
 from pyFlowStat.TriSurfaceScalar import TriSurfaceScalar
 from pyFlowStat.TriSurfaceSymmTensor import TriSurfaceSymmTensor
+from pyFlowStat.TriGridResampler import TriGridResampler
 #from pyFlowStat.TriSurface import parseFoamFile
 
 # special modules
@@ -136,6 +138,250 @@ def getMode(buf,theX_,theY_,width_,frameOffset):
     mode=mode-1
     return mode
 
+
+#===========================================================================#
+# derived fields of Surface.data
+#===========================================================================#
+# registry of the derived fields: name -> (names, dependencies, function).
+# "function" is called with the values of "dependencies" and returns the
+# value of "names" (a tuple of values if more than one name is provided).
+derivedFields = dict()
+_dependentsCache = dict()
+
+def registerDerivedField(names,dependencies,function):
+    '''
+    Register a derived field of Surface.data. A registered field is computed
+    on demand the first time it is accessed (surface.data['Q']), cached, and
+    dropped again when one of its dependencies is replaced.
+
+    Arguments:
+        *names*: python string or tuple of strings.
+         Key(s) of the field(s) computed by "function". Use a tuple if one
+         call computes several fields at once (e.g. np.gradient).
+
+        *dependencies*: python tuple of strings.
+         Keys of Surface.data needed to compute the field(s). They can be
+         derived fields themselves.
+
+        *function*: python function.
+         Called as function(*[data[k] for k in dependencies]). Returns the
+         field, or a tuple of fields ordered as "names".
+
+    Usage:
+        >>> registerDerivedField('Umag2D',('Ux','Uy'),lambda Ux,Uy: np.sqrt(Ux**2+Uy**2))
+    '''
+    if isinstance(names,str):
+        names = (names,)
+    entry = (tuple(names),tuple(dependencies),function)
+    for name in names:
+        derivedFields[name] = entry
+    _dependentsCache.clear()
+
+def getDependents(key):
+    '''
+    Return the set of registered derived fields which depend, directly or
+    through other derived fields, on "key".
+    '''
+    if key not in _dependentsCache:
+        dependents = set()
+        for name,(names,deps,func) in derivedFields.items():
+            if key in deps:
+                dependents.add(name)
+                dependents.update(getDependents(name))
+        _dependentsCache[key] = dependents
+    return _dependentsCache[key]
+
+def lambda2(dudx,dudy,dvdx,dvdy):
+    '''
+    Lambda2 criterion computed from the in-plane velocity gradients. Returns
+    the second eigenvalue (times -1) of S^2+W^2, with S and W the symmetric and
+    anti-symmetric parts of the velocity gradient tensor.
+    '''
+    S11 = dudx
+    S12 = 0.5*(dudy+dvdx)
+    S21 = 0.5*(dvdx+dudy)
+    S22 = dvdy
+    S13=S23=S33=S31=S32 = np.zeros(dudx.shape)
+    W13=W23=W33=W31=W32 = np.zeros(dudx.shape)
+    W11 = np.zeros(dudx.shape)
+    W12 = 0.5*(dudy-dvdx)
+    W21 = 0.5*(dvdx-dudy)
+    W22 = np.zeros(dudx.shape)
+
+    P11=S11*S11+S12*S12+S13*S13-W12*W12-W13*W13
+    P12=S12*(S11+S22)+S13*S23-W13*W23
+    P13=S13*(S11+S33)+S12*S23+W12*W23
+    P22=S12*S12+S22*S22+S23*S23-W12*W12-W23*W23
+    P23=S23*(S22+S33)+S12*S13-W12*W13
+    P33=S13*S13+S23*S23+S33*S33-W13*W13-W23*W23
+
+    a=-1.0
+    b=P11+P22+P33
+    c=P12*P12+P13*P13+P23*P23-P11*P22-P11*P33-P22*P33
+    d=P11*P22*P33+2.0*P12*P13*P23-P12*P12*P33-P13*P13*P22-P23*P23*P11
+
+    x=((3.0*c/a)-b*b/(a*a))/3.0
+    y=(2.0*b*b*b/(a*a*a)-9.0*b*c/(a*a)+27.0*d/a)/27.0
+    z=y*y/4.0+x*x*x/27.0
+
+    i=np.sqrt(y*y/4.0-z)
+    j=-pow(i,1.0/3.0)
+    k=np.arccos(-(y/(2.0*i)))
+    m=np.cos(k/3.0)
+    n=np.sqrt(3.0)*np.sin(k/3.0)
+    p=b/(3.0*a)
+
+    lam1=2.0*j*m+p;
+    lam2=-j*(m+n)+p;
+    lam3=-j*(m-n)+p;
+    # middle eigenvalue of each pixel
+    lam=np.sort(np.array([lam1,lam2,lam3]),axis=0)[1]
+    return lam*-1.0
+
+def _velocityGradient(U,dx,dy):
+    # the two last axes are the spatial axes (single frame or stack of frames)
+    dUdy,dUdx=np.gradient(U,-dy/1000.0,dx/1000.0,axis=(-2,-1))
+    return dUdy,dUdx
+
+def _signedQ(Q,VortZ):
+    Q_sign=Q.copy()
+    Q_sign[Q_sign<0]=0.0
+    Q_sign[VortZ<0]=Q_sign[VortZ<0]*-1.0
+    return Q_sign
+
+registerDerivedField(('dudy','dudx'),('Ux','dx','dy'),_velocityGradient)
+registerDerivedField(('dvdy','dvdx'),('Uy','dx','dy'),_velocityGradient)
+registerDerivedField('Umag',('Ux','Uy','Uz'),
+                     lambda Ux,Uy,Uz: np.sqrt(Ux**2+Uy**2+Uz**2))
+registerDerivedField('Umag2D',('Ux','Uy'),lambda Ux,Uy: np.sqrt(Ux**2+Uy**2))
+registerDerivedField('KE',('Ux','Uy','Uz'),lambda Ux,Uy,Uz: 0.5*(Ux**2+Uy**2+Uz**2))
+registerDerivedField('VortZ',('dudy','dvdx'),lambda dudy,dvdx: dvdx-dudy)
+registerDerivedField('Div2D',('dudx','dvdy'),lambda dudx,dvdy: dudx+dvdy)
+registerDerivedField('Q',('dudx','dudy','dvdx','dvdy'),
+                     lambda dudx,dudy,dvdx,dvdy: 0.5*(-2.0*dudy*dvdx-dudx**2-dvdy**2))
+registerDerivedField('Q_sign',('Q','VortZ'),_signedQ)
+registerDerivedField('OW-Q',('dudx','dudy','dvdx','dvdy'),
+                     lambda dudx,dudy,dvdx,dvdy: (dudx-dvdy)**2+(dudy+dvdx)**2-(dvdx-dudy)**2)
+registerDerivedField('SwirlingStrength^2',('dudx','dudy','dvdx','dvdy'),
+                     lambda dudx,dudy,dvdx,dvdy: (1.0/(4.0*dudx))**2+(1.0/(4.0*dvdy))**2-0.5*dudx*dvdy+dvdx*dudy)
+registerDerivedField('lambda2',('dudx','dudy','dvdx','dvdy'),lambda2)
+registerDerivedField('umag',('ux','uy','uz'),
+                     lambda ux,uy,uz: np.sqrt(ux**2+uy**2+uz**2))
+registerDerivedField('uu',('ux',),lambda ux: ux**2)
+registerDerivedField('vv',('uy',),lambda uy: uy**2)
+registerDerivedField('ww',('uz',),lambda uz: uz**2)
+registerDerivedField('uv',('ux','uy'),lambda ux,uy: ux*uy)
+registerDerivedField('uw',('ux','uz'),lambda ux,uz: ux*uz)
+registerDerivedField('vw',('uy','uz'),lambda uy,uz: uy*uz)
+registerDerivedField('TKE',('uu','vv','ww'),lambda uu,vv,ww: 0.5*(uu+vv+ww))
+
+
+def computeDerivedField(data,key):
+    '''
+    (Re)compute the registered derived field "key" of the dictionary "data"
+    and store it in "data". Works with a SurfaceDataDict or a classic dict.
+    Missing dependencies are computed on the way.
+    '''
+    names,deps,func = derivedFields[key]
+    values = []
+    for d in deps:
+        if d not in data and d in derivedFields:
+            computeDerivedField(data,d)
+        values.append(data[d])
+    res = func(*values)
+    if len(names)==1:
+        res = (res,)
+    for name,value in zip(names,res):
+        data[name] = value
+
+
+class SurfaceDataDict(dict):
+    '''
+    Dictionary holding the data of a Surface. It behaves like a classic python
+    dict, but the derived fields registered with registerDerivedField() (for
+    example 'dudx', 'VortZ', 'Q', 'lambda2') are computed on demand:
+
+        >>> s.data['Q']    # computes dudx,dudy,dvdx,dvdy and Q if missing
+
+    Computed derived fields are cached. They are dropped when one of their
+    dependencies is replaced (s.data['Ux']=newUx drops the gradients, Q,
+    VortZ...). In-place modifications (s.data['Ux'][:]=0) are not detected.
+
+    If maxBytes is not None, the least recently used derived fields are
+    evicted as soon as the derived fields use more than maxBytes bytes.
+    Evicted fields are recomputed on the next access.
+    '''
+    def __init__(self,maxBytes=None):
+        super(SurfaceDataDict,self).__init__()
+        self.maxBytes = maxBytes
+        # derived fields currently stored -> nbytes, least recently used first
+        self.derivedBytes = collections.OrderedDict()
+
+    def __missing__(self,key):
+        if key not in derivedFields:
+            raise KeyError(key)
+        self.computeField(key)
+        return super(SurfaceDataDict,self).__getitem__(key)
+
+    def __getitem__(self,key):
+        value = super(SurfaceDataDict,self).__getitem__(key)
+        if key in self.derivedBytes:
+            self.derivedBytes[key] = self.derivedBytes.pop(key)
+        return value
+
+    def __setitem__(self,key,value):
+        for dependent in getDependents(key):
+            if dependent!=key and dependent in self:
+                self.pop(dependent)
+        super(SurfaceDataDict,self).__setitem__(key,value)
+        self.derivedBytes.pop(key,None)
+        if key in derivedFields:
+            self.derivedBytes[key] = getattr(value,'nbytes',0)
+            self.evict(keep=derivedFields[key][0])
+
+    def __delitem__(self,key):
+        super(SurfaceDataDict,self).__delitem__(key)
+        self.derivedBytes.pop(key,None)
+
+    def pop(self,key,*default):
+        self.derivedBytes.pop(key,None)
+        return super(SurfaceDataDict,self).pop(key,*default)
+
+    def update(self,*args,**kwargs):
+        for key,value in dict(*args,**kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        super(SurfaceDataDict,self).clear()
+        self.derivedBytes.clear()
+
+    def computeField(self,key):
+        '''
+        (Re)compute the derived field "key" and store it. Missing
+        dependencies are computed on the way.
+        '''
+        computeDerivedField(self,key)
+
+    def evict(self,keep=()):
+        '''
+        Drop the least recently used derived fields until the derived fields
+        use less than maxBytes. The fields listed in "keep" are not dropped.
+        '''
+        if self.maxBytes is None:
+            return
+        for key in list(self.derivedBytes.keys()):
+            if sum(self.derivedBytes.values())<=self.maxBytes:
+                break
+            if key not in keep:
+                self.pop(key)
+
+    def derivedKeys(self):
+        '''
+        Return the derived fields currently stored, least recently used first.
+        '''
+        return list(self.derivedBytes.keys())
+
+
 class Surface(object):
     '''
     Holds 2D data on a equidistant,cartesian grid
@@ -146,6 +392,8 @@ class Surface(object):
       * minX,maxX,minY,maxY (float): min/max position of cell centers in mm.
       * extent (list of floats): [minX-dx/2,maxX+dx/2,minY-dy/2,maxY+dy/2] in mm.
       * data (dict): dictionary to hold processed data, created by createDataDict().
+      * resampler (TriGridResampler): interpolation weights used by the last
+        read*FromFoamFile call. Can be given to the next call on the same mesh.
         
     Note: Units for distances have to be in mm (dx,dy,minX,maxX,minY,maxY and extent)
     in order for gradients to be calculated correctly.
@@ -164,7 +412,8 @@ class Surface(object):
         self.maxY = float()
         self.extent = []
 
-        self.data=dict()
+        self.data=SurfaceDataDict()
+        self.resampler=None
         return
 
     def createDataDict(self):
@@ -179,9 +428,13 @@ class Surface(object):
             Uz:  [numpy.array.shape=(ny,nx)] Velocity Uz
             dx:    [float] spacing in x dirction
             dy:    [float] spacing in y dirction
-        '''
 
-        self.data = dict()
+        The derived fields (gradients, VortZ, Q, lambda2, ...) are computed on
+        demand when accessed, see SurfaceDataDict. The memory budget (maxBytes)
+        of an existing data dictionary is kept.
+        '''
+        maxBytes = getattr(self.data,'maxBytes',None)
+        self.data = SurfaceDataDict(maxBytes=maxBytes)
         self.data['Ux'] = self.vx
         self.data['Uy'] = self.vy
         self.data['Uz'] = self.vz
@@ -202,24 +455,25 @@ class Surface(object):
         s.extent=self.extent
         return s
 
+    def computeDerivedField(self,key):
+        '''
+        (Re)compute the registered derived field "key" (see
+        registerDerivedField) and store it in self.data.
+        '''
+        computeDerivedField(self.data,key)
+
     def generateUmag(self):
-        Umag = np.zeros(self.data['Ux'].shape)
-        Umag = np.sqrt(self.data['Ux']**2+self.data['Uy']**2+self.data['Uz']**2)
-        self.data['Umag']=Umag
+        self.computeDerivedField('Umag')
         
     def generateUmagFluct(self):
         try:
-            Umag = np.zeros(self.data['ux'].shape)
-            Umag = np.sqrt(self.data['ux']**2+self.data['uy']**2+self.data['uz']**2)
-            self.data['umag']=Umag
+            self.computeDerivedField('umag')
         except KeyError as err:
             print err.message
             print 'add fluctuating field using addReynoldsDecomposition()'
         
     def generateUmag2D(self):
-        Umag2D = np.zeros(self.data['Ux'].shape)
-        Umag2D = np.sqrt(self.data['Ux']**2+self.data['Uy']**2)
-        self.data['Umag2D']=Umag2D
+        self.computeDerivedField('Umag2D')
         
     def generateFields(self):
         '''
@@ -236,7 +490,7 @@ class Surface(object):
         self.computeLambda2()
         self.computeDivergence()
         
-        self.data['KE']=0.5*(self.vx**2+self.vy**2+self.vz**2)
+        self.computeDerivedField('KE')
         
         #self.computeGradients(method='r')
         #self.computeGradients(method='ls')
@@ -248,6 +502,9 @@ class Surface(object):
 #        tensor2= 0.5*[[0.0,dudy-dvdx],[dvdx-dudy,0.0]]
 
     def computeDivergence(self,postfix=''):
+        if postfix=='':
+            self.computeDerivedField('Div2D')
+            return
         dudx=self.data['dudx'+postfix]
         dvdy=self.data['dvdy'+postfix]
         self.data['Div2D'+postfix]=dudx+dvdy
@@ -270,12 +527,8 @@ class Surface(object):
              
         '''
         if method=='numpy':
-            dudy,dudx=np.gradient(self.vx,-self.dy/1000,self.dx/1000)
-            dvdy,dvdx=np.gradient(self.vy,-self.dy/1000,self.dx/1000)
-            self.data['dudy']=dudy
-            self.data['dudx']=dudx
-            self.data['dvdy']=dvdy
-            self.data['dvdx']=dvdx
+            self.computeDerivedField('dudx')
+            self.computeDerivedField('dvdx')
         elif method=='r':
             dudx_r = np.zeros(self.data['Ux'].shape)
             dvdy_r = np.zeros(self.data['Uy'].shape)
@@ -334,103 +587,28 @@ class Surface(object):
                 self.data.pop(k)
         
     def computeQ(self):
-        
-        dudy=self.data['dudy']
-        dudx=self.data['dudx']
-        dvdy=self.data['dvdy']
-        dvdx=self.data['dvdx']
-        #self.data['Q']=np.zeros(self.data['Ux'].shape)
-        self.data['Q']=0.5*(-2.0*dudy*dvdx-dudx**2-dvdy**2)
+        self.computeDerivedField('Q')
         
     def computeSignedQ(self):
-        Q_sign=self.data['Q'].copy()
-        Q_sign[Q_sign<0]=0.0
-        Q_sign[self.data['VortZ']<0]=Q_sign[self.data['VortZ']<0]*-1.0
-        self.data['Q_sign']=Q_sign
+        self.computeDerivedField('Q_sign')
         
     def computeSwirlingStrength(self):
-        
-        dudy=self.data['dudy']
-        dudx=self.data['dudx']
-        dvdy=self.data['dvdy']
-        dvdx=self.data['dvdx']
-        #self.data['Q']=np.zeros(self.data['Ux'].shape)
-        self.data['SwirlingStrength^2']=(1.0/(4.0*dudx))**2+(1.0/(4.0*dvdy))**2-0.5*dudx*dvdy+dvdx*dudy
+        self.computeDerivedField('SwirlingStrength^2')
         
     def computeOWQ(self):
         '''
         Okubo-Weiss
         '''
-        dudy=self.data['dudy']
-        dudx=self.data['dudx']
-        dvdy=self.data['dvdy']
-        dvdx=self.data['dvdx']
-        #self.data['Q']=np.zeros(self.data['Ux'].shape)
-        self.data['OW-Q']=(dudx-dvdy)**2+(dudy+dvdx)**2-(dvdx-dudy)**2
+        self.computeDerivedField('OW-Q')
         
     def computeLambda2(self):
-        dudy=self.data['dudy']
-        dudx=self.data['dudx']
-        dvdy=self.data['dvdy']
-        dvdx=self.data['dvdx']
-        self.data['lambda2'] = self.getLambda2(dudx,dudy,dvdx,dvdy)
+        self.computeDerivedField('lambda2')
         
     def computeVorticity(self):
-        
-        dudy=self.data['dudy']
-        dvdx=self.data['dvdx']
-        vort_z=dvdx-dudy
-        self.data['VortZ']=vort_z
+        self.computeDerivedField('VortZ')
         
     def getLambda2(self,dudx,dudy,dvdx,dvdy):
-        S11 = dudx
-        S12 = 0.5*(dudy+dvdx)
-        S21 = 0.5*(dvdx+dudy)
-        S22 = dvdy
-        S13=S23=S33=S31=S32 = np.zeros(dudx.shape)
-        W13=W23=W33=W31=W32 = np.zeros(dudx.shape)
-        W11 = np.zeros(dudx.shape)
-        W12 = 0.5*(dudy-dvdx)
-        W21 = 0.5*(dvdx-dudy)
-        W22 = np.zeros(dudx.shape)
-
-        P11=S11*S11+S12*S12+S13*S13-W12*W12-W13*W13
-        P12=S12*(S11+S22)+S13*S23-W13*W23
-        P13=S13*(S11+S33)+S12*S23+W12*W23
-        P22=S12*S12+S22*S22+S23*S23-W12*W12-W23*W23
-        P23=S23*(S22+S33)+S12*S13-W12*W13
-        P33=S13*S13+S23*S23+S33*S33-W13*W13-W23*W23
-
-        a=-1.0
-        b=P11+P22+P33
-        c=P12*P12+P13*P13+P23*P23-P11*P22-P11*P33-P22*P33
-        d=P11*P22*P33+2.0*P12*P13*P23-P12*P12*P33-P13*P13*P22-P23*P23*P11
-
-        x=((3.0*c/a)-b*b/(a*a))/3.0
-        y=(2.0*b*b*b/(a*a*a)-9.0*b*c/(a*a)+27.0*d/a)/27.0
-        z=y*y/4.0+x*x*x/27.0
-
-        i=np.sqrt(y*y/4.0-z)
-        j=-pow(i,1.0/3.0)
-        k=np.arccos(-(y/(2.0*i)))
-        m=np.cos(k/3.0)
-        n=np.sqrt(3.0)*np.sin(k/3.0)
-        p=b/(3.0*a)
-
-        lam1=2.0*j*m+p;
-        lam2=-j*(m+n)+p;
-        lam3=-j*(m-n)+p;
-        lam=np.zeros(lam1.shape)
-        row,col=lam1.shape
-        for arow in range(0,row):
-            for acol in range(0,col):
-                l=[]
-                l.append(lam1[arow,acol])
-                l.append(lam2[arow,acol])
-                l.append(lam3[arow,acol])
-                l.sort()
-                lam[arow,acol]=l[1]
-        return lam*-1.0
+        return lambda2(dudx,dudy,dvdx,dvdy)
 
     def addReynoldsDecomposition(self,MeanFlowSurface,addReStresses=True):
         '''
@@ -441,13 +619,8 @@ class Surface(object):
         self.data['uy']=self.data['Uy']-MeanFlowSurface.data['Uy']
         self.data['uz']=self.data['Uz']-MeanFlowSurface.data['Uz']
         if addReStresses:
-            self.data['uu']=self.data['ux']**2
-            self.data['vv']=self.data['uy']**2
-            self.data['ww']=self.data['uz']**2
-            self.data['uv']=self.data['ux']*self.data['uy']
-            self.data['uw']=self.data['ux']*self.data['uz']
-            self.data['vw']=self.data['uy']*self.data['uz']
-            self.data['TKE']=0.5*(self.data['uu']+self.data['vv']+self.data['ww'])
+            for key in ['uu','vv','ww','uv','uw','vw','TKE']:
+                self.computeDerivedField(key)
 
     def addQuadrants(self,thr=0.0):
         '''
@@ -674,7 +847,7 @@ class Surface(object):
         returns X and Y meshgrid, usable for contour plotting etc.
         '''
         ysteps=int(np.round((self.maxY-self.minY)/self.dy))+1
-        xsteps=int(np.round((self.maxX-self.minX)/self.dy))+1
+        xsteps=int(np.round((self.maxX-self.minX)/self.dx))+1
         yrange=np.linspace(self.minY,self.maxY,ysteps)
         yrange=np.flipud(yrange)
         xrange = np.linspace(self.minX,self.maxX,xsteps)
@@ -685,6 +858,98 @@ class Surface(object):
         X,Y = np.meshgrid(xrange, yrange)
         return X,Y
         
+    def getView(self,region):
+        '''
+        Return a Surface of the region of interest "region". The velocity
+        fields and the 2D fields of data are numpy views (no copy) of the
+        fields of the current surface.
+        
+        Arguments:
+            *region*: rect object or tuple of slices.
+             Region of interest, as a rect in physical coordinates (see
+             rect.getSlice) or as pixel slices created with np.s_ (positive
+             steps only).
+             
+        Returns:
+            *s*: pyFlowStat.Surface object.
+        '''
+        rows,cols=getRegionSlices(self,region,self.vx.shape)
+        s=Surface()
+        s.vx=self.vx[rows,cols]
+        s.vy=self.vy[rows,cols]
+        s.vz=self.vz[rows,cols]
+        setViewGrid(self,s,rows,cols,self.vx.shape)
+        s.createDataDict()
+        for key in self.data.keys():
+            if key in s.data or key in derivedFields:
+                pass
+            elif np.shape(self.data[key])==np.shape(self.vx):
+                s.data[key]=self.data[key][rows,cols]
+        return s
+        
+    def getResampler(self,
+                     triangulation,
+                     dx=None,
+                     dy=None,
+                     interpolationMethod='cubic',
+                     kind='min_E',
+                     resampler=None,
+                     bounds=None):
+        '''
+        Return the TriGridResampler used to interpolate the fields of
+        "triangulation" on the cartesian grid and store it in self.resampler.
+        If "resampler" is None, a new one is created with spacing dx, dy and
+        cell centers "bounds" ([minX,maxX,minY,maxY], bounding box of the
+        triangulation if None).
+        
+        Arguments:
+            *triangulation*: matplotlib.tri.Triangulation object.
+            
+            *dx*, *dy*: python float.
+             Physical size of a pixel. Must be given in mm.
+             
+            *interpolationMethod*: python string.
+             "cubic" or "linear". Default="cubic".
+             
+            *kind*: python string.
+             "min_E" or "geom". Default="min_E".
+             
+            *resampler*: pyFlowStat.TriGridResampler object.
+             Existing resampler (for example from the previous time step).
+             Default=None.
+             
+            *bounds*: python list of float.
+             Default=None.
+             
+        Returns:
+            *resampler*: pyFlowStat.TriGridResampler object.
+        '''
+        if resampler is None:
+            resampler=TriGridResampler.createFromTriangulation(triangulation,
+                                                               dx=dx,
+                                                               dy=dy,
+                                                               bounds=bounds,
+                                                               method=interpolationMethod,
+                                                               kind=kind)
+        elif resampler.nPoints!=len(triangulation.x):
+            raise ValueError('resampler does not match the triangulation: '
+                             +str(resampler.nPoints)+' points instead of '
+                             +str(len(triangulation.x))+'.')
+        self.resampler=resampler
+        return resampler
+        
+    def setGridFromResampler(self,resampler):
+        '''
+        sets dx,dy,minX,maxX,minY,maxY and extent from the grid of resampler
+        '''
+        self.dx=resampler.dx
+        self.dy=resampler.dy
+        self.minX=resampler.minX
+        self.maxX=resampler.maxX
+        self.minY=resampler.minY
+        self.maxY=resampler.maxY
+        self.extent=resampler.extent
+        
     def readFromFoamFile(self,
                          pointsFile,
                          facesFile,
@@ -697,7 +962,8 @@ class Surface(object):
                          dx=None,
                          dy=None,
                          interpolationMethod='cubic',
-                         kind='min_E'):
+                         kind='min_E',
+                         resampler=None):
         '''
         Read an OpenFOAM surface (triangulated grid) in the current Surface
         object (cartesian grid). As the "grid" change (tri to cartesian), the
@@ -738,6 +1004,13 @@ class Surface(object):
              "min_E" or "geom". "min_E" should be the more accurate, but it is 
              also the most time time consuming.
              
+            *resampler*: pyFlowStat.TriGridResampler object.
+             Interpolation weights computed by a previous call on the same
+             mesh (self.resampler), for example with another time step. If
+             None, the weights are computed and stored in self.resampler. dx,
+             dy, interpolationMethod and kind are ignored if a resampler is
+             given. Default=None.
+             
         Returns:
             none
         '''
@@ -755,69 +1028,30 @@ class Surface(object):
                                                 time=0,
                                                 projectedField=False)                  
 
-        points = np.vstack((tsv.x,tsv.y)).T
-        
         print 'Creating Grid and Interpolator'
-        if dx==None:
-            dxlist=[a for a in np.abs(np.diff(points[:,0])) if a>0]
-            dx=np.min(dxlist)
-        if dy==None:
-            dylist=[a for a in np.abs(np.diff(points[:,1])) if a>0]
-            dy=np.min(dylist)
-
-        MaxX=np.max(points[:,0])
-        MinX=np.min(points[:,0])
-        MaxY=np.max(points[:,1])
-        MinY=np.min(points[:,1])
-        extent=[MinX-dx/2,MaxX+dx/2,MinY-dy/2,MaxY+dy/2]
-
-        cellsX=int((MaxX-MinX)/dx)+1
-        cellsY=int((MaxY-MinY)/dy)+1
-
-        grid_y, grid_x = np.mgrid[MinY:MaxY:np.complex(0,cellsY),MinX:MaxX:np.complex(0,cellsX)]
-        triang = tsv.triangulation
+        r=self.getResampler(tsv.triangulation,
+                            dx=dx,
+                            dy=dy,
+                            interpolationMethod=interpolationMethod,
+                            kind=kind,
+                            resampler=resampler)
 
         print 'Interpolating Velocity'
-        vx_i=self.interpolateField(tsv.vx,grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-        vy_i=self.interpolateField(tsv.vy,grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-        vz_i=self.interpolateField(tsv.vz,grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-        self.vx=np.flipud(vx_i)
-        self.vy=np.flipud(vy_i)
-        self.vz=np.flipud(vz_i)
-
-        self.dx=dx
-        self.dy=dy
-        self.minX=MinX
-        self.maxX=MaxX
-        self.minY=MinY
-        self.maxY=MaxY
-        self.extent=extent
+        self.vx,self.vy,self.vz=r.resample(np.vstack((tsv.vx,tsv.vy,tsv.vz)).T)
+        self.setGridFromResampler(r)
         self.createDataDict()
 
         for scalarFile in scalarFileList:
             varName=os.path.basename(scalarFile)
             print 'Reading Scalar',varName
             tsv.addFieldFromFoamFile(fieldFile=scalarFile,fieldname=varName)
-            scalar_i=self.interpolateField(tsv[varName],grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            self.data[varName]=np.flipud(scalar_i)
+            self.data[varName]=r.resample(tsv[varName])
 
         for symTensorFile in symTensorFileList:
             varName=os.path.basename(symTensorFile)
             print 'Reading Tenstor',varName
             tsv.addFieldFromFoamFile(fieldFile=symTensorFile,fieldname=varName)
-            tensor_11=self.interpolateField(tsv[varName][:,0],grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            tensor_12=self.interpolateField(tsv[varName][:,1],grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            tensor_13=self.interpolateField(tsv[varName][:,2],grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            tensor_22=self.interpolateField(tsv[varName][:,3],grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            tensor_23=self.interpolateField(tsv[varName][:,4],grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            tensor_33=self.interpolateField(tsv[varName][:,5],grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-
-            tensor_11=np.flipud(tensor_11)
-            tensor_12=np.flipud(tensor_12)
-            tensor_13=np.flipud(tensor_13)
-            tensor_22=np.flipud(tensor_22)
-            tensor_23=np.flipud(tensor_23)
-            tensor_33=np.flipud(tensor_33)
+            tensor_11,tensor_12,tensor_13,tensor_22,tensor_23,tensor_33=r.resample(tsv[varName][:,0:6])
 
             if varName=='UPrime2Mean':
                 print 'Adding UPrime2Mean'
@@ -844,7 +1078,8 @@ class Surface(object):
                             dx=None,
                             dy=None,
                             interpolationMethod='cubic',
-                            kind='min_E'):
+                            kind='min_E',
+                            resampler=None):
         '''
         '''
 
@@ -859,44 +1094,17 @@ class Surface(object):
                                                 time=0,
                                                 projectedField=False)                  
 
-        points = np.vstack((tsv.x,tsv.y)).T
-        
         print 'Creating Grid and Interpolator'
-        if dx==None:
-            dxlist=[a for a in np.abs(np.diff(points[:,0])) if a>0]
-            dx=np.min(dxlist)
-        if dy==None:
-            dylist=[a for a in np.abs(np.diff(points[:,1])) if a>0]
-            dy=np.min(dylist)
-
-        MaxX=np.max(points[:,0])
-        MinX=np.min(points[:,0])
-        MaxY=np.max(points[:,1])
-        MinY=np.min(points[:,1])
-        extent=[MinX-dx/2,MaxX+dx/2,MinY-dy/2,MaxY+dy/2]
-
-        cellsX=int((MaxX-MinX)/dx)+1
-        cellsY=int((MaxY-MinY)/dy)+1
-
-        grid_y, grid_x = np.mgrid[MinY:MaxY:np.complex(0,cellsY),MinX:MaxX:np.complex(0,cellsX)]
-        triang = tsv.triangulation
-
-        vx_i=self.interpolateField(tsv.vx,grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-        vy_i=self.interpolateField(tsv.vx,grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-        vz_i=self.interpolateField(tsv.vx,grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-
-        self.vx=np.flipud(vx_i)
-        self.vy=np.flipud(vy_i)
-        self.vz=np.flipud(vz_i)
-        
-        self.dx=dx
-        self.dy=dy
-        self.minX=MinX
-        self.maxX=MaxX
-        self.minY=MinY
-        self.maxY=MaxY
+        r=self.getResampler(tsv.triangulation,
+                            dx=dx,
+                            dy=dy,
+                            interpolationMethod=interpolationMethod,
+                            kind=kind,
+                            resampler=resampler)
+
+        self.vx,self.vy,self.vz=r.resample(np.vstack((tsv.vx,tsv.vy,tsv.vz)).T)
+        self.setGridFromResampler(r)
         self.createDataDict()
-        self.extent=extent
 
     def readScalarFromFoamFile(self,
                                varsFile,
@@ -908,7 +1116,8 @@ class Surface(object):
                                dx=None,
                                dy=None,
                                interpolationMethod='cubic',
-                               kind='min_E'):
+                               kind='min_E',
+                               resampler=None):
         '''
         '''
         varName=os.path.basename(varsFile)        
@@ -923,33 +1132,15 @@ class Surface(object):
                                                 time=0,
                                                 projectedField=False)                  
 
-        points = np.vstack((tss.x,tss.y)).T
-
-        #if not hasattr(self,'data'):
-            #print 'dict does not exists'
-        if not self.data.has_key('dx') or self.data.has_key('dy'):
+        if not ('dx' in self.data and 'dy' in self.data):
             print 'keys dx and dy does not exist'
-            if dx==None:
-                dxlist=[a for a in np.abs(np.diff(points[:,0])) if a>0]
-                dx=np.min(dxlist)
-            if dy==None:
-                dylist=[a for a in np.abs(np.diff(points[:,1])) if a>0]
-                dy=np.min(dylist)
-
-            MaxX=np.max(points[:,0])
-            MinX=np.min(points[:,0])
-            MaxY=np.max(points[:,1])
-            MinY=np.min(points[:,1])
-            extent=[MinX,MaxX,MinY,MaxY]
-            #print MinX,MaxX,MinY,MaxY
-
-            cellsX=int((MaxX-MinX)/dx)
-            cellsY=int((MaxY-MinY)/dy)
-            #print cellsX,cellsY
-            grid_y, grid_x = np.mgrid[MinY:MaxY:np.complex(0,cellsY),MinX:MaxX:np.complex(0,cellsX)]
-            triang = tss.triangulation
-#            scalar_i=doInterp(triang,tss.s,grid_x, grid_y)
-            scalar_i=self.interpolateField(tss.s,grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
+            r=self.getResampler(tss.triangulation,
+                                dx=dx,
+                                dy=dy,
+                                interpolationMethod=interpolationMethod,
+                                kind=kind,
+                                resampler=resampler)
+            scalar_i=r.resample(tss.s)
             vx_i=np.empty(scalar_i.shape)
             vy_i=np.empty(scalar_i.shape)
             vz_i=np.empty(scalar_i.shape)
@@ -957,34 +1148,24 @@ class Surface(object):
             vy_i[:]=np.NAN
             vz_i[:]=np.NAN
 
-            self.vx=np.flipud(vx_i)
-            self.vy=np.flipud(vy_i)
-            self.vz=np.flipud(vz_i)
-            self.extent=extent
-            self.minX=MinX
-            self.maxX=MaxX
-            self.minY=MinY
-            self.maxY=MaxY
-            self.dx=dx
-            self.dy=dy
+            self.vx=vx_i
+            self.vy=vy_i
+            self.vz=vz_i
+            self.setGridFromResampler(r)
             self.createDataDict()
 
-            self.data[varName]=np.flipud(scalar_i)
+            self.data[varName]=scalar_i
         else:
             print 'dict exists'
-            MaxX=self.extent[1]
-            MinX=self.extent[0]
-            MaxY=self.extent[3]
-            MinY=self.extent[2]
-
-            cellsX=int((MaxX-MinX)/self.dx)
-            cellsY=int((MaxY-MinY)/self.dy)
-            #print cellsX,cellsY
-            grid_y, grid_x = np.mgrid[MinY:MaxY:np.complex(0,cellsY),MinX:MaxX:np.complex(0,cellsX)]
-            triang = tss.triangulation
-            scalar_i=self.interpolateField(tss.s,grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
+            r=self.getResampler(tss.triangulation,
+                                dx=self.dx,
+                                dy=self.dy,
+                                interpolationMethod=interpolationMethod,
+                                kind=kind,
+                                resampler=resampler,
+                                bounds=[self.minX,self.maxX,self.minY,self.maxY])
             print 'adding scalar',varName
-            self.data[varName]=np.flipud(scalar_i)
+            self.data[varName]=r.resample(tss.s)
 
 
     def readReStressFromFoamFile(self,
@@ -997,7 +1178,8 @@ class Surface(object):
                                  dx=None,
                                  dy=None,
                                  interpolationMethod='cubic',
-                                 kind='min_E'):
+                                 kind='min_E',
+                                 resampler=None):
         '''
         '''
         tsm = TriSurfaceMesh.readFromFoamFile(pointsFile=pointsFile,
@@ -1011,38 +1193,17 @@ class Surface(object):
                                                      time=0,
                                                      projectedField=False)                  
 
-        points = np.vstack((tsst.x,tsst.y)).T
+        tensor=np.vstack((tsst.txx,tsst.txy,tsst.txz,tsst.tyy,tsst.tyz,tsst.tzz)).T
 
-        #if not hasattr(self,'data'):
-        if not self.data.has_key('dx') or self.data.has_key('dy'):
+        if not ('dx' in self.data and 'dy' in self.data):
             print 'keys dx and dy does not exist'
-            if dx==None:
-                dxlist=[a for a in np.abs(np.diff(points[:,0])) if a>0]
-                dx=np.min(dxlist)
-            if dy==None:
-                dylist=[a for a in np.abs(np.diff(points[:,1])) if a>0]
-                dy=np.min(dylist)
-
-            MaxX=np.max(points[:,0])
-            MinX=np.min(points[:,0])
-            MaxY=np.max(points[:,1])
-            MinY=np.min(points[:,1])
-            extent=[MinX,MaxX,MinY,MaxY]
-            #print MinX,MaxX,MinY,MaxY
-
-
-
-            cellsX=int((MaxX-MinX)/dx)
-            cellsY=int((MaxY-MinY)/dy)
-            #print cellsX,cellsY
-            grid_y, grid_x = np.mgrid[MinY:MaxY:np.complex(0,cellsY),MinX:MaxX:np.complex(0,cellsX)]
-            triang = tsst.triangulation            
-            uu_bar=self.interpolateField(tsst.txx, grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            uv_bar=self.interpolateField(tsst.txy, grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            uw_bar=self.interpolateField(tsst.tyy, grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            vv_bar=self.interpolateField(tsst.tyy, grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            vw_bar=self.interpolateField(tsst.tyz, grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            ww_bar=self.interpolateField(tsst.tzz, grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
+            r=self.getResampler(tsst.triangulation,
+                                dx=dx,
+                                dy=dy,
+                                interpolationMethod=interpolationMethod,
+                                kind=kind,
+                                resampler=resampler)
+            uu_bar,uv_bar,uw_bar,vv_bar,vw_bar,ww_bar=r.resample(tensor)
             vx_i=np.empty(uu_bar.shape)
             vy_i=np.empty(uu_bar.shape)
             vz_i=np.empty(uu_bar.shape)
@@ -1050,53 +1211,31 @@ class Surface(object):
             vy_i[:]=np.NAN
             vz_i[:]=np.NAN
 
-            self.vx=np.flipud(vx_i)
-            self.vy=np.flipud(vy_i)
-            self.vz=np.flipud(vz_i)
-            self.extent=extent
-            self.dx=dx
-            self.dy=dy
-            self.minX=MinX
-            self.maxX=MaxX
-            self.minY=MinY
-            self.maxY=MaxY
+            self.vx=vx_i
+            self.vy=vy_i
+            self.vz=vz_i
+            self.setGridFromResampler(r)
             self.createDataDict()
 
-            print 'adding Tensor'
-            self.data['uu_bar']=np.flipud(uu_bar)
-            self.data['uv_bar']=np.flipud(uv_bar)
-            self.data['uw_bar']=np.flipud(uw_bar)
-            self.data['vv_bar']=np.flipud(vv_bar)
-            self.data['vw_bar']=np.flipud(vw_bar)
-            self.data['ww_bar']=np.flipud(ww_bar)
-            self.data['TKE_bar']=0.5*(self.data['uu_bar']+self.data['vv_bar']+self.data['ww_bar'])
-
         else:
             print 'dict exists'
-            MaxX=self.maxX
-            MinX=self.minX
-            MaxY=self.maxY
-            MinY=self.minY
-
-            cellsX=int((MaxX-MinX)/self.dx)
-            cellsY=int((MaxY-MinY)/self.dy)
-            #print cellsX,cellsY
-            grid_y, grid_x = np.mgrid[MinY:MaxY:np.complex(0,cellsY),MinX:MaxX:np.complex(0,cellsX)]
-            triang = tsst.triangulation
-            uu_bar=self.interpolateField(tsst.txx, grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            uv_bar=self.interpolateField(tsst.txy, grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            uw_bar=self.interpolateField(tsst.tyy, grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            vv_bar=self.interpolateField(tsst.tyy, grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            vw_bar=self.interpolateField(tsst.tyz, grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            ww_bar=self.interpolateField(tsst.tzz, grid_x, grid_y, triang, method=interpolationMethod, kind=kind)
-            print 'adding Tensor'
-            self.data['uu_bar']=np.flipud(uu_bar)
-            self.data['uv_bar']=np.flipud(uv_bar)
-            self.data['uw_bar']=np.flipud(uw_bar)
-            self.data['vv_bar']=np.flipud(vv_bar)
-            self.data['vw_bar']=np.flipud(vw_bar)
-            self.data['ww_bar']=np.flipud(ww_bar)
-            self.data['TKE_bar']=0.5*(self.data['uu_bar']+self.data['vv_bar']+self.data['ww_bar'])
+            r=self.getResampler(tsst.triangulation,
+                                dx=self.dx,
+                                dy=self.dy,
+                                interpolationMethod=interpolationMethod,
+                                kind=kind,
+                                resampler=resampler,
+                                bounds=[self.minX,self.maxX,self.minY,self.maxY])
+            uu_bar,uv_bar,uw_bar,vv_bar,vw_bar,ww_bar=r.resample(tensor)
+
+        print 'adding Tensor'
+        self.data['uu_bar']=uu_bar
+        self.data['uv_bar']=uv_bar
+        self.data['uw_bar']=uw_bar
+        self.data['vv_bar']=vv_bar
+        self.data['vw_bar']=vw_bar
+        self.data['ww_bar']=ww_bar
+        self.data['TKE_bar']=0.5*(self.data['uu_bar']+self.data['vv_bar']+self.data['ww_bar'])
 
 
 def getVC7SurfaceList(directory,nr=0,step=1):
@@ -1167,6 +1306,37 @@ def getIM7SurfaceList(directory,nr=0,step=1):
         surfaces[i].readFromIM7(os.path.join(directory,filelist[i]))
     return surfaces
 
+def getRegionSlices(grid,region,shape):
+    '''
+    Return the (rows,cols) slices of a region of interest on the grid of a
+    Surface or SurfaceTimeSeries of shape "shape" (ny,nx). region can be a
+    rect object or a tuple of slices. The steps of the slices must be
+    positive (the orientation of the grid is kept).
+    '''
+    if isinstance(region,rect):
+        region=region.getSlice(grid)
+    rows,cols=region
+    if not isinstance(rows,slice) or not isinstance(cols,slice):
+        raise ValueError('region must be a rect or a tuple of two slices.')
+    if (rows.step is not None and rows.step<=0) or (cols.step is not None and cols.step<=0):
+        raise ValueError('the steps of the region slices must be positive.')
+    return slice(*rows.indices(shape[0])),slice(*cols.indices(shape[1]))
+
+def setViewGrid(src,tgt,rows,cols,shape):
+    '''
+    Set dx,dy,minX,maxX,minY,maxY and extent of tgt, the view rows,cols of
+    src.
+    '''
+    nrows=len(range(*rows.indices(shape[0])))
+    ncols=len(range(*cols.indices(shape[1])))
+    tgt.dx=src.dx*cols.step
+    tgt.dy=src.dy*rows.step
+    tgt.minX=src.minX+cols.start*src.dx
+    tgt.maxY=src.maxY-rows.start*src.dy
+    tgt.maxX=tgt.minX+(ncols-1)*tgt.dx
+    tgt.minY=tgt.maxY-(nrows-1)*tgt.dy
+    tgt.extent=[tgt.minX-(tgt.dx/2),tgt.maxX+(tgt.dx/2),tgt.minY-(tgt.dy/2),tgt.maxY+(tgt.dy/2)]
+
 class rect(object):
     '''
     Defines a rectangle using the cooridnate of two points
@@ -1193,6 +1363,26 @@ class rect(object):
 
         return (xmin,ymin)
 
+    def getSlice(self,surface):
+        '''
+        Returns the pixel slices (rows,cols) of the cells of surface (Surface
+        or SurfaceTimeSeries) whose center is inside the rectangle. Indexing
+        a field with them returns a view:
+            >>> rows,cols=myRect.getSlice(s)
+            >>> s.vx[rows,cols]
+        '''
+        xmin,ymin=self.p1()
+        xmax=xmin+self.width()
+        ymax=ymin+self.height()
+        nx=int(np.round((surface.maxX-surface.minX)/surface.dx))+1
+        ny=int(np.round((surface.maxY-surface.minY)/surface.dy))+1
+        # row 0 is at maxY
+        j0=max(int(np.ceil((xmin-surface.minX)/surface.dx-1e-6)),0)
+        j1=min(int(np.floor((xmax-surface.minX)/surface.dx+1e-6)),nx-1)
+        i0=max(int(np.ceil((surface.maxY-ymax)/surface.dy-1e-6)),0)
+        i1=min(int(np.floor((surface.maxY-ymin)/surface.dy+1e-6)),ny-1)
+        return np.s_[i0:i1+1,j0:j1+1]
+
 class IM7(object):
     def __init__(self,filename):
         '''
@@ -1292,4 +1482,36 @@ class SurfaceTimeSeries(object):
         self.data['frq']=frq
         self.data['dt']=1.0/frq       
         self.t=np.linspace(0,(self.vx.shape[0]-1)/self.data['frq'],self.vx.shape[0])
-        self.data['t'] = self.t
\ No newline at end of file
+        self.data['t'] = self.t
+
+    def getView(self,region,frames=slice(None)):
+        '''
+        Return a SurfaceTimeSeries of the region of interest "region". vx, vy
+        and vz are strided numpy views (no copy) of the current fields.
+        
+        Arguments:
+            *region*: rect object or tuple of slices.
+             Region of interest, as a rect in physical coordinates (see
+             rect.getSlice) or as pixel slices created with np.s_ (positive
+             steps only).
+             
+            *frames*: python slice.
+             Frames of the view. Default=slice(None) (all the frames).
+             
+        Returns:
+            *sts*: pyFlowStat.SurfaceTimeSeries object.
+        '''
+        rows,cols=getRegionSlices(self,region,self.vx.shape[1:])
+        sts=SurfaceTimeSeries()
+        sts.vx=self.vx[frames,rows,cols]
+        sts.vy=self.vy[frames,rows,cols]
+        sts.vz=self.vz[frames,rows,cols]
+        sts.t=np.asarray(self.t)[frames]
+        setViewGrid(self,sts,rows,cols,self.vx.shape[1:])
+        sts.data.update(self.data)
+        if 't' in self.data:
+            sts.data['t']=sts.t
+            step=frames.indices(self.vx.shape[0])[2]
+            sts.data['dt']=self.data['dt']*step
+            sts.data['frq']=1.0/sts.data['dt']
+        return sts
\ No newline at end of file
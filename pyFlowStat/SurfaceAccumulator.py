@@ -0,0 +1,316 @@
+'''
+SurfaceAccumulator.py
+
+Single pass (streaming) statistics of a sequence of Surfaces: mean, rms,
+Reynolds stress tensor, number of valid samples and optionally skewness and
+flatness. The frames are not stored.
+'''
+
+#=============================================================================#
+# load modules
+#=============================================================================#
+#scientific modules
+import numpy as np
+
+import pyFlowStat.Surface as sr
+
+
+class SurfaceAccumulator(object):
+    '''
+    Streaming, NaN aware accumulator of the statistics of a velocity field
+    sequence (PIV frames, interpolated CFD surfaces...).
+
+    Frames are added one by one (addSurface) or by chunks (addFrames,
+    addSurfaceList). The statistics are updated with the pairwise formulas of
+    Chan et al., which are stable even for large mean values. For each pixel,
+    a frame is a valid sample if vx, vy and vz are not NaN. Accumulators
+    filled in parallel (for example one per HDF5 file or per process) can be
+    merged with merge().
+
+    The results are returned as a Surface (see getSurface) with the keys of
+    Surface.readReStressFromFoamFile: 'uu_bar', 'vv_bar', 'ww_bar', 'uv_bar',
+    'uw_bar', 'vw_bar', 'TKE_bar'.
+
+    Usage:
+        >>> acc = SurfaceAccumulator(higherMoments=True)
+        >>> acc.addSurfaceList(SurfaceFunctions.iterSurfaces_hdf5(h5obj),chunkSize=100)
+        >>> meanSurface = acc.getSurface()
+        >>> meanSurface.data['uv_bar']
+    '''
+
+    # index of the components of the symmetric tensor {ui*uj}
+    tensorComp = [(0,0),(0,1),(0,2),(1,1),(1,2),(2,2)]
+
+    # constructors #
+    #--------------#
+    def __init__(self,higherMoments=False):
+        '''
+        base constructor.
+
+        Arguments:
+            *higherMoments*: python bool.
+             Accumulate the third and fourth moments of each component to get
+             skewness and flatness. Default=False.
+        '''
+        self.higherMoments = higherMoments
+
+        # pixel-wise accumulators, created with the first frame
+        self.n = None
+        self.mean = None
+        self.M2 = None
+        self.M3 = None
+        self.M4 = None
+
+        self.dx = float()
+        self.dy = float()
+        self.minX = float()
+        self.maxX = float()
+        self.minY = float()
+        self.maxY = float()
+        self.extent = []
+
+
+    # getters #
+    #---------#
+    @property
+    def shape(self):
+        return self.n.shape
+
+    @property
+    def nFrames(self):
+        '''
+        Number of valid samples, shape=(ny,nx).
+        '''
+        return self.n
+
+
+    # class methods #
+    #---------------#
+    def addSurface(self,surface):
+        '''
+        Add the velocity field (vx,vy,vz) of a Surface.
+        '''
+        self.setGrid(surface)
+        self.addFrames(surface.vx,surface.vy,surface.vz)
+
+    def addSurfaceList(self,surfaceList,chunkSize=50):
+        '''
+        Add the velocity fields of a list of Surfaces, or of any python iterable
+        returning Surfaces (for example SurfaceFunctions.iterSurfaces_hdf5).
+        The surfaces are stacked by chunks of chunkSize frames, which are
+        added with one vectorized update.
+
+        Arguments:
+            *surfaceList*: python list or iterable of Surface objects.
+
+            *chunkSize*: python int.
+             Number of frames added at once. Default=50.
+        '''
+        chunk = []
+        for s in surfaceList:
+            self.setGrid(s)
+            chunk.append((s.vx,s.vy,s.vz))
+            if len(chunk)==chunkSize:
+                self.addFrames(*np.array(chunk).transpose((1,0,2,3)))
+                chunk = []
+        if len(chunk)>0:
+            self.addFrames(*np.array(chunk).transpose((1,0,2,3)))
+
+    def addFrames(self,vx,vy,vz):
+        '''
+        Add one frame (arrays of shape (ny,nx)) or a chunk of frames (arrays of
+        shape (T,ny,nx)) to the statistics.
+
+        Arguments:
+            *vx*, *vy*, *vz*: numpy.array of shape=(ny,nx) or (T,ny,nx).
+             Velocity components. NaN values are ignored.
+        '''
+        U = np.array([vx,vy,vz],dtype=float)
+        if U.ndim==3:
+            U = U[:,np.newaxis]
+
+        valid = np.all(np.isfinite(U),axis=0)
+        nB = np.sum(valid,axis=0)
+        U = np.where(valid[np.newaxis],U,0.0)
+        nBsafe = np.maximum(nB,1)
+        meanB = np.sum(U,axis=1)/nBsafe
+        dev = np.where(valid[np.newaxis],U-meanB[:,np.newaxis],0.0)
+
+        M2B = np.array([np.sum(dev[i]*dev[j],axis=0) for i,j in self.tensorComp])
+        M3B = None
+        M4B = None
+        if self.higherMoments:
+            M3B = np.sum(dev**3,axis=1)
+            M4B = np.sum(dev**4,axis=1)
+        self._combine(nB,meanB,M2B,M3B,M4B)
+
+    def merge(self,other):
+        '''
+        Merge the statistics of an other SurfaceAccumulator (for example
+        filled by another process with other frames) in the current one.
+        '''
+        if other.n is None:
+            return
+        if self.higherMoments and not other.higherMoments:
+            raise ValueError('other SurfaceAccumulator has no higher moments.')
+        if self.n is None:
+            self.dx = other.dx
+            self.dy = other.dy
+            self.minX = other.minX
+            self.maxX = other.maxX
+            self.minY = other.minY
+            self.maxY = other.maxY
+            self.extent = other.extent
+        M3B = None
+        M4B = None
+        if self.higherMoments:
+            M3B = other.M3
+            M4B = other.M4
+        self._combine(other.n,other.mean,other.M2,M3B,M4B)
+
+    def _combine(self,nB,meanB,M2B,M3B=None,M4B=None):
+        '''
+        Pairwise update of the accumulators with the statistics of a set B.
+        '''
+        if self.n is None:
+            self.n = np.zeros(nB.shape,dtype=np.int64)
+            self.mean = np.zeros(meanB.shape)
+            self.M2 = np.zeros(M2B.shape)
+            if self.higherMoments:
+                self.M3 = np.zeros(meanB.shape)
+                self.M4 = np.zeros(meanB.shape)
+        elif nB.shape!=self.n.shape:
+            raise ValueError('frame shape '+str(nB.shape)+' does not match '
+                             'accumulator shape '+str(self.n.shape)+'.')
+
+        nA = self.n.astype(float)
+        nBf = nB.astype(float)
+        n = nA+nBf
+        nSafe = np.maximum(n,1.0)
+        delta = meanB-self.mean
+
+        if self.higherMoments:
+            # uses the second moments of A and B before the update
+            M2A = self.M2[[0,3,5]]
+            M2Bd = M2B[[0,3,5]]
+            M4 = (self.M4+M4B
+                  +delta**4*nA*nBf*(nA**2-nA*nBf+nBf**2)/nSafe**3
+                  +6.0*delta**2*(nA**2*M2Bd+nBf**2*M2A)/nSafe**2
+                  +4.0*delta*(nA*M3B-nBf*self.M3)/nSafe)
+            M3 = (self.M3+M3B
+                  +delta**3*nA*nBf*(nA-nBf)/nSafe**2
+                  +3.0*delta*(nA*M2Bd-nBf*M2A)/nSafe)
+            self.M3 = M3
+            self.M4 = M4
+
+        for k,(i,j) in enumerate(self.tensorComp):
+            self.M2[k] = self.M2[k]+M2B[k]+delta[i]*delta[j]*nA*nBf/nSafe
+        self.mean = self.mean+delta*nBf/nSafe
+        self.n = self.n+nB
+
+    def setGrid(self,surface):
+        '''
+        Copy the grid definition (dx,dy,minX,maxX,minY,maxY,extent) of
+        surface.
+        '''
+        self.dx = surface.dx
+        self.dy = surface.dy
+        self.minX = surface.minX
+        self.maxX = surface.maxX
+        self.minY = surface.minY
+        self.maxY = surface.maxY
+        self.extent = surface.extent
+
+    def getMean(self):
+        '''
+        Returns the mean velocity, numpy.array of shape=(3,ny,nx). NaN where
+        there is no valid sample.
+        '''
+        res = self.mean.copy()
+        res[:,self.n==0] = np.nan
+        return res
+
+    def getReynoldsStress(self):
+        '''
+        Returns the Reynolds stress tensor {ui*uj} as a dict with the keys
+        'uu_bar', 'uv_bar', 'uw_bar', 'vv_bar', 'vw_bar', 'ww_bar' and
+        'TKE_bar'. NaN where there is no valid sample.
+        '''
+        R = self.M2/np.maximum(self.n,1)
+        R[:,self.n==0] = np.nan
+        res = dict()
+        for k,key in enumerate(['uu_bar','uv_bar','uw_bar','vv_bar','vw_bar','ww_bar']):
+            res[key] = R[k]
+        res['TKE_bar'] = 0.5*(res['uu_bar']+res['vv_bar']+res['ww_bar'])
+        return res
+
+    def getRms(self):
+        '''
+        Returns the rms of the velocity fluctuations, numpy.array of
+        shape=(3,ny,nx).
+        '''
+        R = self.getReynoldsStress()
+        return np.sqrt(np.array([R['uu_bar'],R['vv_bar'],R['ww_bar']]))
+
+    def getSkewness(self):
+        '''
+        Returns the skewness of the velocity components, numpy.array of
+        shape=(3,ny,nx). Requires higherMoments=True.
+        '''
+        if not self.higherMoments:
+            raise ValueError('higher moments not accumulated. Use higherMoments=True.')
+        M2 = self.M2[[0,3,5]]
+        with np.errstate(divide='ignore',invalid='ignore'):
+            res = np.sqrt(self.n)*self.M3/M2**1.5
+        res[:,self.n==0] = np.nan
+        return res
+
+    def getFlatness(self):
+        '''
+        Returns the flatness (kurtosis) of the velocity components,
+        numpy.array of shape=(3,ny,nx). Requires higherMoments=True.
+        '''
+        if not self.higherMoments:
+            raise ValueError('higher moments not accumulated. Use higherMoments=True.')
+        M2 = self.M2[[0,3,5]]
+        with np.errstate(divide='ignore',invalid='ignore'):
+            res = self.n*self.M4/M2**2
+        res[:,self.n==0] = np.nan
+        return res
+
+    def getSurface(self):
+        '''
+        Returns a Surface holding the statistics. vx, vy and vz are the mean
+        velocity. The following keys are added to the data dictionary:
+            * Ux, Uy, Uz, dx, dy: see Surface.createDataDict
+            * uu_bar, uv_bar, uw_bar, vv_bar, vw_bar, ww_bar: Reynolds stresses
+            * TKE_bar: turbulent kinetic energy
+            * ux_rms, uy_rms, uz_rms: rms of the fluctuations
+            * nSamples: number of valid samples
+            * ux_skew, uy_skew, uz_skew, ux_flat, uy_flat, uz_flat: skewness
+              and flatness, if higherMoments=True
+        '''
+        s = sr.Surface()
+        s.vx,s.vy,s.vz = self.getMean()
+        s.dx = self.dx
+        s.dy = self.dy
+        s.minX = self.minX
+        s.maxX = self.maxX
+        s.minY = self.minY
+        s.maxY = self.maxY
+        s.extent = self.extent
+        s.createDataDict()
+
+        s.data.update(self.getReynoldsStress())
+        rms = self.getRms()
+        s.data['ux_rms'] = rms[0]
+        s.data['uy_rms'] = rms[1]
+        s.data['uz_rms'] = rms[2]
+        s.data['nSamples'] = self.n.copy()
+        if self.higherMoments:
+            skew = self.getSkewness()
+            flat = self.getFlatness()
+            for i,c in enumerate(['ux','uy','uz']):
+                s.data[c+'_skew'] = skew[i]
+                s.data[c+'_flat'] = flat[i]
+        return s
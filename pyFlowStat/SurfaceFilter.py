@@ -0,0 +1,327 @@
+'''
+SurfaceFilter.py
+
+Validation and filtering of PIV velocity fields stored as stacks of frames
+(SurfaceTimeSeries or numpy arrays of shape (T,ny,nx)). All filters work on
+the whole stack at once with scipy.ndimage filters; long series are processed
+by chunks of frames, optionally in parallel threads.
+
+Functions included:
+    * normalizedMedianTest: universal outlier detection
+    * replaceVectors: replacement of rejected vectors by the local median or
+      by interpolation of the valid neighbours
+    * smoothField: NaN aware gaussian smoothing
+    * medianFilter: batched median filter (same result as scipy.signal.medfilt
+      applied frame by frame)
+    * filterTimeSeries: validation, replacement and smoothing of a
+      SurfaceTimeSeries
+    * packMask, unpackMask, getRejectedMask: compact storage of the masks of
+      rejected vectors
+'''
+
+#=============================================================================#
+# load modules
+#=============================================================================#
+import warnings
+from multiprocessing.pool import ThreadPool
+
+#scientific modules
+import numpy as np
+import scipy.ndimage as ndimage
+
+
+#=============================================================================#
+# functions
+#=============================================================================#
+
+def neighbourStack(field,kernelSize=3):
+    '''
+    Stack of the neighbours of each vector in a kernelSize x kernelSize
+    window, without the vector itself. Neighbours outside the field are NaN.
+
+    Arguments:
+        *field*: numpy array of shape (T,ny,nx).
+
+        *kernelSize*: python int (odd).
+         Size of the window. Default=3.
+
+    Returns:
+        *stack*: numpy array of shape (kernelSize**2-1,T,ny,nx).
+    '''
+    r = kernelSize//2
+    ny,nx = field.shape[1:]
+    padded = np.empty((field.shape[0],ny+2*r,nx+2*r))
+    padded[:] = np.nan
+    padded[:,r:r+ny,r:r+nx] = field
+    stack = np.empty((kernelSize**2-1,)+field.shape)
+    n = 0
+    for i in range(kernelSize):
+        for j in range(kernelSize):
+            if i==r and j==r:
+                continue
+            stack[n] = padded[:,i:i+ny,j:j+nx]
+            n = n+1
+    return stack
+
+def _nanmedian(a,axis=0):
+    '''
+    np.nanmedian without the "All-NaN slice" warnings.
+    '''
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore',RuntimeWarning)
+        return np.nanmedian(a,axis=axis)
+
+def normalizedMedianTest(components,kernelSize=3,threshold=2.0,eps=0.1):
+    '''
+    Normalized median test (universal outlier detection) of Westerweel and
+    Scarano (2005). For each component, the residual of a vector is its
+    distance to the median of its neighbours, normalized by the median of the
+    residuals of the neighbours plus eps:
+        r = |U0-Um|/(median(|Ui-Um|)+eps)
+    A vector is rejected if the norm of the residuals of its components is
+    larger than threshold, or if one of its components is not finite.
+
+    Arguments:
+        *components*: list of numpy arrays of shape (T,ny,nx).
+         Velocity components, for example [vx,vy] or [vx,vy,vz].
+
+        *kernelSize*: python int (odd).
+         Size of the neighbourhood. Default=3.
+
+        *threshold*: python float.
+         Rejection threshold. Default=2.0.
+
+        *eps*: python float.
+         Acceptable fluctuation level, in the unit of the velocity (typically
+         0.1 pixel). Default=0.1.
+
+    Returns:
+        *rejected*: numpy bool array of shape (T,ny,nx).
+    '''
+    r2 = np.zeros(components[0].shape)
+    invalid = np.zeros(components[0].shape,dtype=bool)
+    for comp in components:
+        comp = np.asarray(comp,dtype=float)
+        invalid = invalid | ~np.isfinite(comp)
+        stack = neighbourStack(comp,kernelSize)
+        Um = _nanmedian(stack)
+        rm = _nanmedian(np.abs(stack-Um))
+        r2 = r2+(np.abs(comp-Um)/(rm+eps))**2
+    with np.errstate(invalid='ignore'):
+        return invalid | (np.sqrt(r2)>threshold)
+
+def replaceVectors(field,rejected,method='median',kernelSize=3,maxIter=10):
+    '''
+    Replace the rejected vectors of a field by the median of the valid
+    neighbours (method='median') or by the mean of the valid neighbours in a
+    kernelSize x kernelSize window (method='interpolation'). The interpolation
+    is repeated (maximum maxIter times) to fill clusters of rejected vectors.
+    Vectors without valid neighbours are NaN.
+
+    Arguments:
+        *field*: numpy array of shape (T,ny,nx).
+
+        *rejected*: numpy bool array of shape (T,ny,nx).
+
+        *method*: python string.
+         'median' or 'interpolation'. Default='median'.
+
+        *kernelSize*: python int (odd).
+         Size of the neighbourhood. Default=3.
+
+        *maxIter*: python int.
+         Maximal number of passes of the interpolation. Default=10.
+
+    Returns:
+        *res*: numpy array of shape (T,ny,nx).
+    '''
+    res = np.where(rejected,np.nan,field)
+    if method=='median':
+        fill = _nanmedian(neighbourStack(res,kernelSize))
+        return np.where(rejected,fill,res)
+    elif method=='interpolation':
+        size = (1,kernelSize,kernelSize)
+        for i in range(maxIter):
+            valid = np.isfinite(res)
+            holes = rejected & ~valid
+            if not np.any(holes):
+                break
+            num = ndimage.uniform_filter(np.where(valid,res,0.0),size=size,mode='constant')
+            den = ndimage.uniform_filter(valid.astype(float),size=size,mode='constant')
+            fillable = holes & (den>1e-12)
+            if not np.any(fillable):
+                break
+            res[fillable] = num[fillable]/den[fillable]
+        return res
+    else:
+        raise ValueError('method '+str(method)+' is not valid. Use \'median\' or \'interpolation\'.')
+
+def smoothField(field,sigma=1.0):
+    '''
+    Gaussian smoothing of each frame of a field, ignoring NaN values
+    (normalized convolution). NaN values stay NaN.
+
+    Arguments:
+        *field*: numpy array of shape (T,ny,nx).
+
+        *sigma*: python float.
+         Standard deviation of the gaussian kernel, in pixels. Default=1.0.
+
+    Returns:
+        *res*: numpy array of shape (T,ny,nx).
+    '''
+    valid = np.isfinite(field)
+    s = (0,sigma,sigma)
+    num = ndimage.gaussian_filter(np.where(valid,field,0.0),sigma=s,mode='constant')
+    den = ndimage.gaussian_filter(valid.astype(float),sigma=s,mode='constant')
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return np.where(valid,num/den,np.nan)
+
+def medianFilter(field,kernelSize=3):
+    '''
+    Median filter of size kernelSize x kernelSize applied to each frame of a
+    stack of frames. The two last axes of field are the spatial axes, all
+    the other axes are frames or components. The result is the same as
+    scipy.signal.medfilt applied frame by frame (zero padding).
+
+    Arguments:
+        *field*: numpy array of shape (...,ny,nx).
+
+        *kernelSize*: python int (odd).
+         Size of the kernel. Default=3.
+
+    Returns:
+        *res*: numpy array of same shape as field.
+    '''
+    size = (1,)*(field.ndim-2)+(kernelSize,kernelSize)
+    return ndimage.median_filter(field,size=size,mode='constant',cval=0.0)
+
+def packMask(mask):
+    '''
+    Pack a bool mask of shape (T,ny,nx) in a bitmap of shape (T,nbytes), one
+    bit per vector.
+    '''
+    mask = np.asarray(mask,dtype=bool)
+    return np.packbits(mask.reshape(mask.shape[0],-1),axis=1)
+
+def unpackMask(packed,shape):
+    '''
+    Unpack a bitmap created with packMask. shape is the shape (ny,nx) of a
+    frame.
+
+    Returns:
+        *mask*: numpy bool array of shape (T,ny,nx).
+    '''
+    n = shape[0]*shape[1]
+    mask = np.unpackbits(packed,axis=1)[:,:n]
+    return mask.reshape((packed.shape[0],)+tuple(shape)).astype(bool)
+
+def getRejectedMask(sts,frame=None):
+    '''
+    Returns the mask of the vectors rejected by filterTimeSeries, numpy bool
+    array of shape (T,ny,nx), or (ny,nx) for a single frame.
+    '''
+    packed = sts.data['rejectedMask']
+    shape = sts.vx.shape[1:]
+    if frame is None:
+        return unpackMask(packed,shape)
+    return unpackMask(packed[frame:frame+1],shape)[0]
+
+def _filterChunk(components,kernelSize,threshold,eps,replace,sigma):
+    '''
+    Validation, replacement and smoothing of a chunk of frames.
+    '''
+    rejected = normalizedMedianTest(components,kernelSize=kernelSize,threshold=threshold,eps=eps)
+    res = []
+    for comp in components:
+        if replace is not None:
+            comp = replaceVectors(comp,rejected,method=replace,kernelSize=kernelSize)
+        else:
+            comp = np.where(rejected,np.nan,comp)
+        if sigma>0:
+            comp = smoothField(comp,sigma=sigma)
+        res.append(comp)
+    return res,rejected
+
+def filterTimeSeries(sts,
+                     kernelSize=3,
+                     threshold=2.0,
+                     eps=0.1,
+                     replace='median',
+                     sigma=0.0,
+                     stereo=True,
+                     chunkSize=100,
+                     nThreads=1):
+    '''
+    Filter the velocity fields of a SurfaceTimeSeries: normalized median test,
+    replacement of the rejected vectors and optional gaussian smoothing. vx,
+    vy and vz are replaced by the filtered fields (the original arrays are
+    not modified). The mask of the rejected vectors is stored as a bitmap
+    under the key 'rejectedMask' of sts.data (see getRejectedMask).
+
+    Arguments:
+        *sts*: SurfaceTimeSeries object.
+
+        *kernelSize*: python int (odd).
+         Size of the neighbourhood. Default=3.
+
+        *threshold*: python float.
+         Threshold of the normalized median test. Default=2.0.
+
+        *eps*: python float.
+         Acceptable fluctuation level of the normalized median test.
+         Default=0.1.
+
+        *replace*: python string or None.
+         'median', 'interpolation' or None. If None, the rejected vectors are
+         set to NaN. Default='median'.
+
+        *sigma*: python float.
+         Standard deviation of the gaussian smoothing, in pixels. No
+         smoothing if sigma=0. Default=0.0.
+
+        *stereo*: python bool.
+         If True, vz is used by the outlier detection and filtered. Default=True.
+
+        *chunkSize*: python int.
+         Number of frames processed at once. Default=100.
+
+        *nThreads*: python int.
+         Number of threads processing the chunks. Default=1.
+
+    Returns:
+        *nRejected*: numpy array of shape (T,). Number of rejected vectors
+         per frame.
+    '''
+    if stereo:
+        names = ['vx','vy','vz']
+    else:
+        names = ['vx','vy']
+    components = [np.asarray(getattr(sts,name),dtype=float) for name in names]
+    nFrames = components[0].shape[0]
+    results = [np.empty(comp.shape) for comp in components]
+    rejected = np.empty(components[0].shape,dtype=bool)
+
+    def work(start):
+        chunk = [comp[start:start+chunkSize] for comp in components]
+        res,rej = _filterChunk(chunk,kernelSize,threshold,eps,replace,sigma)
+        for i in range(len(res)):
+            results[i][start:start+chunkSize] = res[i]
+        rejected[start:start+chunkSize] = rej
+
+    starts = range(0,nFrames,chunkSize)
+    if nThreads>1:
+        pool = ThreadPool(nThreads)
+        try:
+            pool.map(work,starts)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for start in starts:
+            work(start)
+
+    for name,res in zip(names,results):
+        setattr(sts,name,res)
+    sts.data['rejectedMask'] = packMask(rejected)
+    return np.sum(rejected.reshape(nFrames,-1),axis=1)
@@ -16,6 +16,7 @@ Functions included:
 #import os
 #import csv
 #import collections
+import warnings
 import h5py
 
 #scientific modules
@@ -27,7 +28,6 @@ import scipy as sp
 
 #from pyFlowStat.TurbulenceTools import TurbulenceTools as tt
 import pyFlowStat.PointProbe as pp
-import pyFlowStat.TurbulenceTools as tt
 import pyFlowStat.Surface as sr
 
 
@@ -35,10 +35,17 @@ import pyFlowStat.Surface as sr
 # functions
 #=============================================================================#
 
-def saveSurfaceList_hdf5(surfaceList,hdf5file,keyrange='raw',mode='w-'):
+def saveSurfaceList_hdf5(surfaceList,
+                         hdf5file,
+                         keyrange='raw',
+                         mode='w-',
+                         pixelIndex=False,
+                         layout=1,
+                         compression='gzip',
+                         chunks=None):
     '''
-    Save a surface list in a hdf5 data file. The hdf5 file will have the
-    following minimal structure:
+    Save a surface list in a hdf5 data file. With layout=1, the hdf5 file will
+    have the following minimal structure:
 
     myData.hdf5:
         * Surface1  (GROUP)
@@ -54,6 +61,20 @@ def saveSurfaceList_hdf5(surfaceList,hdf5file,keyrange='raw',mode='w-'):
             * 'dim'  (DATASET)
             * 'dimExtent' (DATASET)
 
+    With layout=2, each field is a single extendable, chunked and compressed
+    dataset of shape (T,ny,nx) and the grid is saved once as attributes:
+
+    myData.hdf5:   (ATTRIBUTES 'layoutVersion'=2, 'dx', 'dy', 'dim', 'dimExtent')
+        * 'vx'   (DATASET, shape=(T,ny,nx))
+        * 'vy'   (DATASET, shape=(T,ny,nx))
+        * 'vz'   (DATASET, shape=(T,ny,nx))
+        * data  (GROUP, only if keyrange='full')
+            * key  (DATASET, shape=(T,ny,nx))
+
+    Frames can be added later with appendSurfaceList_hdf5 and read by
+    slices with loadSurfaceArrays_hdf5. All the loaders of this module read
+    both layouts.
+
     Arguments:
         *surfaceList*: python list.
          A list of surfaces.
@@ -63,40 +84,62 @@ def saveSurfaceList_hdf5(surfaceList,hdf5file,keyrange='raw',mode='w-'):
          defines which keys will be be saved the hdf5 file. if keyrange='raw',
          only vx,vy and vz are saved, if keyrange='full', 'raw' plus every keys
          in the surface are saved. Default='raw'.
+        *pixelIndex*: python bool.
+         Also save the pixel-major copy of the velocity (see
+         buildPixelIndex_hdf5), used by loadPPfromSurf_hdf5 and
+         loadPPlistFromSurf_hdf5 to read the time series of a pixel at once.
+         Default=False.
+        *layout*: python int.
+         Layout of the hdf5 file, 1 (one group per surface) or 2 (one
+         dataset per field). Default=1.
+        *compression*: python string.
+         Compression filter of the layout 2 datasets: 'gzip', 'lzf' or None.
+         Default='gzip'.
+        *chunks*: python tuple.
+         Chunk shape of the layout 2 datasets. If None, chunks of about 1MB
+         holding complete frames are used. Default=None.
          
     Returns:
         None
     '''
     fwm = h5py.File(hdf5file, mode)
     try:
-        for i in range(len(surfaceList)):
-            # group name
-            gName = 'Surface'+str(i)
-            gsurfi = fwm.create_group(gName)
-
-            # save minimal data
-            gsurfi.create_dataset('vx',data=surfaceList[i].vx)
-            gsurfi.create_dataset('vy',data=surfaceList[i].vy)
-            gsurfi.create_dataset('vz',data=surfaceList[i].vz)
-
-            gsurfi.create_dataset('dx',data=surfaceList[i].dx)
-            gsurfi.create_dataset('dy',data=surfaceList[i].dy)
-
-            dim=[surfaceList[i].minX, surfaceList[i].minY, surfaceList[i].maxX, surfaceList[i].maxY]
-            gsurfi.create_dataset('dim',data=dim)
-            gsurfi.create_dataset('dimExtent',data=surfaceList[i].extent)
-
-            # save extra data if specified:
-            #save nothing more
-            if keyrange=='raw':
-                pass
-            #add all data from the dictionnary
-            elif keyrange=='full':
-                for key in surfaceList[i].data.keys():
-                    if (key=='dx' or key=='dy' or key=='Ux' or key=='Uy' or key=='Uz'):
-                        pass
-                    else:
-                        gsurfi.create_dataset(key,data=surfaceList[i].data[key])
+        if layout==2:
+            _createLayout2(fwm,surfaceList[0],keyrange,compression,chunks)
+            _appendLayout2(fwm,surfaceList)
+        else:
+            for i in range(len(surfaceList)):
+                # group name
+                gName = 'Surface'+str(i)
+                gsurfi = fwm.create_group(gName)
+
+                # save minimal data
+                gsurfi.create_dataset('vx',data=surfaceList[i].vx)
+                gsurfi.create_dataset('vy',data=surfaceList[i].vy)
+                gsurfi.create_dataset('vz',data=surfaceList[i].vz)
+
+                gsurfi.create_dataset('dx',data=surfaceList[i].dx)
+                gsurfi.create_dataset('dy',data=surfaceList[i].dy)
+
+                dim=[surfaceList[i].minX, surfaceList[i].minY, surfaceList[i].maxX, surfaceList[i].maxY]
+                gsurfi.create_dataset('dim',data=dim)
+                gsurfi.create_dataset('dimExtent',data=surfaceList[i].extent)
+
+                # save extra data if specified:
+                #save nothing more
+                if keyrange=='raw':
+                    pass
+                #add all data from the dictionnary
+                elif keyrange=='full':
+                    for key in surfaceList[i].data.keys():
+                        if (key=='dx' or key=='dy' or key=='Ux' or key=='Uy' or key=='Uz'):
+                            pass
+                        else:
+                            gsurfi.create_dataset(key,data=surfaceList[i].data[key])
+        if pixelIndex==True:
+            _createPixelIndex(fwm,len(surfaceList),surfaceList[0].vx.shape)
+            U = np.array([[s.vx,s.vy,s.vz] for s in surfaceList])
+            fwm['pixelIndex'][...] = U.transpose((2,3,0,1))
     finally:
         fwm.close()
 
@@ -139,7 +182,15 @@ def loadSurfaceList_hdf5(hdf5file,keyrange='raw',createDict=False):
     surfaceList = []
     fr = h5py.File(hdf5file, 'r')
     try:
-        for i in range(len(fr.keys())):
+        if getLayout_hdf5(fr)==2:
+            arrays = loadSurfaceArrays_hdf5(fr,keyrange=keyrange)
+            for i in range(arrays['vx'].shape[0]):
+                surfaceList.append(_surfaceFromArrays(fr,arrays,i,keyrange))
+                if createDict==True and keyrange=='raw':
+                    surfaceList[i].createDataDict()
+            return surfaceList
+
+        for i in range(getNumberOfSurfaces_hdf5(fr)):
             gName = 'Surface'+str(i)
             surfaceList.append(sr.Surface())
 
@@ -220,6 +271,10 @@ def loadSurface_hdf5(hdf5fileObj,surfaceNo,keyrange='raw'):
     >>> surf = SurfaceFunctions.loadSurface_hdf5(h5obj,2,keyrange='raw')
     >>> h5obj.close()
     '''
+    if getLayout_hdf5(hdf5fileObj)==2:
+        arrays = loadSurfaceArrays_hdf5(hdf5fileObj,surfaceNo,surfaceNo+1,keyrange=keyrange)
+        return _surfaceFromArrays(hdf5fileObj,arrays,0,keyrange)
+
     s = sr.Surface()
     gName = 'Surface'+str(surfaceNo)
 
@@ -258,6 +313,336 @@ def loadSurface_hdf5(hdf5fileObj,surfaceNo,keyrange='raw'):
     return s
 
 
+def iterSurfaces_hdf5(hdf5fileObj,keyrange='raw',createDict=False):
+    '''
+    Iterate over the surfaces saved in a hdf5 file object, without loading
+    them all in memory. The surfaces are returned in the order Surface0,
+    Surface1,... See loadSurface_hdf5 for the structure of the hdf5 file.
+
+    Arguments:
+        * hdf5fileObj: an h5py file object
+        * keyrange: [string] 'raw' or 'full' (default='raw')
+        * createDict: [bool] create the data dictionary of each surface if
+          keyrange='raw' (default=False)
+
+    Returns:
+        * generator of surface objects (see pyFlowStat.Surface.Surface)
+
+    Examples:
+    >>> import h5py
+    >>> from pyFlowStat.SurfaceAccumulator import SurfaceAccumulator
+    >>> h5obj = h5py.File('mydata.hdf5','r')
+    >>> acc = SurfaceAccumulator()
+    >>> acc.addSurfaceList(iterSurfaces_hdf5(h5obj))
+    >>> h5obj.close()
+    '''
+    for i in range(getNumberOfSurfaces_hdf5(hdf5fileObj)):
+        s = loadSurface_hdf5(hdf5fileObj,i,keyrange=keyrange)
+        if createDict==True and keyrange=='raw':
+            s.createDataDict()
+        yield s
+
+
+def getNumberOfSurfaces_hdf5(hdf5fileObj):
+    '''
+    Return the number of surfaces saved in a hdf5 file object. With the
+    layout 1, only the groups "Surface<i>" are counted, other groups and
+    datasets (for example "pixelIndex") are ignored.
+    '''
+    if getLayout_hdf5(hdf5fileObj)==2:
+        return hdf5fileObj['vx'].shape[0]
+    return len([k for k in hdf5fileObj.keys() if k.startswith('Surface')])
+
+
+def getLayout_hdf5(hdf5fileObj):
+    '''
+    Return the layout (1 or 2) of a surface hdf5 file object. See
+    saveSurfaceList_hdf5.
+    '''
+    return int(hdf5fileObj.attrs.get('layoutVersion',1))
+
+
+def _createLayout2(hdf5fileObj,surface,keyrange,compression,chunks):
+    '''
+    Create the empty datasets and the grid attributes of the layout 2.
+    '''
+    shape = surface.vx.shape
+    if chunks==None:
+        chunks = (max(1,min(64,2**20//(8*shape[0]*shape[1]))),shape[0],shape[1])
+    hdf5fileObj.attrs['layoutVersion'] = 2
+    hdf5fileObj.attrs['dx'] = surface.dx
+    hdf5fileObj.attrs['dy'] = surface.dy
+    hdf5fileObj.attrs['dim'] = [surface.minX, surface.minY, surface.maxX, surface.maxY]
+    hdf5fileObj.attrs['dimExtent'] = surface.extent
+
+    keys = ['vx','vy','vz']
+    if keyrange=='full':
+        hdf5fileObj.create_group('data')
+        for key in surface.data.keys():
+            if key in ['dx','dy','Ux','Uy','Uz'] or np.shape(surface.data[key])!=shape:
+                pass
+            else:
+                keys.append('data/'+str(key))
+    for key in keys:
+        hdf5fileObj.create_dataset(key,
+                                   shape=(0,shape[0],shape[1]),
+                                   maxshape=(None,shape[0],shape[1]),
+                                   dtype=float,
+                                   chunks=chunks,
+                                   compression=compression)
+
+
+def _appendLayout2(hdf5fileObj,surfaceList):
+    '''
+    Append the surfaces of surfaceList at the end of the layout 2 datasets.
+    '''
+    n0 = hdf5fileObj['vx'].shape[0]
+    n1 = n0+len(surfaceList)
+    fields = [('vx',lambda s: s.vx),('vy',lambda s: s.vy),('vz',lambda s: s.vz)]
+    if 'data' in hdf5fileObj:
+        for key in hdf5fileObj['data'].keys():
+            fields.append(('data/'+key,lambda s,key=key: s.data[key]))
+    for name,getter in fields:
+        ds = hdf5fileObj[name]
+        ds.resize(n1,axis=0)
+        ds[n0:n1] = np.array([getter(s) for s in surfaceList])
+
+
+def _surfaceFromArrays(hdf5fileObj,arrays,i,keyrange='raw'):
+    '''
+    Create the Surface number i of the arrays returned by
+    loadSurfaceArrays_hdf5, with the grid attributes of a layout 2 file.
+    '''
+    s = sr.Surface()
+    s.vx = arrays['vx'][i]
+    s.vy = arrays['vy'][i]
+    s.vz = arrays['vz'][i]
+    s.dx = hdf5fileObj.attrs['dx']
+    s.dy = hdf5fileObj.attrs['dy']
+    dim = hdf5fileObj.attrs['dim']
+    s.minX = dim[0]
+    s.minY = dim[1]
+    s.maxX = dim[2]
+    s.maxY = dim[3]
+    s.extent = hdf5fileObj.attrs['dimExtent']
+    if keyrange=='full':
+        s.data['Ux'] = s.vx
+        s.data['Uy'] = s.vy
+        s.data['Uz'] = s.vz
+        s.data['dx'] = s.dx
+        s.data['dy'] = s.dy
+        for key in arrays.keys():
+            if key not in ['vx','vy','vz']:
+                s.data[str(key)] = arrays[key][i]
+    return s
+
+
+def appendSurfaceList_hdf5(surfaceList,hdf5file):
+    '''
+    Append a surface list at the end of a hdf5 file with layout 2 (see
+    saveSurfaceList_hdf5). The surfaces must have the grid of the file.
+    
+    An existing "pixelIndex" (see buildPixelIndex_hdf5) is extended with the
+    new surfaces. A pixelIndex which cannot be extended (created before the
+    pixelIndex was extendable, or out of date) is deleted with a warning:
+    call buildPixelIndex_hdf5 again to rebuild it.
+
+    Arguments:
+        *surfaceList*: python list.
+         A list of surfaces.
+        *hdf5file*: python string.
+         Path to the target file.
+
+    Returns:
+        None
+    '''
+    f = h5py.File(hdf5file,'r+')
+    try:
+        if getLayout_hdf5(f)!=2:
+            raise IOError('appendSurfaceList_hdf5 requires a hdf5 file with layout 2.')
+        n0 = f['vx'].shape[0]
+        _appendLayout2(f,surfaceList)
+        if 'pixelIndex' in f:
+            ds = f['pixelIndex']
+            if ds.maxshape[2]==None and ds.shape[2]==n0:
+                n1 = n0+len(surfaceList)
+                ds.resize(n1,axis=2)
+                U = np.array([[s.vx,s.vy,s.vz] for s in surfaceList])
+                ds[:,:,n0:n1,:] = U.transpose((2,3,0,1))
+                ds.attrs['nbsurf'] = n1
+            else:
+                warnings.warn('The pixelIndex of '+str(hdf5file)+' cannot be extended and is deleted. Rebuild it with buildPixelIndex_hdf5.')
+                del f['pixelIndex']
+    finally:
+        f.close()
+
+
+def loadSurfaceArrays_hdf5(hdf5fileObj,start=0,stop=None,step=1,keyrange='raw'):
+    '''
+    Load the frames start:stop:step of a surface hdf5 file object as arrays
+    of shape (T,ny,nx). With the layout 2, each field is read with a single
+    slice of its dataset. With the layout 1, the frames are read group by
+    group.
+
+    Arguments:
+        * hdf5fileObj: an h5py file object
+        * start, stop, step: [int] frame range (default=0,None,1)
+        * keyrange: [string] 'raw' (vx,vy,vz) or 'full' (every field of the
+          layout 2 "data" group) (default='raw')
+
+    Returns:
+        * arrays: [python dict] key -> numpy array of shape (T,ny,nx). Keys
+          'vx','vy','vz' and, if keyrange='full', the data keys.
+
+    Examples:
+    >>> import h5py
+    >>> h5obj = h5py.File('mydata.hdf5','r')
+    >>> vx = loadSurfaceArrays_hdf5(h5obj,0,1000,10)['vx']
+    >>> h5obj.close()
+    '''
+    arrays = dict()
+    if getLayout_hdf5(hdf5fileObj)==2:
+        for key in ['vx','vy','vz']:
+            arrays[key] = hdf5fileObj[key][start:stop:step]
+        if keyrange=='full' and 'data' in hdf5fileObj:
+            for key in hdf5fileObj['data'].keys():
+                arrays[str(key)] = hdf5fileObj['data'][key][start:stop:step]
+    else:
+        frames = range(getNumberOfSurfaces_hdf5(hdf5fileObj))[start:stop:step]
+        for key in ['vx','vy','vz']:
+            arrays[key] = np.array([hdf5fileObj['Surface'+str(i)][key][...] for i in frames])
+    return arrays
+
+
+def loadSurfaceTimeSeries_hdf5(hdf5fileObj,frq,start=0,stop=None,step=1):
+    '''
+    Load the frames start:stop:step of a surface hdf5 file object in a
+    SurfaceTimeSeries object (see pyFlowStat.Surface.SurfaceTimeSeries).
+
+    Arguments:
+        * hdf5fileObj: an h5py file object
+        * frq: [float] sampling frequency of the saved surfaces
+        * start, stop, step: [int] frame range (default=0,None,1)
+
+    Returns:
+        * sts: a SurfaceTimeSeries object
+    '''
+    arrays = loadSurfaceArrays_hdf5(hdf5fileObj,start,stop,step)
+    s = loadSurface_hdf5(hdf5fileObj,start)
+    sts = sr.SurfaceTimeSeries()
+    sts.vx = arrays['vx']
+    sts.vy = arrays['vy']
+    sts.vz = arrays['vz']
+    sts.dx = s.dx
+    sts.dy = s.dy
+    sts.minX = s.minX
+    sts.maxX = s.maxX
+    sts.minY = s.minY
+    sts.maxY = s.maxY
+    sts.extent = s.extent
+
+    sts.data['frq'] = float(frq)/step
+    sts.data['dt'] = 1.0/sts.data['frq']
+    sts.t = np.linspace(0,(sts.vx.shape[0]-1)*sts.data['dt'],sts.vx.shape[0])
+    sts.data['t'] = sts.t
+    return sts
+
+
+def convertSurfaceFile_hdf5(srcFile,tgtFile,keyrange='raw',compression='gzip',chunks=None,blockSize=100,mode='w-'):
+    '''
+    Convert a surface hdf5 file with layout 1 (one group per surface) into a
+    file with layout 2 (one dataset per field). See saveSurfaceList_hdf5.
+    The source file is read by blocks of blockSize surfaces.
+
+    Arguments:
+        *srcFile*: python string.
+         Path to the source file (layout 1).
+        *tgtFile*: python string.
+         Path to the target file (layout 2).
+        *keyrange*: python string.
+         'raw' or 'full'. Default='raw'.
+        *compression*: python string.
+         'gzip', 'lzf' or None. Default='gzip'.
+        *chunks*: python tuple.
+         Chunk shape, see saveSurfaceList_hdf5. Default=None.
+        *blockSize*: python int.
+         Number of surfaces converted at once. Default=100.
+        *mode*: python string.
+         Mode used to open the target file. Default='w-'.
+
+    Returns:
+        None
+    '''
+    fr = h5py.File(srcFile,'r')
+    fw = h5py.File(tgtFile,mode)
+    try:
+        nbsurf = getNumberOfSurfaces_hdf5(fr)
+        for a in range(0,nbsurf,blockSize):
+            block = [loadSurface_hdf5(fr,i,keyrange=keyrange) for i in range(a,min(a+blockSize,nbsurf))]
+            if a==0:
+                _createLayout2(fw,block[0],keyrange,compression,chunks)
+            _appendLayout2(fw,block)
+    finally:
+        fr.close()
+        fw.close()
+
+
+def _createPixelIndex(hdf5fileObj,nbsurf,shape,chunkFrames=1024):
+    '''
+    Create the empty "pixelIndex" dataset of shape (ny,nx,nbsurf,3).
+    '''
+    if 'pixelIndex' in hdf5fileObj:
+        del hdf5fileObj['pixelIndex']
+    chunks = (1,min(shape[1],16),min(nbsurf,chunkFrames),3)
+    ds = hdf5fileObj.create_dataset('pixelIndex',
+                                    shape=(shape[0],shape[1],nbsurf,3),
+                                    maxshape=(shape[0],shape[1],None,3),
+                                    dtype=float,
+                                    chunks=chunks)
+    ds.attrs['nbsurf'] = nbsurf
+    return ds
+
+
+def buildPixelIndex_hdf5(hdf5file,blockSize=100):
+    '''
+    Add to a hdf5 file written by saveSurfaceList_hdf5 the pixel-major copy of
+    the velocity fields:
+
+    myData.hdf5:
+        * Surface0  (GROUP)
+        * ...
+        * Surfacei  (GROUP)
+        * 'pixelIndex' (DATASET, shape=(ny,nx,nbsurf,3))
+
+    pixelIndex[i,j] is the velocity time serie (vx,vy,vz) of the pixel (i,j).
+    It is chunked by pixels, therefore the time serie of a pixel, or of a
+    block of pixels, is read with a single hyperslab selection. An existing
+    pixelIndex is replaced. The pixelIndex of a layout 2 file is extended by
+    appendSurfaceList_hdf5.
+
+    Arguments:
+        *hdf5file*: python string.
+         Path to the hdf5 file.
+        *blockSize*: python int.
+         Number of surfaces read and written at once. Default=100.
+
+    Returns:
+        None
+    '''
+    f = h5py.File(hdf5file,'r+')
+    try:
+        nbsurf = getNumberOfSurfaces_hdf5(f)
+        shape = loadSurface_hdf5(f,0).vx.shape
+        ds = _createPixelIndex(f,nbsurf,shape)
+        for a in range(0,nbsurf,blockSize):
+            b = min(a+blockSize,nbsurf)
+            arrays = loadSurfaceArrays_hdf5(f,a,b)
+            U = np.array([arrays['vx'],arrays['vy'],arrays['vz']])
+            ds[:,:,a:b,:] = U.transpose((2,3,1,0))
+    finally:
+        f.close()
+
+
 def loadPPfromSurf_hdf5(hdf5fileObj,pixloc,keyrange='raw',createDict=False,dt=1.0,ptloc=[0.0,0.0,0.0]):
     '''
     Generate a PointPorbe object from a list of surfaces saved in a hdf5.
@@ -277,6 +662,9 @@ def loadPPfromSurf_hdf5(hdf5fileObj,pixloc,keyrange='raw',createDict=False,dt=1.
             * 'dim'  (DATASET)
             * 'dimExtent' (DATASET)
 
+    If the hdf5 file has a "pixelIndex" dataset (see buildPixelIndex_hdf5),
+    the time serie is read from it in one go.
+
     Arguments:
         * hdf5fileObj: an h5py file object.
         * pixloc: [python list, shape=[2]] pixel location .
@@ -297,55 +685,168 @@ def loadPPfromSurf_hdf5(hdf5fileObj,pixloc,keyrange='raw',createDict=False,dt=1.
     >>> pt = SurfaceFunctions.loadPPfromSurf_hdf5(h5obj,(140,53),keyrange='raw',dt=0.04)
     >>> h5obj.close()
     '''
-    pt = pp.PointProbe()
-
-    # get number of surfaces
-    nbsurf = len(hdf5fileObj.keys())
-    print nbsurf
-    # generate probeVar and probeTimes
-    probeVar = np.zeros((nbsurf,3))
-    probeTimes = np.zeros(nbsurf)
+    return loadPPlistFromSurf_hdf5(hdf5fileObj,
+                                   [pixloc],
+                                   keyrange=keyrange,
+                                   createDict=createDict,
+                                   dt=dt,
+                                   ptlocList=[ptloc])[0]
 
 
-    # append velocity v and time t to PointProbe. Add extra variable if requiered
-    for i in range(len(hdf5fileObj.keys())):
-        gName = 'Surface'+str(i)
+def loadPPlistFromSurf_hdf5(hdf5fileObj,pixlocList,keyrange='raw',createDict=False,dt=1.0,ptlocList=None):
+    '''
+    Generate a list of PointPorbe objects from a list of surfaces saved in a
+    hdf5 (see loadPPfromSurf_hdf5). All the probes are extracted together:
+        * with a "pixelIndex" dataset (see buildPixelIndex_hdf5), the pixels
+          of each row of the surface are read with one hyperslab selection.
+        * without, the bounding box of the probes is read once per surface
+          (a single value for one probe).
 
-        vx = hdf5fileObj[gName]['vx'][pixloc[0],pixloc[1]]
-        vy = hdf5fileObj[gName]['vy'][pixloc[0],pixloc[1]]
-        vz = hdf5fileObj[gName]['vz'][pixloc[0],pixloc[1]]
-        probeVar[i,0] = vx
-        probeVar[i,1] = vy
-        probeVar[i,2] = vz
+    Arguments:
+        * hdf5fileObj: an h5py file object.
+        * pixlocList: [python list of pixel locations (i,j)].
+        * keyrange: [string] 'raw' or 'full' (default='raw'. 'full' not implemented).
+        * createDict: [bool] create PointPorbe dictonnary (default=False).
+        * dt: [float] time step between the surfaces.
+        * ptlocList: [python list of point locations (x,y,z)] (default=None,
+          all the points at (0,0,0)).
 
-        probeTimes[i] = i*dt
+    Returns:
+        * ptList: a list of PointProbe objects (see pyFlowStat.PointProbe)
 
-#       crappy... needs improvement
-#        if keyrange=='raw':
-#            pass
-#        elif keyrange=='full':
-#            for key in hdf5fileObj[gName].keys():
-#                if ( key=='dim' or key=='dimExtent' or key=='vx' or key=='vy' or key=='vz'):
-#                    pass
-#                else:
-#                    pt.data[key].append( hdf5fileObj[gName][key][pixloc[0],pixloc[1]] )
+    Examples:
+    >>> import h5py
+    >>> h5obj = h5py.File('mydata.hdf5','r')
+    >>> ptList = loadPPlistFromSurf_hdf5(h5obj,[(140,53),(140,54),(10,2)],dt=0.04)
+    >>> h5obj.close()
+    '''
+    pixloc = np.array(pixlocList,dtype=int).reshape((-1,2))
+    if ptlocList==None:
+        ptlocList = [[0.0,0.0,0.0]]*len(pixloc)
 
-    # add location to PointPorbe
-    pt.probeLoc.append(ptloc[0])
-    pt.probeLoc.append(ptloc[1])
-    pt.probeLoc.append(ptloc[2])
+    # get number of surfaces
+    nbsurf = getNumberOfSurfaces_hdf5(hdf5fileObj)
+    # generate probeVar (one array per probe) and probeTimes
+    probeVar = np.zeros((len(pixloc),nbsurf,3))
+    probeTimes = np.arange(nbsurf)*dt
+
+    if 'pixelIndex' in hdf5fileObj:
+        ds = hdf5fileObj['pixelIndex']
+        for i in np.unique(pixloc[:,0]):
+            inRow = np.where(pixloc[:,0]==i)[0]
+            j0 = np.min(pixloc[inRow,1])
+            j1 = np.max(pixloc[inRow,1])
+            block = ds[i,j0:j1+1]
+            probeVar[inRow] = block[pixloc[inRow,1]-j0]
+    elif getLayout_hdf5(hdf5fileObj)==2:
+        blockSize = hdf5fileObj['vx'].chunks[0]
+        for a in range(0,nbsurf,blockSize):
+            b = min(a+blockSize,nbsurf)
+            for k,key in enumerate(['vx','vy','vz']):
+                block = hdf5fileObj[key][a:b]
+                probeVar[:,a:b,k] = block[:,pixloc[:,0],pixloc[:,1]].T
+    else:
+        # bounding box of the probes
+        i0,j0 = np.min(pixloc,axis=0)
+        i1,j1 = np.max(pixloc,axis=0)
+        for i in range(nbsurf):
+            gName = 'Surface'+str(i)
+            for k,key in enumerate(['vx','vy','vz']):
+                block = hdf5fileObj[gName][key][i0:i1+1,j0:j1+1]
+                probeVar[:,i,k] = block[pixloc[:,0]-i0,pixloc[:,1]-j0]
 
-    # add probeVar and probeTimes to pt
-    pt.probeVar = probeVar
-    pt.probeTimes = probeTimes
+    ptList = []
+    for n in range(len(pixloc)):
+        pt = pp.PointProbe()
+        # add location to PointPorbe
+        pt.probeLoc.append(ptlocList[n][0])
+        pt.probeLoc.append(ptlocList[n][1])
+        pt.probeLoc.append(ptlocList[n][2])
 
+        # add probeVar and probeTimes to pt
+        pt.probeVar = probeVar[n]
+        pt.probeTimes = probeTimes.copy()
 
-    if createDict==True:
-        pt.createDataDict()
+        if createDict==True:
+            pt.createDataDict()
+        ptList.append(pt)
 
-    return pt
+    return ptList
 
     
+def corrFieldMulti(f1,f2=None,refs=[(0,0)],norm=True,chunkSize=None):
+    '''
+    Two point correlation of an entire field with several reference points.
+    The correlation maps of all the reference points are computed with one
+    matrix product (GEMM) per chunk of time realizations, therefore f1 and f2
+    can also be large h5py datasets or numpy.memmap: only chunkSize time
+    realizations are loaded at once.
+    
+    Arguments:
+        *f1*: np.array of shape (T,N,M).
+         In general, one of the fields (vx,vy or vz) of a 
+         pyFlowStat.SurfaceTimeSeries object.
+    
+        *f2*: np.array of shape (T,N,M).
+         Same as f1. If None, then f1 is used has second field. Default=None
+         
+        *refs*: python list of tuple.
+         Locations (i_ref,j_ref) of the reference points. Default=[(0,0)]
+         
+        *norm*: python bool.
+         Normalization of each correlation map by its value at the reference
+         point. Default=True.
+         
+        *chunkSize*: python int.
+         Number of time realizations loaded at once. If None, all the time
+         realizations are used at once. Default=None.
+         
+    Returns:
+        *res*: np.array of shape (len(refs),N,M).
+         the two point correlation maps. NaN where f1 or f2 has a NaN.
+    '''
+    if f2 is None:
+        f2=f1
+    T=f1.shape[0]
+    shape=f1.shape[1:]
+    P=shape[0]*shape[1]
+    if chunkSize==None:
+        chunkSize=T
+    refIdx=np.array([i*shape[1]+j for i,j in refs])
+    chunks=[(a,min(a+chunkSize,T)) for a in range(0,T,chunkSize)]
+    
+    # first pass: mean
+    mean1=np.zeros(len(refIdx))
+    mean2=np.zeros(P)
+    for a,b in chunks:
+        mean1+=np.sum(np.reshape(f1[a:b],(b-a,P))[:,refIdx],axis=0)
+        mean2+=np.sum(np.reshape(f2[a:b],(b-a,P)),axis=0)
+    mean1=mean1/T
+    mean2=mean2/T
+    
+    # second pass: covariance and variance of the fluctuations
+    cov=np.zeros((len(refIdx),P))
+    var1=np.zeros(len(refIdx))
+    var2=np.zeros(P)
+    for a,b in chunks:
+        x=np.reshape(f1[a:b],(b-a,P))[:,refIdx]-mean1
+        y=np.reshape(f2[a:b],(b-a,P))-mean2
+        cov+=np.dot(x.T,y)
+        var1+=np.sum(x**2,axis=0)
+        var2+=np.sum(y**2,axis=0)
+        
+    res=cov/np.sqrt(var1[:,np.newaxis]*var2[np.newaxis,:])
+    if norm==True:
+        res=res/res[np.arange(len(refIdx)),refIdx][:,np.newaxis]
+    return res.reshape((len(refIdx),)+tuple(shape))
+
+def _fluctuations(f):
+    '''
+    Fluctuations of f of shape (T,N,M) and their standard deviation.
+    '''
+    fp=f-np.mean(f,axis=0)
+    return fp,np.std(fp,axis=0)
+
 def corrField(f1,f2=None,i_ref=0,j_ref=0,norm=True):
     '''
     Two point correlation of an entire field with the point pt(i_ref,j_ref) as
@@ -373,29 +874,7 @@ def corrField(f1,f2=None,i_ref=0,j_ref=0,norm=True):
         *res*: np.array of shape (N,M).
          the two point horizontal correlation. 
     '''
-    f1sum=np.sum(f1,axis=0)
-    if f2==None:
-        f2=f1
-        f2sum=f1sum
-    else:
-        f2sum=np.sum(f2,axis=0)
-        
-    res=np.empty(f1[0].shape, dtype=float)
-    res[:] = np.nan
-    k,dx,dy=f1.shape
-    if np.isnan(f1sum[i_ref,j_ref]):
-        res[i_ref,j_ref] = np.nan
-    else:
-        for i in range(dx):
-            for j in range(dy):
-                if np.isnan(f2sum[i,j]):
-                    res[i,j]=np.nan
-                else:
-                    res[i,j]=tt.twoPointCorr(x=f1[:,i_ref,j_ref],y=f2[:,i,j],norm=True)
-    if norm==True:
-        return res/res[i_ref,j_ref]
-    else:
-        return res
+    return corrFieldMulti(f1,f2,refs=[(i_ref,j_ref)],norm=norm)[0]
         
 def corrFieldHorz(f1,f2=None,j_ref=0,norm=True):
     '''
@@ -422,28 +901,19 @@ def corrFieldHorz(f1,f2=None,j_ref=0,norm=True):
         *res*: np.array of shape (N,M).
          the two point horizontal correlation. 
     '''
-    f1sum=np.sum(f1,axis=0)
-    if f2==None:
-        f2=f1
-        f2sum=f1sum
+    f1p,f1std=_fluctuations(f1)
+    if f2 is None:
+        f2p,f2std=f1p,f1std
     else:
-        f2sum=np.sum(f2,axis=0)
-        
-    res=np.empty(f1[0].shape, dtype=float)
-    res[:] = np.nan
-    k,dx,dy=f1.shape
-    for i in range(dx):
-        if np.isnan(f1sum[i,j_ref]):
-            res[i,:]=np.nan
-        else:
-            for j in range(dy):
-                if np.isnan(f1sum[i,j]) or np.isnan(f2sum[i,j]):
-                    res[i,j]=np.nan
-                else:
-                    res[i,j]=tt.twoPointCorr(x=f1[:,i,j_ref],y=f2[:,i,j],norm=True)
-            if norm==True:
-                res[i,:]=res[i,:]/res[i,j_ref]
-      
+        f2p,f2std=_fluctuations(f2)
+    T=f1.shape[0]
+    
+    # reference of row i is the point (i,j_ref)
+    res=np.einsum('ti,tij->ij',f1p[:,:,j_ref],f2p)
+    res=res/(f1std[:,j_ref][:,np.newaxis]*f2std*T)
+    res[np.isnan(f1std)]=np.nan
+    if norm==True:
+        res=res/res[:,j_ref][:,np.newaxis]
     return res
     
 def corrFieldVert(f1,f2=None,i_ref=0,norm=True):
@@ -471,28 +941,19 @@ def corrFieldVert(f1,f2=None,i_ref=0,norm=True):
         *res*: np.array of shape (N,M).
          the two point vertical correlation. 
     '''
-    f1sum=np.sum(f1,axis=0)
-    if f2==None:
-        f2=f1
-        f2sum=f1sum
+    f1p,f1std=_fluctuations(f1)
+    if f2 is None:
+        f2p,f2std=f1p,f1std
     else:
-        f2sum=np.sum(f2,axis=0)
-       
-    res=np.empty(f1[0].shape, dtype=float)
-    res[:] = np.nan
-    k,dx,dy=f1.shape
-    for j in range(dy):
-        if np.isnan(f1sum[i_ref,j]):
-            res[:,j]=np.nan
-        else:
-            for i in range(dx):
-                if np.isnan(f1sum[i,j]) or np.isnan(f2sum[i,j]):
-                    res[i,j]=np.nan
-                else:
-                    res[i,j]=tt.twoPointCorr(x=f1[:,i_ref,j],y=f2[:,i,j],norm=True)
-            if norm==True:
-                res[:,j]=res[:,j]/res[i_ref,j]
-            
+        f2p,f2std=_fluctuations(f2)
+    T=f1.shape[0]
+    
+    # reference of column j is the point (i_ref,j)
+    res=np.einsum('tj,tij->ij',f1p[:,i_ref,:],f2p)
+    res=res/(f1std[i_ref,:][np.newaxis,:]*f2std*T)
+    res[np.isnan(f1std)]=np.nan
+    if norm==True:
+        res=res/res[i_ref,:][np.newaxis,:]
     return res
     
 def corrVert(f1,f2=None,i_ref=0,j_ref=0,norm=True):
@@ -531,25 +992,17 @@ def corrVert(f1,f2=None,i_ref=0,j_ref=0,norm=True):
         *res_r*: numpy array.
          Array of right/positive results.       
     '''
-    f1sum=np.sum(f1,axis=0)
-    if f2==None:
+    if f2 is None:
         f2=f1
-        f2sum=f1sum
-    else:
-        f2sum=np.sum(f2,axis=0)
-    
-    res=np.empty(f1[0].shape[0], dtype=float)
-    res[:] = np.nan
-    k,dx,dy=f1.shape
-    for i in range(dx):
-        if np.isnan(f1sum[i_ref,j_ref]) or np.isnan(f2sum[i_ref,j_ref]):
-            res[i]=np.nan
-        else:
-            res[i]=tt.twoPointCorr(x=f1[:,i_ref,j_ref],y=f2[:,i,j_ref],norm=True)
+    x=f1[:,i_ref,j_ref]-np.mean(f1[:,i_ref,j_ref])
+    y=f2[:,:,j_ref]-np.mean(f2[:,:,j_ref],axis=0)
+    res=np.dot(x,y)/(np.std(x)*np.std(y,axis=0)*len(x))
+    if np.isnan(np.sum(f2[:,i_ref,j_ref])):
+        res[:]=np.nan
     if norm==True:
         res=res/res[i_ref]
     res_l=res[:i_ref+1][::-1]
     res_r=res[i_ref:]
     lags_l=np.arange(len(res_l))
     lags_r=np.arange(len(res_r))
-    return lags_l,res_l,lags_r,res_r
\ No newline at end of file
+    return lags_l,res_l,lags_r,res_r
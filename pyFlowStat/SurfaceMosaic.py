@@ -0,0 +1,307 @@
+'''
+SurfaceMosaic.py
+
+Stitching of the overlapping Surfaces of several PIV cameras on a global
+cartesian grid. The global grid, the interpolation of each camera on its part
+of the global grid (see SurfaceRegridder) and the blending weights of the
+overlaps are computed once; stitching a frame is then a few array gathers and
+weighted sums. Long synchronized recordings stored in hdf5 files can be
+stitched by blocks of frames in a process pool and written to a chunked hdf5
+file with layout 2 (see SurfaceFunctions.saveSurfaceList_hdf5).
+'''
+
+#=============================================================================#
+# load modules
+#=============================================================================#
+import multiprocessing
+import h5py
+
+#scientific modules
+import numpy as np
+
+import pyFlowStat.Surface as sr
+import pyFlowStat.SurfaceFunctions as SurfaceFunctions
+from pyFlowStat.SurfaceRegridder import SurfaceRegridder
+
+
+class SurfaceMosaic(object):
+    '''
+    Mosaic of the Surfaces of several cameras.
+
+    The global grid covers the cell centers of all the cameras. Each camera
+    is interpolated on the window of the global grid it covers. In the
+    overlaps, the cameras are blended with weights which are either constant
+    (blending='average') or proportional to the distance to the edge of the
+    camera field of view (blending='feather'), so that the seams are smooth.
+    NaN values of a camera get a zero weight. Points covered by no valid
+    camera value are NaN.
+
+    Usage:
+        >>> m = SurfaceMosaic([cam0Surface,cam1Surface],dx=0.5,dy=0.5)
+        >>> s = m.stitchSurfaces([cam0Surface,cam1Surface])
+        >>> m.stitchFiles_hdf5(['cam0.h5','cam1.h5'],'mosaic.h5',nProcs=4)
+    '''
+
+    # constructors #
+    #--------------#
+    def __init__(self,
+                 cameras,
+                 dx=None,
+                 dy=None,
+                 method='linear',
+                 blending='feather'):
+        '''
+        base constructor. Computes the global grid, the interpolation of the
+        cameras and the blending weights.
+
+        Arguments:
+            *cameras*: python list of Surface or SurfaceTimeSeries objects.
+             Objects defining the grid (dx,dy,minX,maxX,minY,maxY) of each
+             camera. Only the geometry is used.
+
+            *dx*, *dy*: python float.
+             Spacing of the global grid. If None, the smallest spacing of the
+             cameras is used. Default=None.
+
+            *method*: python string.
+             Interpolation method, "linear" or "cubic" (see
+             SurfaceRegridder). Default="linear".
+
+            *blending*: python string.
+             "feather" or "average". Default="feather".
+        '''
+        if blending not in ['feather','average']:
+            raise ValueError('blending "'+str(blending)+'" is not "feather" or "average".')
+        if dx==None:
+            dx = np.min([c.dx for c in cameras])
+        if dy==None:
+            dy = np.min([c.dy for c in cameras])
+
+        self.nCameras = len(cameras)
+        self.method = method
+        self.blending = blending
+        self.dx = float(dx)
+        self.dy = float(dy)
+        self.minX = float(np.min([c.minX for c in cameras]))
+        self.maxY = float(np.max([c.maxY for c in cameras]))
+        self.cellsX = int(np.ceil((np.max([c.maxX for c in cameras])-self.minX)/self.dx-1e-6))+1
+        self.cellsY = int(np.ceil((self.maxY-np.min([c.minY for c in cameras]))/self.dy-1e-6))+1
+        self.maxX = self.minX+(self.cellsX-1)*self.dx
+        self.minY = self.maxY-(self.cellsY-1)*self.dy
+
+        self.windows = []
+        self.regridders = []
+        self.weights = []
+        for c in cameras:
+            # global cells whose center is inside the camera
+            j0 = int(np.ceil((c.minX-self.minX)/self.dx-1e-6))
+            j1 = int(np.floor((c.maxX-self.minX)/self.dx+1e-6))
+            i0 = int(np.ceil((self.maxY-c.maxY)/self.dy-1e-6))
+            i1 = int(np.floor((self.maxY-c.minY)/self.dy+1e-6))
+            self.windows.append(np.s_[i0:i1+1,j0:j1+1])
+            r = SurfaceRegridder(c,
+                                 self.minX+j0*self.dx,
+                                 self.minX+j1*self.dx,
+                                 self.dx,
+                                 self.maxY-i1*self.dy,
+                                 self.maxY-i0*self.dy,
+                                 self.dy,
+                                 method=method,
+                                 minWeight=0.5)
+            self.regridders.append(r)
+
+            if blending=='feather':
+                x = self.minX+np.arange(j0,j1+1)*self.dx
+                y = self.maxY-np.arange(i0,i1+1)*self.dy
+                distX = np.minimum(x-c.minX,c.maxX-x)
+                distY = np.minimum(y-c.minY,c.maxY-y)
+                # the cells on the edge of the camera keep a small weight
+                w = np.minimum(distY[:,np.newaxis],distX[np.newaxis,:])+0.5*min(self.dx,self.dy)
+            else:
+                w = np.ones(r.shape)
+            self.weights.append(w)
+
+
+    # getters #
+    #---------#
+    @property
+    def shape(self):
+        '''
+        Shape of the global grid, in the Surface orientation (ny,nx).
+        '''
+        return (self.cellsY,self.cellsX)
+
+    @property
+    def extent(self):
+        return [self.minX-self.dx/2,self.maxX+self.dx/2,self.minY-self.dy/2,self.maxY+self.dy/2]
+
+
+    # class methods #
+    #---------------#
+    def setGrid(self,obj):
+        '''
+        Set dx,dy,minX,maxX,minY,maxY and extent of obj (Surface or
+        SurfaceTimeSeries) to the global grid.
+        '''
+        obj.dx = self.dx
+        obj.dy = self.dy
+        obj.minX = self.minX
+        obj.maxX = self.maxX
+        obj.minY = self.minY
+        obj.maxY = self.maxY
+        obj.extent = self.extent
+
+    def stitch(self,fields):
+        '''
+        Stitch one field of each camera on the global grid.
+
+        Arguments:
+            *fields*: python list of numpy.array of shape=(...,ny,nx).
+             One array per camera, on the grid of the camera. The leading
+             axes (components, frames) must be the same for all the cameras
+             and are stitched at once.
+
+        Returns:
+            *res*: numpy.array of shape=(...,cellsY,cellsX).
+        '''
+        if len(fields)!=self.nCameras:
+            raise ValueError('got '+str(len(fields))+' fields for '+str(self.nCameras)+' cameras.')
+        num = None
+        for field,r,window,w in zip(fields,self.regridders,self.windows,self.weights):
+            values = r.regrid(field)
+            if num is None:
+                num = np.zeros(values.shape[:-2]+self.shape)
+                den = np.zeros(values.shape[:-2]+self.shape)
+            valid = np.isfinite(values)
+            wValid = np.where(valid,w,0.0)
+            num[(Ellipsis,)+window] += wValid*np.where(valid,values,0.0)
+            den[(Ellipsis,)+window] += wValid
+        with np.errstate(invalid='ignore',divide='ignore'):
+            return np.where(den>0,num/den,np.nan)
+
+    def stitchSurfaces(self,surfaceList):
+        '''
+        Stitch the velocity fields of one synchronized frame (one Surface per
+        camera) in a Surface on the global grid.
+        '''
+        s = sr.Surface()
+        s.vx,s.vy,s.vz = self.stitch([np.array([c.vx,c.vy,c.vz]) for c in surfaceList])
+        self.setGrid(s)
+        s.createDataDict()
+        return s
+
+    def stitchTimeSeries(self,stsList):
+        '''
+        Stitch the velocity fields of synchronized SurfaceTimeSeries (one per
+        camera) in a SurfaceTimeSeries on the global grid. The time keys of
+        the first camera are kept.
+        '''
+        sts = sr.SurfaceTimeSeries()
+        sts.vx,sts.vy,sts.vz = self.stitch([np.array([c.vx,c.vy,c.vz]) for c in stsList])
+        sts.t = stsList[0].t
+        sts.data.update(stsList[0].data)
+        self.setGrid(sts)
+        return sts
+
+    def stitchFiles_hdf5(self,
+                         cameraFiles,
+                         hdf5file,
+                         start=0,
+                         stop=None,
+                         blockSize=100,
+                         nProcs=1,
+                         compression='gzip',
+                         chunks=None,
+                         mode='w-'):
+        '''
+        Stitch the synchronized frames of several surface hdf5 files (one per
+        camera, layout 1 or 2) and write the mosaic in a hdf5 file with
+        layout 2. The frames are processed by blocks of blockSize frames,
+        optionally in a pool of nProcs processes. The blocks are written in
+        order by the main process as soon as they are stitched.
+
+        Arguments:
+            *cameraFiles*: python list of string.
+             Path to the surface hdf5 file of each camera.
+
+            *hdf5file*: python string.
+             Path to the target file.
+
+            *start*, *stop*: python int.
+             Range of frames. If stop is None, the frames common to all the
+             cameras are stitched. Default=0,None.
+
+            *blockSize*: python int.
+             Number of frames stitched at once. Default=100.
+
+            *nProcs*: python int.
+             Number of processes. Default=1.
+
+            *compression*, *chunks*: see SurfaceFunctions.saveSurfaceList_hdf5.
+
+            *mode*: python string.
+             Mode used to open the target file. Default='w-' (fails if the
+             file exists).
+
+        Returns:
+            *nFrames*: python int. Number of stitched frames.
+        '''
+        if stop==None:
+            stop = np.min([_getNumberOfFrames(fname) for fname in cameraFiles])
+        blocks = [(self,cameraFiles,b,min(b+blockSize,stop)) for b in range(start,stop,blockSize)]
+
+        template = sr.Surface()
+        template.vx = np.zeros(self.shape)
+        self.setGrid(template)
+        f = h5py.File(hdf5file,mode)
+        pool = None
+        try:
+            SurfaceFunctions._createLayout2(f,template,'raw',compression,chunks)
+            if nProcs>1:
+                pool = multiprocessing.Pool(nProcs)
+                results = pool.imap(_stitchBlock,blocks)
+            else:
+                results = (_stitchBlock(b) for b in blocks)
+            n0 = 0
+            for res in results:
+                n1 = n0+res.shape[1]
+                for i,key in enumerate(['vx','vy','vz']):
+                    f[key].resize(n1,axis=0)
+                    f[key][n0:n1] = res[i]
+                n0 = n1
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            f.close()
+        return n0
+
+
+#=============================================================================#
+# functions
+#=============================================================================#
+def _getNumberOfFrames(hdf5file):
+    '''
+    Number of surfaces of a surface hdf5 file.
+    '''
+    f = h5py.File(hdf5file,'r')
+    try:
+        return SurfaceFunctions.getNumberOfSurfaces_hdf5(f)
+    finally:
+        f.close()
+
+def _stitchBlock(args):
+    '''
+    Stitch the frames b0:b1 of the camera files. Returns a numpy.array of
+    shape (3,b1-b0,ny,nx). Module level function, usable by a process pool.
+    '''
+    mosaic,cameraFiles,b0,b1 = args
+    fields = []
+    for fname in cameraFiles:
+        f = h5py.File(fname,'r')
+        try:
+            arrays = SurfaceFunctions.loadSurfaceArrays_hdf5(f,b0,b1)
+        finally:
+            f.close()
+        fields.append(np.array([arrays['vx'],arrays['vy'],arrays['vz']]))
+    return mosaic.stitch(fields)
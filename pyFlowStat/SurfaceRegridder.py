@@ -0,0 +1,294 @@
+'''
+SurfaceRegridder.py
+
+Interpolation of the fields of a Surface or a SurfaceTimeSeries from one
+cartesian grid to another one (change of resolution, alignment of PIV fields
+on a CFD grid...). The interpolation is separable: the indices and weights of
+the source columns and rows are computed once for every target column and
+row, and applied to all the fields and all the frames with two batched
+numpy.take operations.
+'''
+
+#=============================================================================#
+# load modules
+#=============================================================================#
+#scientific modules
+import numpy as np
+
+import pyFlowStat.Surface as sr
+
+
+class SurfaceRegridder(object):
+    '''
+    Separable linear or cubic interpolation from the grid of a source Surface
+    to a target cartesian grid.
+
+    The grids are defined by their cell centers minX,maxX,minY,maxY and their
+    spacing dx,dy, in the Surface orientation (row 0 is at maxY).
+
+    Supported interpolation methods:
+        * "linear": bilinear interpolation (2x2 source points).
+        * "cubic": bicubic convolution of Keys (Catmull-Rom, 4x4 source
+          points). Linear in the first and last interval of each axis.
+
+    NaN values of the source are ignored: the weights of the valid source
+    points are normalized by their sum. A target point is NaN if the sum of
+    the weights of its valid source points is below minWeight, or if it is
+    outside of the source grid.
+
+    Usage:
+        >>> r = SurfaceRegridder(piv,minX=0,maxX=0.1,dx=0.001,minY=0,maxY=0.05,dy=0.001)
+        >>> pivCoarse = r.regridSurface(piv)
+        >>> r = SurfaceRegridder.createFromSurfaces(pivSts,cfdSurface,method='cubic')
+        >>> ptsOnCfdGrid = r.regridTimeSeries(pivSts)
+    '''
+
+    # constructors #
+    #--------------#
+    def __init__(self,
+                 source,
+                 minX,
+                 maxX,
+                 dx,
+                 minY,
+                 maxY,
+                 dy,
+                 method='linear',
+                 minWeight=0.5):
+        '''
+        base constructor. Computes the indices and weights of the
+        interpolation.
+
+        Arguments:
+            *source*: Surface or SurfaceTimeSeries object.
+             Object defining the source grid (dx,dy,minX,maxX,minY,maxY).
+
+            *minX*, *maxX*, *minY*, *maxY*: python float.
+             Position of the first and last cell centers of the target grid.
+             maxX and minY are rounded to the nearest cell center.
+
+            *dx*, *dy*: python float.
+             Spacing of the target grid.
+
+            *method*: python string.
+             "linear" or "cubic". Default="linear".
+
+            *minWeight*: python float.
+             Minimal sum of the weights of the valid source points.
+             Default=0.5.
+        '''
+        if method not in ['linear','cubic']:
+            raise ValueError('method "'+str(method)+'" is not "linear" or "cubic".')
+
+        self.method = method
+        self.minWeight = minWeight
+        self.dx = float(dx)
+        self.dy = float(dy)
+        self.minX = float(minX)
+        self.maxX = float(maxX)
+        self.minY = float(minY)
+        self.maxY = float(maxY)
+        self.cellsX = int(np.round((self.maxX-self.minX)/self.dx))+1
+        self.cellsY = int(np.round((self.maxY-self.minY)/self.dy))+1
+        # last cell centers on the grid defined by minX, maxY, dx and dy
+        self.maxX = self.minX+(self.cellsX-1)*self.dx
+        self.minY = self.maxY-(self.cellsY-1)*self.dy
+
+        srcCellsX = int(np.round((source.maxX-source.minX)/source.dx))+1
+        srcCellsY = int(np.round((source.maxY-source.minY)/source.dy))+1
+        self.srcShape = (srcCellsY,srcCellsX)
+
+        # columns: x increases with the index. rows: y decreases.
+        x = self.minX+np.arange(self.cellsX)*self.dx
+        y = self.maxY-np.arange(self.cellsY)*self.dy
+        self.idxX,self.wX = axisWeights((x-source.minX)/source.dx,srcCellsX,method)
+        self.idxY,self.wY = axisWeights((source.maxY-y)/source.dy,srcCellsY,method)
+        self.weightSum = np.outer(np.sum(self.wY,axis=0),np.sum(self.wX,axis=0))
+
+    @classmethod
+    def createFromSurfaces(cls,source,target,method='linear',minWeight=0.5):
+        '''
+        Create a SurfaceRegridder from the grid of source to the grid of
+        target (Surface or SurfaceTimeSeries objects).
+        '''
+        return cls(source,
+                   target.minX,
+                   target.maxX,
+                   target.dx,
+                   target.minY,
+                   target.maxY,
+                   target.dy,
+                   method=method,
+                   minWeight=minWeight)
+
+    @classmethod
+    def createFromSpacing(cls,source,dx,dy,method='linear',minWeight=0.5):
+        '''
+        Create a SurfaceRegridder to a grid of spacing dx, dy covering the
+        grid of source.
+        '''
+        cellsX = int(np.floor((source.maxX-source.minX)/dx+1e-6))+1
+        cellsY = int(np.floor((source.maxY-source.minY)/dy+1e-6))+1
+        return cls(source,
+                   source.minX,
+                   source.minX+(cellsX-1)*dx,
+                   dx,
+                   source.maxY-(cellsY-1)*dy,
+                   source.maxY,
+                   dy,
+                   method=method,
+                   minWeight=minWeight)
+
+
+    # getters #
+    #---------#
+    @property
+    def shape(self):
+        '''
+        Shape of the target grid, in the Surface orientation (ny,nx).
+        '''
+        return (self.cellsY,self.cellsX)
+
+    @property
+    def extent(self):
+        return [self.minX-self.dx/2,self.maxX+self.dx/2,self.minY-self.dy/2,self.maxY+self.dy/2]
+
+
+    # class methods #
+    #---------------#
+    def regrid(self,field):
+        '''
+        Interpolate one or several fields on the target grid.
+
+        Arguments:
+            *field*: numpy.array of shape=(...,ny,nx).
+             Fields on the source grid, in the Surface orientation. All the
+             leading axes (components, frames) are interpolated at once.
+
+        Returns:
+            *res*: numpy.array of shape=(...,cellsY,cellsX).
+        '''
+        field = np.asarray(field,dtype=float)
+        if field.shape[-2:]!=self.srcShape:
+            raise ValueError('field shape '+str(field.shape[-2:])+' does not '
+                             'match the source grid '+str(self.srcShape)+'.')
+        valid = np.isfinite(field)
+        if np.all(valid):
+            num = self._apply(field)
+            den = self.weightSum
+        else:
+            num = self._apply(np.where(valid,field,0.0))
+            den = self._apply(valid.astype(float))
+        with np.errstate(invalid='ignore',divide='ignore'):
+            return np.where(den>=self.minWeight,num/den,np.nan)
+
+    def _apply(self,field):
+        '''
+        Weighted sums of the source columns, then of the source rows.
+        '''
+        tmp = np.zeros(field.shape[:-1]+(self.cellsX,))
+        for k in range(self.idxX.shape[0]):
+            tmp += self.wX[k]*np.take(field,self.idxX[k],axis=-1)
+        res = np.zeros(field.shape[:-2]+self.shape)
+        for k in range(self.idxY.shape[0]):
+            res += self.wY[k][:,np.newaxis]*np.take(tmp,self.idxY[k],axis=-2)
+        return res
+
+    def setGrid(self,obj):
+        '''
+        Set dx,dy,minX,maxX,minY,maxY and extent of obj (Surface or
+        SurfaceTimeSeries) to the target grid.
+        '''
+        obj.dx = self.dx
+        obj.dy = self.dy
+        obj.minX = self.minX
+        obj.maxX = self.maxX
+        obj.minY = self.minY
+        obj.maxY = self.maxY
+        obj.extent = self.extent
+
+    def regridSurface(self,surface):
+        '''
+        Return a new Surface with vx, vy, vz and all the 2D fields of
+        surface.data (except the derived fields, which are computed again on
+        demand) interpolated on the target grid.
+        '''
+        s = sr.Surface()
+        s.vx,s.vy,s.vz = self.regrid(np.array([surface.vx,surface.vy,surface.vz]))
+        self.setGrid(s)
+        s.createDataDict()
+        keys = [k for k in surface.data.keys()
+                if k not in s.data and k not in sr.derivedFields
+                and np.shape(surface.data[k])==self.srcShape]
+        if len(keys)>0:
+            fields = self.regrid(np.array([surface.data[k] for k in keys]))
+            for k,f in zip(keys,fields):
+                s.data[k] = f
+        return s
+
+    def regridTimeSeries(self,sts):
+        '''
+        Return a new SurfaceTimeSeries with vx, vy and vz interpolated on the
+        target grid. The time keys of sts.data are kept.
+        '''
+        res = sr.SurfaceTimeSeries()
+        res.vx = self.regrid(sts.vx)
+        res.vy = self.regrid(sts.vy)
+        res.vz = self.regrid(sts.vz)
+        res.t = sts.t
+        res.data.update(sts.data)
+        self.setGrid(res)
+        return res
+
+
+#=============================================================================#
+# functions
+#=============================================================================#
+def axisWeights(s,n,method='linear'):
+    '''
+    Indices and weights of the 1D interpolation at the fractional positions
+    s of a source axis of n points.
+
+    Arguments:
+        *s*: numpy.array.
+         Fractional index of the target points on the source axis.
+
+        *n*: python int.
+         Number of points of the source axis.
+
+        *method*: python string.
+         "linear" (2 points) or "cubic" (Keys cubic convolution, 4 points,
+         linear in the first and last interval).
+
+    Returns:
+        *idx*: numpy.array of int, shape=(nTaps,len(s)).
+
+        *w*: numpy.array, shape=(nTaps,len(s)).
+         Weights. Points outside of the source axis get zero weights, target
+         points outside of the source axis have only zero weights.
+    '''
+    s = np.asarray(s,dtype=float)
+    tol = 1e-6
+    inside = (s>=-tol) & (s<=n-1+tol)
+    s = np.clip(s,0,n-1)
+    i0 = np.minimum(np.floor(s),max(n-2,0)).astype(int)
+    t = s-i0
+    if method=='linear':
+        offsets = [0,1]
+        w = [1.0-t,t]
+    else:
+        offsets = [-1,0,1,2]
+        w = [((-0.5*t+1.0)*t-0.5)*t,
+             (1.5*t-2.5)*t*t+1.0,
+             ((-1.5*t+2.0)*t+0.5)*t,
+             (0.5*t-0.5)*t*t]
+    idx = np.array([i0+o for o in offsets])
+    w = np.array(w)
+    if method=='cubic':
+        # linear interpolation in the first and last source interval
+        border = (i0<1) | (i0>n-3)
+        w[:,border] = [np.zeros(np.sum(border)),1.0-t[border],t[border],np.zeros(np.sum(border))]
+    outside = (idx<0) | (idx>n-1) | ~inside[np.newaxis,:]
+    w[outside] = 0.0
+    idx = np.clip(idx,0,n-1)
+    return idx,w
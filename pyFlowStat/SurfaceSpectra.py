@@ -0,0 +1,264 @@
+'''
+SurfaceSpectra.py
+
+Wavenumber spectra of the fields of Surfaces and SurfaceTimeSeries. The
+spectra of a stack of frames (T,ny,nx) are computed with one batched real FFT
+(numpy.fft.rfft along the rows or the columns, numpy.fft.rfft2 for the 2D
+spectrum) and accumulated in an ensemble average, so that a long
+SurfaceTimeSeries is processed in one streaming pass, chunk by chunk.
+'''
+
+#=============================================================================#
+# load modules
+#=============================================================================#
+#scientific modules
+import numpy as np
+
+
+class WavenumberSpectrum(object):
+    '''
+    Ensemble averaged wavenumber power spectral density of a scalar field
+    (one velocity component for example).
+
+    Kinds of spectra:
+        * "x": 1D spectrum along the rows (wavenumber kx). Each row of each
+          frame is a sample.
+        * "y": 1D spectrum along the columns (wavenumber ky). Each column of
+          each frame is a sample.
+        * "2d": 2D spectrum E(ky,kx). Each frame is a sample.
+
+    The wavenumbers are in rad per unit of dx and dy. The PSD is one-sided
+    (positive kx, or positive k for the 1D spectra) and normalized so that
+    its integral over the wavenumbers is the variance of the samples. The
+    mean of each sample is subtracted before the FFT.
+
+    NaN handling (nanMethod):
+        * "exclude": the lines (1D) or frames (2D) with a NaN are ignored.
+        * "interpolate": the gaps of each line are filled by linear
+          interpolation of the valid values of the line (constant
+          extrapolation at the ends). Lines without valid value are ignored.
+
+    Usage:
+        >>> spec = WavenumberSpectrum(sts.dx,sts.dy,kind='x',window='hann')
+        >>> spec.addTimeSeries(sts,component='vx',chunkSize=200)
+        >>> kx,Exx = spec.getSpectrum()
+    '''
+
+    # constructors #
+    #--------------#
+    def __init__(self,dx,dy,kind='x',window='hann',nanMethod='exclude'):
+        '''
+        base constructor.
+
+        Arguments:
+            *dx*, *dy*: python float.
+             Grid spacing.
+
+            *kind*: python string.
+             "x", "y" or "2d". Default="x".
+
+            *window*: python string or None.
+             "hann", "hamming", "blackman" or None (rectangular window).
+             Default="hann".
+
+            *nanMethod*: python string.
+             "exclude" or "interpolate". Default="exclude".
+        '''
+        if kind not in ['x','y','2d']:
+            raise ValueError('kind "'+str(kind)+'" is not "x", "y" or "2d".')
+        if nanMethod not in ['exclude','interpolate']:
+            raise ValueError('nanMethod "'+str(nanMethod)+'" is not "exclude" or "interpolate".')
+        self.dx = dx
+        self.dy = dy
+        self.kind = kind
+        self.window = window
+        self.nanMethod = nanMethod
+
+        self.psdSum = None
+        self.nSamples = 0
+        self.shape = None
+
+
+    # getters #
+    #---------#
+    @property
+    def kx(self):
+        '''
+        Wavenumbers along x (rad per unit of dx), one-sided.
+        '''
+        return 2.0*np.pi*np.fft.rfftfreq(self.shape[1],self.dx)
+
+    @property
+    def ky(self):
+        '''
+        Wavenumbers along y (rad per unit of dy). One-sided for kind="y",
+        two-sided and sorted (fftshift) for kind="2d".
+        '''
+        if self.kind=='2d':
+            return 2.0*np.pi*np.fft.fftshift(np.fft.fftfreq(self.shape[0],self.dy))
+        return 2.0*np.pi*np.fft.rfftfreq(self.shape[0],self.dy)
+
+
+    # class methods #
+    #---------------#
+    def addFrames(self,field):
+        '''
+        Add the spectra of one frame (ny,nx) or of a stack of frames
+        (T,ny,nx) to the ensemble average.
+        '''
+        field = np.asarray(field,dtype=float)
+        if field.ndim==2:
+            field = field[np.newaxis]
+        if self.shape is None:
+            self.shape = field.shape[1:]
+        elif field.shape[1:]!=self.shape:
+            raise ValueError('frame shape '+str(field.shape[1:])+' does not '
+                             'match the spectrum shape '+str(self.shape)+'.')
+
+        if self.kind=='2d':
+            psd,n = self._spectrum2D(field)
+        elif self.kind=='x':
+            psd,n = self._spectrum1D(field.reshape(-1,self.shape[1]),self.dx)
+        else:
+            psd,n = self._spectrum1D(field.transpose((0,2,1)).reshape(-1,self.shape[0]),self.dy)
+        if n==0:
+            return
+        if self.psdSum is None:
+            self.psdSum = psd
+        else:
+            self.psdSum = self.psdSum+psd
+        self.nSamples = self.nSamples+n
+
+    def addSurface(self,surface,component='vx'):
+        '''
+        Add the spectrum of the field "component" ('vx', 'vy', 'vz' or a key
+        of surface.data) of a Surface.
+        '''
+        if component in ['vx','vy','vz']:
+            self.addFrames(getattr(surface,component))
+        else:
+            self.addFrames(surface.data[component])
+
+    def addTimeSeries(self,sts,component='vx',chunkSize=100):
+        '''
+        Add the spectra of all the frames of the component ('vx', 'vy' or
+        'vz') of a SurfaceTimeSeries, by chunks of chunkSize frames.
+        '''
+        field = getattr(sts,component)
+        for start in range(0,len(field),chunkSize):
+            self.addFrames(field[start:start+chunkSize])
+
+    def getSpectrum(self):
+        '''
+        Returns the ensemble averaged spectrum.
+
+        Returns:
+            *k*, *E*: for kind="x" or "y", numpy arrays of the wavenumbers and
+             the PSD.
+            *ky*, *kx*, *E*: for kind="2d", E has the shape (len(ky),len(kx)).
+        '''
+        if self.nSamples==0:
+            raise ValueError('no valid sample added.')
+        E = self.psdSum/self.nSamples
+        if self.kind=='x':
+            return self.kx,E
+        elif self.kind=='y':
+            return self.ky,E
+        return self.ky,self.kx,np.fft.fftshift(E,axes=0)
+
+    def _spectrum1D(self,lines,d):
+        '''
+        Sum of the PSD of the lines (nLines,n) and number of valid lines.
+        '''
+        n = lines.shape[1]
+        lines = self._validLines(lines)
+        if lines.shape[0]==0:
+            return None,0
+        w = getWindow(self.window,n)
+        lines = lines-np.mean(lines,axis=1)[:,np.newaxis]
+        X = np.fft.rfft(lines*w,axis=1)
+        # one-sided PSD, integral over k = variance
+        psd = np.sum(np.abs(X)**2,axis=0)*d/(np.pi*n*np.mean(w**2))
+        psd[0] = 0.5*psd[0]
+        if n%2==0:
+            psd[-1] = 0.5*psd[-1]
+        return psd,lines.shape[0]
+
+    def _spectrum2D(self,frames):
+        '''
+        Sum of the 2D PSD of the frames (T,ny,nx) and number of valid frames.
+        '''
+        ny,nx = frames.shape[1:]
+        if self.nanMethod=='interpolate':
+            frames = fillGaps(frames.reshape(-1,nx)).reshape(frames.shape)
+        frames = frames[np.all(np.isfinite(frames.reshape(frames.shape[0],-1)),axis=1)]
+        if frames.shape[0]==0:
+            return None,0
+        w = np.outer(getWindow(self.window,ny),getWindow(self.window,nx))
+        frames = frames-np.mean(frames,axis=(1,2))[:,np.newaxis,np.newaxis]
+        X = np.fft.rfft2(frames*w,axes=(1,2))
+        psd = np.sum(np.abs(X)**2,axis=0)*self.dx*self.dy/((2.0*np.pi)**2*nx*ny*np.mean(w**2))
+        # one-sided in kx
+        psd[:,1:] = 2.0*psd[:,1:]
+        if nx%2==0:
+            psd[:,-1] = 0.5*psd[:,-1]
+        return psd,frames.shape[0]
+
+    def _validLines(self,lines):
+        '''
+        Lines without NaN, after gap filling if nanMethod="interpolate".
+        '''
+        if self.nanMethod=='interpolate':
+            lines = fillGaps(lines)
+        return lines[np.all(np.isfinite(lines),axis=1)]
+
+
+#=============================================================================#
+# functions
+#=============================================================================#
+def getWindow(window,n):
+    '''
+    Window function of length n: "hann", "hamming", "blackman" or None
+    (rectangular).
+    '''
+    if window==None:
+        return np.ones(n)
+    elif window=='hann':
+        return np.hanning(n)
+    elif window=='hamming':
+        return np.hamming(n)
+    elif window=='blackman':
+        return np.blackman(n)
+    else:
+        raise ValueError('window "'+str(window)+'" is not "hann", "hamming", "blackman" or None.')
+
+def fillGaps(lines):
+    '''
+    Fill the NaN of each line of lines (nLines,n) by linear interpolation of
+    the valid values of the line, and constant extrapolation at the ends.
+    Lines without valid value stay NaN. Vectorized over all the lines.
+    '''
+    lines = np.array(lines,dtype=float)
+    valid = np.isfinite(lines)
+    if np.all(valid):
+        return lines
+    n = lines.shape[1]
+    idx = np.arange(n)[np.newaxis,:]
+    # index of the previous and next valid value of each point
+    prev = np.maximum.accumulate(np.where(valid,idx,-1),axis=1)
+    nxt = np.minimum.accumulate(np.where(valid,idx,n)[:,::-1],axis=1)[:,::-1]
+    noPrev = prev<0
+    noNext = nxt>=n
+    prev = np.where(noPrev,nxt,prev)
+    nxt = np.where(noNext,prev,nxt)
+    empty = noPrev & noNext
+    prev[empty] = 0
+    nxt[empty] = 0
+    rows = np.arange(lines.shape[0])[:,np.newaxis]
+    vPrev = lines[rows,prev]
+    vNext = lines[rows,nxt]
+    span = (nxt-prev).astype(float)
+    t = np.where(span>0,(idx-prev)/np.where(span>0,span,1.0),0.0)
+    res = np.where(valid,lines,(1.0-t)*vPrev+t*vNext)
+    res[empty] = np.nan
+    return res
@@ -0,0 +1,663 @@
+'''
+TriGridResampler.py
+
+Interpolation from a triangulated surface (for example an OpenFOAM sampled
+surface) to the cartesian grid of a Surface object. The triangle containing
+each grid point is located once and the interpolation weights are stored as a
+sparse matrix. Resampling a field is then a single sparse matrix product,
+whatever the number of components or time steps.
+'''
+
+#=============================================================================#
+# load modules
+#=============================================================================#
+import h5py
+
+#scientific modules
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg as splinalg
+import matplotlib.tri as tri
+
+# element of tri.CubicTriInterpolator, used to assemble the "min_E" system
+try:
+    from matplotlib.tri._triinterpolate import _ReducedHCT_Element
+except ImportError:
+    try:
+        from matplotlib.tri.triinterpolate import _ReducedHCT_Element
+    except ImportError:
+        _ReducedHCT_Element = None
+
+
+class TriGridResampler(object):
+    '''
+    Sparse interpolation operator from the points of a matplotlib
+    Triangulation to a cartesian grid.
+
+    The cartesian grid is defined by its cell centers minX,maxX,minY,maxY and
+    its size cellsX, cellsY (same grid as Surface.readFromFoamFile).
+
+    Supported interpolation methods:
+        * "linear": barycentric weights (same as tri.LinearTriInterpolator).
+        * "cubic" with kind="geom": weights of tri.CubicTriInterpolator with
+          kind="geom". The geometric estimation of the nodal gradients is
+          linear in the field, therefore the whole interpolation is one
+          sparse matrix.
+        * "cubic" with kind="min_E": the nodal gradients depend on the field
+          through a global minimization. The system of the minimization is
+          factorized once (see minEOperators) and the nodal gradients of all
+          the fields given to resample are solved together, the rest of the
+          interpolation uses the stored sparse weights.
+
+    Grid points outside the triangulation are set to NaN.
+
+    Usage:
+        >>> r = TriGridResampler.createFromTriangulation(tsm.triangulation,dx=1.0,dy=1.0)
+        >>> vx,vy,vz = r.resample(tsv.rawVars())
+        >>> r.save('resampler.h5')
+        >>> r = TriGridResampler.load('resampler.h5')
+    '''
+
+    # constructors #
+    #--------------#
+    def __init__(self,
+                 triangulation,
+                 minX,
+                 maxX,
+                 minY,
+                 maxY,
+                 cellsX,
+                 cellsY,
+                 method='cubic',
+                 kind='min_E'):
+        '''
+        base constructor. Computes the interpolation weights.
+
+        Arguments:
+            *triangulation*: matplotlib.tri.Triangulation object.
+             Source triangulation.
+
+            *minX*, *maxX*, *minY*, *maxY*: python float.
+             Position of the first and last cell centers of the grid.
+
+            *cellsX*, *cellsY*: python int.
+             Number of cells in x and y direction.
+
+            *method*: python string.
+             "cubic" or "linear". Default="cubic".
+
+            *kind*: python string.
+             Algorithm used for the cubic interpolation. "min_E" or "geom".
+             Default="min_E".
+        '''
+        if method not in ['cubic','linear']:
+            raise ValueError('method "'+str(method)+'" is not "cubic" or "linear".')
+        if method=='cubic' and kind not in ['min_E','geom']:
+            raise ValueError('kind "'+str(kind)+'" is not "min_E" or "geom".')
+
+        self.minX = float(minX)
+        self.maxX = float(maxX)
+        self.minY = float(minY)
+        self.maxY = float(maxY)
+        self.cellsX = int(cellsX)
+        self.cellsY = int(cellsY)
+        self.method = method
+        self.kind = kind
+        self.nPoints = len(triangulation.x)
+        self.dx = 0.0
+        self.dy = 0.0
+        if self.cellsX>1:
+            self.dx = (self.maxX-self.minX)/(self.cellsX-1)
+        if self.cellsY>1:
+            self.dy = (self.maxY-self.minY)/(self.cellsY-1)
+
+        # the triangulation is only kept for the per-field gradient estimation
+        self.triangulation = None
+        self.Bx = None
+        self.By = None
+        self.__minE = None
+
+        grid_y, grid_x = self.getGrid()
+        gx = grid_x.ravel()
+        gy = grid_y.ravel()
+
+        trifinder = triangulation.get_trifinder()
+        tris = np.asarray(trifinder(gx,gy))
+        self.valid = tris!=-1
+
+        if method=='linear':
+            self.W = linearWeights(triangulation,gx,gy,tris)
+        else:
+            Bz,Bx,By = cubicWeights(triangulation,gx,gy,tris)
+            if kind=='geom':
+                Gx,Gy = geomGradientOperators(triangulation)
+                self.W = (Bz+Bx*Gx+By*Gy).tocsr()
+            else:
+                self.W = Bz
+                self.Bx = Bx
+                self.By = By
+                self.triangulation = triangulation
+
+    @classmethod
+    def createFromTriangulation(cls,
+                                triangulation,
+                                dx=None,
+                                dy=None,
+                                bounds=None,
+                                method='cubic',
+                                kind='min_E'):
+        '''
+        Create a TriGridResampler for a grid of spacing dx, dy covering the
+        triangulation. The grid is the one of Surface.readFromFoamFile.
+
+        Arguments:
+            *triangulation*: matplotlib.tri.Triangulation object.
+             Source triangulation.
+
+            *dx*, *dy*: python float.
+             Spacing of the grid. If None, the smallest non-zero distance
+             between two consecutive points is used. Default=None.
+
+            *bounds*: python list of float.
+             Cell centers [minX,maxX,minY,maxY] of the grid. If None, the
+             bounding box of the triangulation is used. Default=None.
+
+            *method*: python string.
+             "cubic" or "linear". Default="cubic".
+
+            *kind*: python string.
+             "min_E" or "geom". Default="min_E".
+
+        Returns:
+            *resampler*: pyFlowStat.TriGridResampler object.
+        '''
+        x = triangulation.x
+        y = triangulation.y
+        if dx==None:
+            dxlist = np.abs(np.diff(x))
+            dx = np.min(dxlist[dxlist>0])
+        if dy==None:
+            dylist = np.abs(np.diff(y))
+            dy = np.min(dylist[dylist>0])
+        if bounds==None:
+            bounds = [np.min(x),np.max(x),np.min(y),np.max(y)]
+        minX,maxX,minY,maxY = bounds
+
+        cellsX = int((maxX-minX)/dx)+1
+        cellsY = int((maxY-minY)/dy)+1
+        r = cls(triangulation,minX,maxX,minY,maxY,cellsX,cellsY,method=method,kind=kind)
+        r.dx = dx
+        r.dy = dy
+        return r
+
+    @classmethod
+    def load(cls,filename,group='TriGridResampler'):
+        '''
+        Load a TriGridResampler saved with TriGridResampler.save().
+
+        Arguments:
+            *filename*: python string.
+             Path of the HDF5 file.
+
+            *group*: python string.
+             Name of the HDF5 group. Default="TriGridResampler".
+
+        Returns:
+            *resampler*: pyFlowStat.TriGridResampler object.
+        '''
+        f = h5py.File(filename,'r')
+        g = f[group]
+        r = cls.__new__(cls)
+        for key in ['minX','maxX','minY','maxY','dx','dy']:
+            setattr(r,key,float(g.attrs[key]))
+        for key in ['cellsX','cellsY','nPoints']:
+            setattr(r,key,int(g.attrs[key]))
+        r.method = str(g.attrs['method'])
+        r.kind = str(g.attrs['kind'])
+        r.valid = g['valid'][()].astype(bool)
+        r.W = _readCsr(g['W'])
+        r.Bx = None
+        r.By = None
+        r.triangulation = None
+        r.__minE = None
+        if 'Bx' in g:
+            r.Bx = _readCsr(g['Bx'])
+            r.By = _readCsr(g['By'])
+            r.triangulation = tri.Triangulation(g['x'][()],
+                                                g['y'][()],
+                                                triangles=g['triangles'][()])
+        f.close()
+        return r
+
+
+    # getters #
+    #---------#
+    @property
+    def shape(self):
+        '''
+        Shape of the grid, in the Surface orientation (ny,nx).
+        '''
+        return (self.cellsY,self.cellsX)
+
+    @property
+    def extent(self):
+        return [self.minX-self.dx/2,self.maxX+self.dx/2,self.minY-self.dy/2,self.maxY+self.dy/2]
+
+    # class methods #
+    #---------------#
+    def getGrid(self):
+        '''
+        Return the grid as grid_y,grid_x from numpy.mgrid (y increasing with
+        the row index).
+        '''
+        return np.mgrid[self.minY:self.maxY:complex(0,self.cellsY),
+                        self.minX:self.maxX:complex(0,self.cellsX)]
+
+    def resample(self,values):
+        '''
+        Interpolate one or several fields on the grid.
+
+        Arguments:
+            *values*: numpy.array of shape=(nPoints,) or (nPoints,n).
+             Values at the points of the triangulation. The n columns (for
+             example the components of a vector or several time steps) are
+             interpolated with one sparse matrix product.
+
+        Returns:
+            *res*: numpy.array of shape=(ny,nx) or (n,ny,nx).
+             Interpolated values, in the Surface orientation (flipped in y).
+             NaN outside of the triangulation.
+        '''
+        values = np.asarray(values,dtype=float)
+        if values.shape[0]!=self.nPoints:
+            raise ValueError('values has '+str(values.shape[0])+' points, the '
+                             'resampler was created for '+str(self.nPoints)+' points.')
+        oneD = values.ndim==1
+        if oneD:
+            values = values[:,np.newaxis]
+
+        res = self.W*values
+        if self.Bx is not None:
+            res = res+self._minEGradientTerm(values)
+        res[~self.valid,:] = np.nan
+
+        res = res.T.reshape((values.shape[1],self.cellsY,self.cellsX))[:,::-1,:]
+        if oneD:
+            return res[0]
+        return res
+
+    def _minEGradientTerm(self,values):
+        '''
+        Contribution of the "min_E" nodal gradients to the cubic interpolation.
+        The factorization of the "min_E" system is computed on the first
+        call and reused by the next ones.
+        '''
+        if self.__minE is None:
+            self.__minE = minEOperators(self.triangulation)
+        dzdx,dzdy = minEGradients(self.__minE,values)
+        return self.Bx*dzdx+self.By*dzdy
+
+    def save(self,filename,group='TriGridResampler',mode='a'):
+        '''
+        Save the resampler in a HDF5 file.
+
+        Arguments:
+            *filename*: python string.
+             Path of the HDF5 file.
+
+            *group*: python string.
+             Name of the HDF5 group. Replaced if it exists.
+             Default="TriGridResampler".
+
+            *mode*: python string.
+             Mode used to open the HDF5 file. Default="a".
+        '''
+        f = h5py.File(filename,mode)
+        if group in f:
+            del f[group]
+        g = f.create_group(group)
+        for key in ['minX','maxX','minY','maxY','dx','dy','cellsX','cellsY','nPoints','method','kind']:
+            g.attrs[key] = getattr(self,key)
+        g.create_dataset('valid',data=self.valid.astype(np.uint8))
+        _writeCsr(g.create_group('W'),self.W)
+        if self.Bx is not None:
+            _writeCsr(g.create_group('Bx'),self.Bx)
+            _writeCsr(g.create_group('By'),self.By)
+            g.create_dataset('x',data=self.triangulation.x)
+            g.create_dataset('y',data=self.triangulation.y)
+            g.create_dataset('triangles',data=self.triangulation.triangles)
+        f.close()
+
+
+#=============================================================================#
+# functions
+#=============================================================================#
+def linearWeights(triangulation,gx,gy,tris):
+    '''
+    Barycentric interpolation weights as a sparse matrix of shape
+    (len(gx),nPoints). Rows of the points outside of the triangulation
+    (tris==-1) are empty.
+    '''
+    valid = np.where(tris!=-1)[0]
+    T = triangulation.triangles[tris[valid]]
+    x = triangulation.x[T]
+    y = triangulation.y[T]
+    px = gx[valid]
+    py = gy[valid]
+
+    det = (y[:,1]-y[:,2])*(x[:,0]-x[:,2])+(x[:,2]-x[:,1])*(y[:,0]-y[:,2])
+    l0 = ((y[:,1]-y[:,2])*(px-x[:,2])+(x[:,2]-x[:,1])*(py-y[:,2]))/det
+    l1 = ((y[:,2]-y[:,0])*(px-x[:,2])+(x[:,0]-x[:,2])*(py-y[:,2]))/det
+    l2 = 1.0-l0-l1
+
+    rows = np.repeat(valid,3)
+    data = np.vstack([l0,l1,l2]).T.ravel()
+    return sparse.csr_matrix((data,(rows,T.ravel())),shape=(len(gx),len(triangulation.x)))
+
+def linearGradientWeights(triangulation,gx,gy,tris):
+    '''
+    Gradient of the barycentric interpolation (constant in each triangle,
+    same as tri.LinearTriInterpolator.gradient) as two sparse matrices Dx,
+    Dy of shape (len(gx),nPoints). Rows of the points outside of the
+    triangulation (tris==-1) are empty.
+    '''
+    valid = np.where(tris!=-1)[0]
+    T = triangulation.triangles[tris[valid]]
+    x = triangulation.x[T]
+    y = triangulation.y[T]
+
+    det = (x[:,1]-x[:,0])*(y[:,2]-y[:,0])-(x[:,2]-x[:,0])*(y[:,1]-y[:,0])
+    cx = np.vstack([y[:,1]-y[:,2],y[:,2]-y[:,0],y[:,0]-y[:,1]]).T/det[:,np.newaxis]
+    cy = np.vstack([x[:,2]-x[:,1],x[:,0]-x[:,2],x[:,1]-x[:,0]]).T/det[:,np.newaxis]
+
+    rows = np.repeat(valid,3)
+    shape = (len(gx),len(triangulation.x))
+    Dx = sparse.csr_matrix((cx.ravel(),(rows,T.ravel())),shape=shape)
+    Dy = sparse.csr_matrix((cy.ravel(),(rows,T.ravel())),shape=shape)
+    return Dx,Dy
+
+def cubicWeights(triangulation,gx,gy,tris):
+    '''
+    Weights of the reduced HCT element of tri.CubicTriInterpolator.
+
+    The interpolated value at a grid point only depends on the value and on
+    the gradient at the three nodes of its triangle:
+        f = Bz*z + Bx*dzdx + By*dzdy
+
+    Returns:
+        *Bz*, *Bx*, *By*: scipy.sparse.csr_matrix of shape (len(gx),nPoints).
+    '''
+    return cubicOperators(triangulation,gx,gy,tris,keys=['z'])['z']
+
+def cubicOperators(triangulation,gx,gy,tris,keys=['z','dzdx','dzdy']):
+    '''
+    Weights of the reduced HCT element of tri.CubicTriInterpolator for the
+    interpolated value ("z") and its derivatives ("dzdx", "dzdy"). Each
+    of them is a linear function of the nodal values and gradients of the
+    triangle of the point, see cubicWeights.
+
+    The sparse matrices are obtained by probing an interpolator of kind
+    "user": the nodes are colored such that the nodes of a triangle have
+    different colors, and each probe activates the nodes of one color.
+
+    Returns:
+        *operators*: python dict. For each key, the tuple (Bz,Bx,By) of
+         scipy.sparse.csr_matrix of shape (len(gx),nPoints).
+    '''
+    nPoints = len(triangulation.x)
+    triangles = triangulation.get_masked_triangles()
+    colors = colorNodes(triangles,nPoints)
+
+    valid = np.where(tris!=-1)[0]
+    T = triangulation.triangles[tris[valid]]
+    px = gx[valid]
+    py = gy[valid]
+    zero = np.zeros(nPoints)
+
+    coo = dict([(key,[]) for key in keys])
+    for probe in range(3):
+        for key in keys:
+            coo[key].append([[],[],[]])
+        for c in range(colors.max()+1):
+            ind = (colors==c).astype(float)
+            if probe==0:
+                itp = tri.CubicTriInterpolator(triangulation,ind,kind='user',dz=(zero,zero))
+            elif probe==1:
+                itp = tri.CubicTriInterpolator(triangulation,zero,kind='user',dz=(ind,zero))
+            else:
+                itp = tri.CubicTriInterpolator(triangulation,zero,kind='user',dz=(zero,ind))
+            vals = dict()
+            if 'z' in keys:
+                vals['z'] = itp(px,py)
+            if 'dzdx' in keys or 'dzdy' in keys:
+                vals['dzdx'],vals['dzdy'] = itp.gradient(px,py)
+            # node of color c in the triangle of each grid point
+            hasColor = colors[T]==c
+            i,k = np.nonzero(hasColor)
+            for key in keys:
+                coo[key][probe][0].append(valid[i])
+                coo[key][probe][1].append(T[i,k])
+                coo[key][probe][2].append(np.ma.filled(vals[key],0.0)[i])
+    operators = dict()
+    for key in keys:
+        B = []
+        for rows,cols,data in coo[key]:
+            B.append(sparse.csr_matrix((np.concatenate(data),(np.concatenate(rows),np.concatenate(cols))),
+                                       shape=(len(gx),nPoints)))
+        operators[key] = (B[0],B[1],B[2])
+    return operators
+
+def colorNodes(triangles,nPoints):
+    '''
+    Coloring of the nodes, such that the three nodes of a triangle have
+    different colors. The colors are filled one after the other with a
+    maximal independent set of the uncolored nodes, built by rounds over the
+    edges: an eligible node takes the color if its (random, fixed seed)
+    priority is larger than the priorities of its eligible neighbors.
+    '''
+    edges = np.vstack([triangles[:,[0,1]],triangles[:,[1,2]],triangles[:,[2,0]]])
+    edges = np.vstack([edges,edges[:,::-1]])
+    adj = sparse.csr_matrix((np.ones(len(edges)),(edges[:,0],edges[:,1])),shape=(nPoints,nPoints))
+    # unique edges, sorted by source node
+    src = np.repeat(np.arange(nPoints),np.diff(adj.indptr))
+    dst = adj.indices
+    prio = np.random.RandomState(0).permutation(nPoints)+1.0
+    colors = -np.ones(nPoints,dtype=int)
+    c = 0
+    while np.any(colors<0):
+        eligible = colors<0
+        s = src
+        d = dst
+        while np.any(eligible):
+            # edges between eligible nodes
+            keep = eligible[s] & eligible[d]
+            s = s[keep]
+            d = d[keep]
+            starts = np.flatnonzero(np.diff(np.concatenate([[-1],s])))
+            nbMax = np.zeros(nPoints)
+            if len(starts)>0:
+                nbMax[s[starts]] = np.maximum.reduceat(prio[d],starts)
+            pick = eligible & (prio>nbMax)
+            colors[pick] = c
+            # the neighbors of the picked nodes cannot take the color c
+            blocked = np.zeros(nPoints,dtype=bool)
+            blocked[s[pick[d]]] = True
+            eligible = eligible & ~pick & ~blocked
+        # edges between uncolored nodes
+        keep = (colors[src]<0) & (colors[dst]<0)
+        src = src[keep]
+        dst = dst[keep]
+        c+=1
+    return colors
+
+def geomGradientOperators(triangulation):
+    '''
+    Sparse operators Gx, Gy of shape (nPoints,nPoints) giving the nodal
+    gradients estimated by tri.CubicTriInterpolator with kind="geom": the
+    gradient of each triangle (field assumed linear) averaged over the
+    triangles sharing the node, weighted by the angle of the triangle at the
+    node (see nodalGradientOperators).
+    '''
+    triangles = triangulation.get_masked_triangles()
+    ux,uy = _unitScales(triangulation,triangles)
+
+    # angles are computed in the unit box, as in matplotlib
+    xs = triangulation.x[triangles]/ux
+    ys = triangulation.y[triangles]/uy
+    w = np.zeros(triangles.shape)
+    for ipt in range(3):
+        alpha1 = np.arctan2(ys[:,(ipt+1)%3]-ys[:,ipt],xs[:,(ipt+1)%3]-xs[:,ipt])
+        alpha2 = np.arctan2(ys[:,(ipt-1)%3]-ys[:,ipt],xs[:,(ipt-1)%3]-xs[:,ipt])
+        angle = np.abs(((alpha2-alpha1)/np.pi)%1)
+        w[:,ipt] = 0.5-np.abs(angle-0.5)
+    return nodalGradientOperators(triangulation,w)
+
+def nodalGradientOperators(triangulation,weights):
+    '''
+    Sparse operators Gx, Gy of shape (nPoints,nPoints) giving the nodal
+    gradients of a field as the weighted average of the gradients of the
+    linear (P1) interpolation of the triangles sharing the node. The
+    gradient of the flat triangles (relative area below 1e-12) is 0.
+
+    Arguments:
+        *triangulation*: matplotlib.tri.Triangulation object.
+
+        *weights*: numpy array of shape (nTriangles,3).
+         Weight of each (unmasked, see get_masked_triangles) triangle at
+         each of its nodes.
+
+    Returns:
+        *Gx*, *Gy*: scipy.sparse.csr_matrix
+    '''
+    nPoints = len(triangulation.x)
+    triangles = triangulation.get_masked_triangles()
+    x = triangulation.x[triangles]
+    y = triangulation.y[triangles]
+    ux,uy = _unitScales(triangulation,triangles)
+
+    # gradient of the linear function: grad f = sum_k c_k*f_k
+    det = (x[:,1]-x[:,0])*(y[:,2]-y[:,0])-(x[:,2]-x[:,0])*(y[:,1]-y[:,0])
+    flat = np.abs(det)<=1e-12*np.abs(ux*uy)
+    det[flat] = 1.0
+    cx = np.vstack([y[:,1]-y[:,2],y[:,2]-y[:,0],y[:,0]-y[:,1]]).T/det[:,np.newaxis]
+    cy = np.vstack([x[:,2]-x[:,1],x[:,0]-x[:,2],x[:,1]-x[:,0]]).T/det[:,np.newaxis]
+    cx[flat] = 0.0
+    cy[flat] = 0.0
+
+    w = np.asarray(weights,dtype=float)
+    wsum = np.bincount(triangles.ravel(),weights=w.ravel(),minlength=nPoints)
+    wsum[wsum==0] = 1.0
+
+    # rows: apex a of triangle t, cols: node k of triangle t
+    rows = np.repeat(triangles,3,axis=1).ravel()
+    cols = np.tile(triangles,(1,3)).ravel()
+    wa = np.repeat(w,3,axis=1)
+    Gx = sparse.csr_matrix(((wa*np.tile(cx,(1,3))).ravel(),(rows,cols)),shape=(nPoints,nPoints))
+    Gy = sparse.csr_matrix(((wa*np.tile(cy,(1,3))).ravel(),(rows,cols)),shape=(nPoints,nPoints))
+    scale = sparse.diags(1.0/wsum,0)
+    return (scale*Gx).tocsr(),(scale*Gy).tocsr()
+
+def _unitScales(triangulation,triangles):
+    '''
+    Extent in x and y of the nodes of the triangles.
+    '''
+    used = np.unique(triangles)
+    return np.ptp(triangulation.x[used]),np.ptp(triangulation.y[used])
+
+def minEOperators(triangulation):
+    '''
+    Linear system of the "min_E" nodal gradients of tri.CubicTriInterpolator:
+    minimization of the bending energy of the reduced HCT elements with the
+    nodal values imposed,
+        Kff*Uf = -Kfc*z
+    with Uf the nodal gradients in the coordinates scaled by the extent of
+    the triangulation (as in matplotlib), Uf = [dzdx0,dzdy0,dzdx1,...].
+
+    Returns:
+        *lu*: LU factorization of Kff (scipy.sparse.linalg.splu).
+
+        *Kfc*: scipy.sparse.csr_matrix of shape (2*nPoints,nPoints).
+
+        *unitX*, *unitY*: python float, scales of the x and y coordinates.
+        
+    If the element of matplotlib is not available, the triangulation is
+    returned instead and minEGradients uses tri.CubicTriInterpolator.
+    '''
+    if _ReducedHCT_Element is None:
+        return triangulation
+    nPoints = len(triangulation.x)
+    triangles = triangulation.get_masked_triangles()
+    used = np.unique(triangles)
+    unitX = np.ptp(triangulation.x[used])
+    unitY = np.ptp(triangulation.y[used])
+    pts = np.vstack([triangulation.x/unitX,triangulation.y/unitY]).T
+    trisPts = pts[triangles]
+
+    J = tri.CubicTriInterpolator._get_jacobian(trisPts)
+    eccs = tri.CubicTriInterpolator._compute_tri_eccentricities(trisPts)
+    K = _ReducedHCT_Element().get_bending_matrices(J,eccs)
+
+    # free dofs (gradients) and imposed dofs (values) of the element
+    fDof = [1,2,4,5,7,8]
+    cDof = [0,3,6]
+    fIdx = np.vstack([2*triangles[:,0],2*triangles[:,0]+1,
+                      2*triangles[:,1],2*triangles[:,1]+1,
+                      2*triangles[:,2],2*triangles[:,2]+1]).T
+    Kff = sparse.coo_matrix((K[:,fDof][:,:,fDof].ravel(),
+                             (np.repeat(fIdx,6,axis=1).ravel(),np.tile(fIdx,(1,6)).ravel())),
+                            shape=(2*nPoints,2*nPoints)).tocsc()
+    Kfc = sparse.coo_matrix((K[:,fDof][:,:,cDof].ravel(),
+                             (np.repeat(fIdx,3,axis=1).ravel(),np.tile(triangles,(1,6)).ravel())),
+                            shape=(2*nPoints,nPoints)).tocsr()
+
+    # the gradients of the nodes without triangle are 0
+    unused = np.ones(nPoints,dtype=bool)
+    unused[used] = False
+    if np.any(unused):
+        diag = np.repeat(unused,2).astype(float)
+        Kff = (Kff+sparse.diags(diag,0)).tocsc()
+    return splinalg.splu(Kff),Kfc,unitX,unitY
+
+def minEGradients(operators,values):
+    '''
+    "min_E" nodal gradients of one or several fields (shape (nPoints,) or
+    (nPoints,n)), with the operators returned by minEOperators. All the
+    fields are solved with the same factorization.
+
+    Returns:
+        *dzdx*, *dzdy*: numpy arrays of the shape of values.
+    '''
+    values = np.asarray(values,dtype=float)
+    if not isinstance(operators,tuple):
+        return _minEGradientsMatplotlib(operators,values)
+    lu,Kfc,unitX,unitY = operators
+    Uf = lu.solve(-(Kfc*values.reshape((values.shape[0],-1))))
+    dzdx = (Uf[0::2]/unitX).reshape(values.shape)
+    dzdy = (Uf[1::2]/unitY).reshape(values.shape)
+    return dzdx,dzdy
+
+def _minEGradientsMatplotlib(triangulation,values):
+    '''
+    "min_E" nodal gradients estimated with one tri.CubicTriInterpolator per
+    field. Used if the element of matplotlib is not available.
+    '''
+    values2D = values.reshape((values.shape[0],-1))
+    dzdx = np.empty(values2D.shape)
+    dzdy = np.empty(values2D.shape)
+    for i in range(values2D.shape[1]):
+        itp = tri.CubicTriInterpolator(triangulation,values2D[:,i],kind='min_E')
+        dx,dy = itp.gradient(triangulation.x,triangulation.y)
+        dzdx[:,i] = np.ma.filled(dx,0.0)
+        dzdy[:,i] = np.ma.filled(dy,0.0)
+    return dzdx.reshape(values.shape),dzdy.reshape(values.shape)
+
+def _writeCsr(group,m):
+    m = m.tocsr()
+    group.create_dataset('data',data=m.data)
+    group.create_dataset('indices',data=m.indices)
+    group.create_dataset('indptr',data=m.indptr)
+    group.attrs['shape'] = m.shape
+
+def _readCsr(group):
+    return sparse.csr_matrix((group['data'][()],group['indices'][()],group['indptr'][()]),
+                             shape=tuple(group.attrs['shape']))
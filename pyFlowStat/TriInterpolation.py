@@ -0,0 +1,227 @@
+'''
+TriInterpolation.py
+
+Interpolation of the fields of the TriSurface objects sharing a
+TriSurfaceMesh. Everything depending only on the mesh is computed once per
+mesh and interpolation type (see TriInterpolationContext):
+    * the TriFinder of the triangulation
+    * for each set of query points, the containing triangles and the sparse
+      interpolation weights (value and gradient)
+    * for the cubic interpolation, the linear operator estimating the nodal
+      gradients of a field ("geom" or "min_E")
+Interpolating a new field on the same mesh is then a few sparse
+matrix-vector products (and, for "min_E", the solve of a factorized
+system).
+'''
+
+#=============================================================================#
+# load modules
+#=============================================================================#
+import hashlib
+from collections import OrderedDict
+
+#scientific modules
+import numpy as np
+
+import pyFlowStat.TriGridResampler as TriGridResampler
+
+
+class TriInterpolationContext(object):
+    '''
+    Interpolation context of a matplotlib Triangulation.
+
+    Supported interpolation methods (same results as the matplotlib
+    interpolators):
+        * "linear": tri.LinearTriInterpolator
+        * "cubic" with kind="geom" or "min_E": tri.CubicTriInterpolator.
+          The nodal gradients are a linear function of the field: sparse
+          operators for "geom", factorized bending energy system for
+          "min_E" (TriGridResampler.minEOperators, solved directly instead
+          of with the iterative solver of matplotlib).
+
+    The weights of the last cacheSize sets of query points are kept.
+
+    Usage:
+        >>> ctx = tsm.getInterpolationContext('cubic','geom')
+        >>> vx_i,vy_i = ctx.createInterpolators([vx,vy])
+        >>> dvxdx,dvxdy = vx_i.gradient(tsm.x,tsm.y)
+    '''
+
+    # constructors #
+    #--------------#
+    def __init__(self,triangulation,interpolation='cubic',kind='geom',cacheSize=4):
+        '''
+        base constructor.
+
+        Arguments:
+            *triangulation*: matplotlib.tri.Triangulation object.
+
+            *interpolation*: python string.
+             "cubic" or "linear". Default="cubic".
+
+            *kind*: python string.
+             "geom" or "min_E", for the cubic interpolation. Default="geom".
+
+            *cacheSize*: python int.
+             Number of sets of query points whose weights are kept.
+             Default=4.
+        '''
+        if interpolation not in ['cubic','linear']:
+            raise ValueError('Interpolation must be "cubic" or "linear".')
+        if interpolation=='cubic' and kind not in ['geom','min_E']:
+            raise ValueError('kind "'+str(kind)+'" is not "geom" or "min_E".')
+        self.triangulation = triangulation
+        self.interpolation = interpolation
+        self.kind = kind
+        self.cacheSize = cacheSize
+        self.nPoints = len(triangulation.x)
+        self.trifinder = triangulation.get_trifinder()
+
+        # weights of the query points, key: see _queryKey
+        self.queries = OrderedDict()
+        self.__Gx = None
+        self.__Gy = None
+        self.__minE = None
+
+
+    # class methods #
+    #---------------#
+    def createInterpolator(self,z):
+        '''
+        Returns a TriContextInterpolator of the field z (shape (nPoints,)).
+        '''
+        return self.createInterpolators([z])[0]
+
+    def createInterpolators(self,fields):
+        '''
+        Returns a list of TriContextInterpolator, one for each field of the
+        list fields. The nodal gradients of all the fields are estimated
+        at once.
+        '''
+        values = np.array([np.asarray(f,dtype=float) for f in fields]).T
+        if self.interpolation=='linear':
+            return [TriContextInterpolator(self,values[:,i]) for i in range(values.shape[1])]
+        dzdx,dzdy = self.estimateGradients(values)
+        return [TriContextInterpolator(self,values[:,i],dz=(dzdx[:,i],dzdy[:,i]))
+                for i in range(values.shape[1])]
+
+    def estimateGradients(self,values):
+        '''
+        Nodal gradients of one or several fields (shape (nPoints,) or
+        (nPoints,n)), estimated as tri.CubicTriInterpolator does with kind.
+
+        Returns:
+            *dzdx*, *dzdy*: numpy arrays of the shape of values.
+        '''
+        values = np.asarray(values,dtype=float)
+        if self.kind=='geom':
+            if self.__Gx is None:
+                self.__Gx,self.__Gy = TriGridResampler.geomGradientOperators(self.triangulation)
+            return self.__Gx*values,self.__Gy*values
+        if self.__minE is None:
+            self.__minE = TriGridResampler.minEOperators(self.triangulation)
+        return TriGridResampler.minEGradients(self.__minE,values)
+
+    def getWeights(self,x,y,gradient=False):
+        '''
+        Sparse interpolation weights at the query points x,y (cached).
+
+        Returns:
+            *weights*: python dict with the entries
+             "valid": numpy bool array, False outside of the triangulation.
+             "z", "dzdx", "dzdy" (if gradient): a sparse matrix (linear) or
+             a tuple (Bz,Bx,By) of sparse matrices (cubic).
+        '''
+        key = _queryKey(x,y)
+        if key in self.queries:
+            weights = self.queries.pop(key)
+        else:
+            weights = dict()
+        self.queries[key] = weights
+        while len(self.queries)>max(self.cacheSize,1):
+            self.queries.popitem(last=False)
+
+        missing = [k for k in (['z','dzdx','dzdy'] if gradient else ['z']) if k not in weights]
+        if len(missing)>0:
+            gx = np.asarray(x,dtype=float).ravel()
+            gy = np.asarray(y,dtype=float).ravel()
+            if 'tris' not in weights:
+                weights['tris'] = np.asarray(self.trifinder(gx,gy)).ravel()
+                weights['valid'] = weights['tris']!=-1
+            tris = weights['tris']
+            if self.interpolation=='linear':
+                if 'z' in missing:
+                    weights['z'] = TriGridResampler.linearWeights(self.triangulation,gx,gy,tris)
+                if 'dzdx' in missing:
+                    weights['dzdx'],weights['dzdy'] = TriGridResampler.linearGradientWeights(self.triangulation,gx,gy,tris)
+            else:
+                weights.update(TriGridResampler.cubicOperators(self.triangulation,gx,gy,tris,keys=missing))
+        return weights
+
+    def interpolate(self,values,x,y,dz=None,key='z'):
+        '''
+        Interpolate the field values (shape (nPoints,)) at x,y.
+
+        Arguments:
+            *values*: numpy array of shape (nPoints,).
+
+            *x*, *y*: python float or numpy arrays of the same shape.
+
+            *dz*: python tuple (dzdx,dzdy) of the nodal gradients (cubic).
+             Estimated if None. Default=None.
+
+            *key*: python string.
+             "z" (value), "dzdx" or "dzdy" (derivatives). Default="z".
+
+        Returns:
+            *res*: numpy masked array of the shape of x, masked outside of
+             the triangulation.
+        '''
+        weights = self.getWeights(x,y,gradient=(key!='z'))
+        W = weights[key]
+        if self.interpolation=='linear':
+            res = W*values
+        else:
+            if dz==None:
+                dz = self.estimateGradients(values)
+            res = W[0]*values+W[1]*dz[0]+W[2]*dz[1]
+        valid = weights['valid']
+        res = np.ma.masked_array(np.where(valid,res,0.0),mask=~valid)
+        return res.reshape(np.shape(x))
+
+
+class TriContextInterpolator(object):
+    '''
+    Interpolator of one field, with the interface of the matplotlib
+    interpolators (__call__ and gradient). Created by
+    TriInterpolationContext.createInterpolators.
+    '''
+
+    # constructors #
+    #--------------#
+    def __init__(self,context,z,dz=None):
+        self.context = context
+        self.z = z
+        self.dz = dz
+
+
+    # class methods #
+    #---------------#
+    def __call__(self,x,y):
+        return self.context.interpolate(self.z,x,y,dz=self.dz,key='z')
+
+    def gradient(self,x,y):
+        return (self.context.interpolate(self.z,x,y,dz=self.dz,key='dzdx'),
+                self.context.interpolate(self.z,x,y,dz=self.dz,key='dzdy'))
+
+
+#=============================================================================#
+# functions
+#=============================================================================#
+def _queryKey(x,y):
+    '''
+    Hashable key of a set of query points.
+    '''
+    x = np.ascontiguousarray(x,dtype=float)
+    y = np.ascontiguousarray(y,dtype=float)
+    return (x.shape,hashlib.sha1(x.tobytes()).hexdigest(),hashlib.sha1(y.tobytes()).hexdigest())
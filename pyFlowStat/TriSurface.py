@@ -249,27 +249,14 @@ class TriSurface(object):
 #            *field*: numpy array of shape (N,d).
 #            
 #            *fieldName*: python string.
+#
+#        If projectedField is True, vectors (d=3) and symmTensors (d=6) are
+#        projected in the basis of the surface (see projectField).
         '''
-        fieldSrc = field
-        fieldShape = fieldSrc.shape
-        fieldTgt = np.zeros(fieldShape)
-
-        if (self.projectedField==True and len(fieldShape)>1):            
-            if fieldShape[1]==3:
-                for i in range(fieldShape[0]):
-                    fieldTgt[i,:] = self.linTrans.srcToTgt(fieldSrc[i,:])
-            if fieldShape[1]==6:
-                for i in range(fieldShape[0]):
-                    a = fieldSrc[i,:]
-                    A = np.array([[a[0],a[1],a[2]],
-                                  [a[1],a[3],a[4]],
-                                  [a[2],a[4],a[5]]])
-                    B = self.linTrans.srcToTgt(A)
-                    fieldTgt[i,:] = np.array([B[0,0],B[0,1],B[0,2],B[1,1],B[1,2],B[2,2]])
-                    
-                
+        if self.projectedField==True:
+            fieldTgt = projectField(field,self.linTrans)
         else:
-            fieldTgt = fieldSrc
+            fieldTgt = field
         self.data[fieldname] = fieldTgt
             
         
@@ -284,14 +271,16 @@ class TriSurface(object):
         self.addField(fieldSrc,fieldname)
         
         
-    def addFieldFromVTK(self,fieldFile,fieldname):
+    def addFieldFromVTK(self,fieldFile,fieldname,varName=None):
         '''
 #        Add a field F (shape d) stored in a VTK file to the current
 #        TriSurfaceVector object. See docstring from self.addField() for more
-#        information.
+#        information. varName is the name of the POINT_DATA array of the VTK
+#        file (first array if None).
         '''
         #get field
-        points, polygon, fieldSrc = ParserFunctions.parseVTK_ugly_sampledSurface(fieldFile)
+        points, polygon, pointData, cellData = ParserFunctions.parseVTK_sampledSurface(fieldFile)
+        fieldSrc = ParserFunctions.getVTKField(pointData,varName)
         self.addField(fieldSrc,fieldname)
     
     
@@ -372,6 +361,35 @@ def getTransformation(viewAnchor,
     
     return afftrans, lintrans
 
+
+def projectField(field,linTrans):
+    '''
+    Project a vector field (shape=[N,3]) or a symmTensor field (shape=[N,6])
+    from the source basis to the target basis of a LinearTransformation
+    linTrans: R*v for the vectors and R*T*R^T for the symmTensors, with R the
+    transformation matrix from the source to the target. All the points are
+    projected at once, a stack of fields (shape=[T,N,d]) is also accepted.
+    Other fields (scalars for example) are returned unmodified.
+    
+    Arguments:
+        *field*: numpy array. Shape=[N,d] or [T,N,d].
+         Field to project.
+         
+        *linTrans*: LinearTransformation object.
+         
+    Returns:
+        *projectedField*: numpy array of the shape of "field".
+    '''
+    field = np.asarray(field)
+    if field.ndim<2:
+        return field
+    if field.shape[-1]==3:
+        return linTrans.srcToTgtArray(field)
+    elif field.shape[-1]==6:
+        return linTrans.srcToTgtSymmTensorArray(field)
+    else:
+        return field
+
     
 def mat(field):
     '''
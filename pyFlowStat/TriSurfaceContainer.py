@@ -12,6 +12,7 @@ from pyFlowStat.TriSurfaceVector import TriSurfaceVector
 from pyFlowStat.TriSurfaceScalar import TriSurfaceScalar
 from pyFlowStat.TriSurfaceSymmTensor import TriSurfaceSymmTensor
 from pyFlowStat.TriSurfaceMesh import TriSurfaceMesh
+from pyFlowStat.TriSurfaceMesh import meshCache as sharedMeshCache
 
 
 class TriSurfaceContainer(object):
@@ -40,7 +41,7 @@ class TriSurfaceContainer(object):
         return c
     
     @classmethod
-    def createFromFoamFolder(cls,pathname,xViewBasis,yViewBasis=None,viewAnchor=(0,0,0),time=0.0,names=[]):
+    def createFromFoamFolder(cls,pathname,xViewBasis,yViewBasis=None,viewAnchor=(0,0,0),time=0.0,names=[],meshCache=sharedMeshCache):
         '''
         This function creates a TriSurfaceContainer for an OpenFOAM sampled
         surface folder (e.g./postProcessing/surfaces/0/planeXY/) and loads all
@@ -69,17 +70,26 @@ class TriSurfaceContainer(object):
             *names*: python list
              List of surface to load in the container.
              
+            *meshCache*: TriSurfaceMeshCache object.
+             Cache of the meshes. The containers of the time steps with the
+             same points and faces share the same TriSurfaceMesh. If None,
+             the mesh is always read. Default=TriSurfaceMesh.meshCache.
+             
         Returns:
             *tsc*: pyflowStat.TriSurfaceContainer object 
         '''
         pointsFile=os.path.join(pathname,'points')
         facesFile=os.path.join(pathname,'faces')
 
-        tsm=TriSurfaceMesh.readFromFoamFile(pointsFile=pointsFile,
-                                           facesFile=facesFile,
-                                           viewAnchor=viewAnchor,
-                                           xViewBasis=xViewBasis,
-                                           yViewBasis=yViewBasis)
+        if meshCache==None:
+            readMesh = TriSurfaceMesh.readFromFoamFile
+        else:
+            readMesh = meshCache.readFromFoamFile
+        tsm=readMesh(pointsFile=pointsFile,
+                     facesFile=facesFile,
+                     viewAnchor=viewAnchor,
+                     xViewBasis=xViewBasis,
+                     yViewBasis=yViewBasis)
         
         c=cls(triSurfaceMesh=tsm)
         c.data['name']=os.path.basename(pathname)
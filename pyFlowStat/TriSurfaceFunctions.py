@@ -17,6 +17,10 @@ Functions included:
     * loadTriSurfaceMesh_hdf5Parser
     * loadTriSurfaceVectorList_hdf5Parser
     * loadTriSurfaceVector_hdf5Parser
+    * getFoamSurfaceTimes
+    * getComponentMatrix
+    * twoPointCorrMatrix
+    * loadFoamSurfaceTimeSeries
     * parseFoamFile_sampledSurface
     * parseVTK_ugly_sampledSurface
     
@@ -25,15 +29,16 @@ For documentation, see the docstring included in each function.
 #=============================================================================#
 # load modules
 #=============================================================================#
+import os
+import glob
+import time
+import multiprocessing
 import h5py
 
 import numpy as np
 
-import matplotlib.tri as tri
-import matplotlib.path as mplPath
 import matplotlib.pyplot as plt
 
-import pyFlowStat
 
 #import pyFlowStat.CoordinateTransformation as coorTrans
 import pyFlowStat.TriSurface as TriSurface
@@ -42,6 +47,7 @@ import pyFlowStat.TriSurfaceScalar as TriSurfaceScalar
 import pyFlowStat.TriSurfaceVector as TriSurfaceVector
 import pyFlowStat.TriSurfaceSymmTensor as TriSurfaceSymmTensor
 import pyFlowStat.Functions as func
+import pyFlowStat.ParserFunctions as ParserFunctions
 import pyFlowStat.TriSurfaceContainer as TriSurfaceContainer
 
 from pyFlowStat import TurbulenceTools as tt
@@ -67,6 +73,9 @@ def getSubTriSurfaceMesh(tsmSource, poly, op='in', mode='mid'):
          
         *op*: python string ('in' or 'out'). Default='in'
          Keep the triangles inside or outside the polygon
+         
+        *mode*: python string ('mid' or 'each'). Default='mid'
+         See TriSurfaceMesh.getSubMesh
 
     Returns:
         *tsm*: TriSurfaceMesh object.
@@ -74,61 +83,8 @@ def getSubTriSurfaceMesh(tsmSource, poly, op='in', mode='mid'):
         *node_renum*: 
          Node renumbering. Useful for the compression of the data
     '''
-    # create a boundBox from the polygon
-    maskedTri = np.zeros(tsmSource.triangles.shape[0])
-    bb = mplPath.Path(poly)
-    
-    # define the operation
-    inPoly = None
-    outPoly = None
-    if op=='in':
-        inPoly = 0
-        outPoly = 1
-    elif op=='out':
-        inPoly = 1
-        outPoly = 0
-    else:
-        raise ValueError('Argument "op" must be "in" or "out".')
-
-    # define the mask and apply it.
-    if mode=='each':
-        xtri = tsmSource.x[tsmSource.triangles]
-        ytri = tsmSource.y[tsmSource.triangles]
-        for i in range(maskedTri.shape[0]):
-            if np.sum(bb.contains_points(np.vstack((xtri[i],ytri[i])).T))>0:
-                maskedTri[i] = inPoly
-            else:
-                maskedTri[i] = outPoly
-    elif mode=='mid':
-        xmid = tsmSource.x[tsmSource.triangles].mean(axis=1)
-        ymid = tsmSource.y[tsmSource.triangles].mean(axis=1)
-        for i in range(maskedTri.shape[0]):
-            if bb.contains_point([xmid[i],ymid[i]])==1:
-                maskedTri[i] = inPoly
-            else:
-                maskedTri[i] = outPoly
-    else:
-        raise ValueError('Argument "mode" must be "each" or "mid".')
-    
-    tsmSource.triangulation.set_mask(maskedTri)
-    
-    #compress the triangles and create a new TriSurface mesh
-    trianalyzer = tri.TriAnalyzer(tsmSource.triangulation)
-    (comp_triangles,comp_x,comp_y,node_renum) = trianalyzer._get_compressed_triangulation(return_node_renum=True)
-
-    comp_z = compressArray(tsmSource._TriSurfaceMesh__z,node_renum)
-
-    subTsm = TriSurfaceMesh.TriSurfaceMesh(x=comp_x,
-                                           y=comp_y,
-                                           z=comp_z,
-                                           triangles=comp_triangles,
-                                           mask=None,
-                                           affTrans=tsmSource.affTrans,
-                                           linTrans=tsmSource.linTrans)
-
-    # remove the mash from the source
-    tsmSource.triangulation.set_mask(None)   
-    
+    # the work is done (and cached) by the source mesh
+    subTsm,points,node_renum = tsmSource.getSubMesh(poly,op=op,mode=mode)
     return subTsm,node_renum
 
 
@@ -139,21 +95,22 @@ def compressArray(z,node_renum):
     "getSubTriSurfaceVector" to learn about node_renum.
     
     Arguments:
-        *z*: numpy array of shape (N,)
-         The array to compress.
+        *z*: numpy array of shape (N,) or (N,...)
+         The array to compress. It is not modified.
          
         *node_renum*: numpy array
          Node renumbering list generated by getSubTriSurfaceMesh or
          getSubTriSurfaceVector
 
     Returns:
-        *comp_z*: numpy array of shape (M,)
+        *comp_z*: numpy array of shape (M,) or (M,...)
          Compressed array    
     '''
-    node_mask = (node_renum == -1)
-    z[node_renum[~node_mask]] = z
-    z = z[~node_mask]
-    return z
+    z = np.asarray(z)
+    valid = np.where(node_renum!=-1)[0]
+    comp_z = np.empty((len(valid),)+z.shape[1:],dtype=z.dtype)
+    comp_z[node_renum[valid]] = z[valid]
+    return comp_z
 
    
 def getSubTriSurfaceVector(tsvSource, poly, op='in', mode='mid',return_node_renum=False):
@@ -186,14 +143,11 @@ def getSubTriSurfaceVector(tsvSource, poly, op='in', mode='mid',return_node_renu
         
         *node_renum*: numpy array. Returned only if return_node_renum=True        
     '''
-    subTsm,node_renum = getSubTriSurfaceMesh(tsmSource=tsvSource.triSurfaceMesh,
-                                             poly=poly,
-                                             op=op,
-                                             mode=mode)
+    subTsm,points,node_renum = tsvSource.triSurfaceMesh.getSubMesh(poly,op=op,mode=mode)
     
-    comp_vx = compressArray(tsvSource.vx,node_renum)
-    comp_vy = compressArray(tsvSource.vy,node_renum)
-    comp_vz = compressArray(tsvSource.vz,node_renum)
+    comp_vx = tsvSource.vx[points]
+    comp_vy = tsvSource.vy[points]
+    comp_vz = tsvSource.vz[points]
 
     subProjectedField = tsvSource.projectedField
 
@@ -240,18 +194,15 @@ def getSubTriSurfaceContainer(tscSource, poly, op='in', mode='mid',return_node_r
         
         *node_renum*: numpy array. Returned only if return_node_renum=True        
     '''
-    subTsm,node_renum = getSubTriSurfaceMesh(tsmSource=tscSource.triSurfaceMesh,
-                                             poly=poly,
-                                             op=op,
-                                             mode=mode)
+    subTsm,points,node_renum = tscSource.triSurfaceMesh.getSubMesh(poly,op=op,mode=mode)
     
     subTsc = TriSurfaceContainer.TriSurfaceContainer(subTsm)
     
     for fname,fdata in tscSource.fields.iteritems():
         if isinstance(fdata,TriSurfaceVector.TriSurfaceVector):
-            comp_vx = compressArray(fdata.vx,node_renum)
-            comp_vy = compressArray(fdata.vy,node_renum)
-            comp_vz = compressArray(fdata.vz,node_renum)
+            comp_vx = fdata.vx[points]
+            comp_vy = fdata.vy[points]
+            comp_vz = fdata.vz[points]
             subProjectedField = fdata.projectedField
             subTs = TriSurfaceVector.TriSurfaceVector(vx=comp_vx,
                                                       vy=comp_vy,
@@ -264,7 +215,7 @@ def getSubTriSurfaceContainer(tscSource, poly, op='in', mode='mid',return_node_r
             subTsc.addTriSurface(subTs,fname)
            
         if isinstance(fdata,TriSurfaceScalar.TriSurfaceScalar):
-            comp_s = compressArray(fdata.s,node_renum)
+            comp_s = fdata.s[points]
             subProjectedField = fdata.projectedField
             subTs = TriSurfaceScalar.TriSurfaceScalar(s=comp_s,
                                                       time=fdata.time,
@@ -275,12 +226,12 @@ def getSubTriSurfaceContainer(tscSource, poly, op='in', mode='mid',return_node_r
             subTsc.addTriSurface(subTs,fname)
             
         if isinstance(fdata,TriSurfaceSymmTensor.TriSurfaceSymmTensor):
-            comp_txx = compressArray(fdata.txx,node_renum)
-            comp_txy = compressArray(fdata.txy,node_renum)
-            comp_txz = compressArray(fdata.txz,node_renum)
-            comp_tyy = compressArray(fdata.tyy,node_renum)
-            comp_tyz = compressArray(fdata.tyz,node_renum)
-            comp_tzz = compressArray(fdata.tzz,node_renum)
+            comp_txx = fdata.txx[points]
+            comp_txy = fdata.txy[points]
+            comp_txz = fdata.txz[points]
+            comp_tyy = fdata.tyy[points]
+            comp_tyz = fdata.tyz[points]
+            comp_tzz = fdata.tzz[points]
             subProjectedField = fdata.projectedField
             subTs = TriSurfaceSymmTensor.TriSurfaceSymmTensor(txx=comp_txx,
                                                               txy=comp_txy,
@@ -334,17 +285,14 @@ def getSubTriSurfaceVectorList(tsvListSource,
         
         *node_renum*: numpy array. Returned only if return_node_renum=True      
     '''    
-    subTsm,node_renum = getSubTriSurfaceMesh(tsmSource=tsvListSource[0].triSurfaceMesh,
-                                             poly=poly,
-                                             op=op,
-                                             mode=mode)
+    subTsm,points,node_renum = tsvListSource[0].triSurfaceMesh.getSubMesh(poly,op=op,mode=mode)
 
     subTsvList = []    
     
     for tsvSource in tsvListSource:
-        comp_vx = compressArray(tsvSource.vx,node_renum)
-        comp_vy = compressArray(tsvSource.vy,node_renum)
-        comp_vz = compressArray(tsvSource.vz,node_renum)
+        comp_vx = tsvSource.vx[points]
+        comp_vy = tsvSource.vy[points]
+        comp_vz = tsvSource.vz[points]
     
         subProjectedField = tsvSource.projectedField
     
@@ -721,19 +669,275 @@ def getSortedTimes_hdf5(hdf5fileName,asFloat=True):
     finally:
         hdf5Parser.close()
 
+def getFoamSurfaceTimes(surfacesPath,surfaceName,minVal=None,maxVal=None,step=None):
+    '''
+    Return the time directories of an OpenFOAM postProcessing/surfaces
+    folder holding the surface surfaceName, sorted numerically (see
+    Functions.sortNumStrList).
+    
+    Arguments:
+        *surfacesPath*: python string.
+         Path to the surfaces folder (e.g: postProcessing/surfaces).
+         
+        *surfaceName*: python string.
+         Name of the surface (e.g: planeXY).
+         
+        *minVal*, *maxVal*, *step*: see Functions.sortNumStrList.
+    
+    Returns:
+        *times*: python list of string.
+    '''
+    allTs = [t for t in os.listdir(surfacesPath)
+             if os.path.isdir(os.path.join(surfacesPath,t,surfaceName))]
+    return func.sortNumStrList(allTs,minVal=minVal,maxVal=maxVal,step=step)
+
+
+def loadFoamSurfaceTimeSeries(surfacesPath,
+                              surfaceName,
+                              xViewBasis,
+                              yViewBasis=None,
+                              viewAnchor=(0,0,0),
+                              srcBasisSrc=[[1,0,0],[0,1,0],[0,0,1]],
+                              names=[],
+                              projectedField=False,
+                              minVal=None,maxVal=None,step=None,
+                              nProcs=1,
+                              chunkSize=16,
+                              meshCache=TriSurfaceMesh.meshCache,
+                              verbose=False):
+    '''
+    Load the fields of an OpenFOAM sampled surface for all its time steps
+    (postProcessing/surfaces/<time>/<surfaceName>/) in one array per field.
+    The mesh is read once, from the first time step. The field files are
+    parsed in a pool of nProcs processes and copied in preallocated arrays
+    of shape (T,N) for the scalars and (T,N,d) for the vectors (d=3) and the
+    symmTensors (d=6). No TriSurface object is created. If projectedField is
+    True, the vectors and symmTensors of all the time steps are projected at
+    once in the basis of the surface (see TriSurface.projectField).
+    
+    Arguments:
+        *surfacesPath*: python string.
+         Path to the surfaces folder (e.g: postProcessing/surfaces).
+         
+        *surfaceName*: python string.
+         Name of the surface (e.g: planeXY).
+         
+        *xViewBasis*, *yViewBasis*, *viewAnchor*, *srcBasisSrc*: see
+         TriSurfaceMesh.readFromFoamFile.
+         
+        *names*: python list of strings.
+         Names of the fields to load. All the fields of the first time step
+         if empty. Default=[].
+         
+        *projectedField*: bool.
+         Default=False.
+         
+        *minVal*, *maxVal*, *step*: see Functions.sortNumStrList.
+         
+        *nProcs*: python int.
+         Number of processes parsing the field files. Default=1.
+         
+        *chunkSize*: python int.
+         Number of files sent at once to a process. Default=16.
+         
+        *meshCache*: TriSurfaceMeshCache object.
+         Cache used to read the mesh. If None, the mesh is always read.
+         Default=TriSurfaceMesh.meshCache.
+         
+        *verbose*: bool.
+         Print the timings of the stages. Default=False.
+    
+    Returns:
+        *tsm*: TriSurfaceMesh object.
+        
+        *times*: numpy array of shape (T,).
+        
+        *data*: python dict.
+         Array of each field, key=field name.
+         
+        *timings*: python dict.
+         Duration in seconds of the stages 'discover', 'mesh', 'fields' and
+         'projection'.
+    '''
+    timings = dict()
+    
+    # time directories and fields
+    t0 = time.time()
+    timeDirs = getFoamSurfaceTimes(surfacesPath,surfaceName,minVal=minVal,maxVal=maxVal,step=step)
+    if len(timeDirs)==0:
+        raise IOError('no time directory with the surface "'+surfaceName+'" in '+surfacesPath)
+    firstPath = os.path.join(surfacesPath,timeDirs[0],surfaceName)
+    fieldTypes = []
+    for typeDir,nComp in [('scalarField',1),('vectorField',3),('symmTensorField',6)]:
+        for fname in sorted(glob.glob(os.path.join(firstPath,typeDir,'*'))):
+            name = os.path.basename(fname)
+            if len(names)==0 or name in names:
+                fieldTypes.append((name,typeDir,nComp))
+    missing = [n for n in names if n not in [f[0] for f in fieldTypes]]
+    if len(missing)>0:
+        raise IOError('fields '+str(missing)+' not found in '+firstPath)
+    tasks = []
+    for name,typeDir,nComp in fieldTypes:
+        for i,t in enumerate(timeDirs):
+            tasks.append((name,i,os.path.join(surfacesPath,t,surfaceName,typeDir,name)))
+    timings['discover'] = time.time()-t0
+    
+    # mesh
+    t0 = time.time()
+    if meshCache==None:
+        readMesh = TriSurfaceMesh.TriSurfaceMesh.readFromFoamFile
+    else:
+        readMesh = meshCache.readFromFoamFile
+    tsm = readMesh(pointsFile=os.path.join(firstPath,'points'),
+                   facesFile=os.path.join(firstPath,'faces'),
+                   xViewBasis=xViewBasis,
+                   yViewBasis=yViewBasis,
+                   viewAnchor=viewAnchor,
+                   srcBasisSrc=srcBasisSrc)
+    timings['mesh'] = time.time()-t0
+    
+    # fields
+    t0 = time.time()
+    data = dict()
+    pool = None
+    try:
+        if nProcs>1:
+            pool = multiprocessing.Pool(nProcs)
+            results = pool.imap_unordered(_parseFoamFieldFile,tasks,chunkSize)
+        else:
+            results = (_parseFoamFieldFile(task) for task in tasks)
+        for name,i,values in results:
+            if name not in data:
+                data[name] = np.empty((len(timeDirs),)+values.shape,dtype=values.dtype)
+            elif values.shape!=data[name].shape[1:]:
+                raise IOError('field "'+name+'" of time '+timeDirs[i]+' has the shape '
+                              +str(values.shape)+' instead of '+str(data[name].shape[1:]))
+            data[name][i] = values
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    timings['fields'] = time.time()-t0
+    
+    # projection
+    t0 = time.time()
+    if projectedField==True:
+        for name,typeDir,nComp in fieldTypes:
+            if nComp>1:
+                data[name] = TriSurface.projectField(data[name],tsm.linTrans)
+    timings['projection'] = time.time()-t0
+    
+    if verbose==True:
+        print('loaded '+str(len(timeDirs))+' time steps, '+str(len(fieldTypes))+' fields')
+        for stage in ['discover','mesh','fields','projection']:
+            print('    '+stage+': '+str(round(timings[stage],3))+' s')
+    times = np.array([float(t) for t in timeDirs])
+    return tsm, times, data, timings
+
+
+def _parseFoamFieldFile(task):
+    '''
+    Parse the field file of a task (name,timeIndex,path). Module level
+    function, usable by a process pool.
+    '''
+    name,i,path = task
+    return name,i,ParserFunctions.parseFoamFile_sampledSurface(path)
+
+
 def getIndex(tCont,x_ref,y_ref):
-    r_list=np.abs(tCont.triSurfaceMesh.x-x_ref)+np.abs(tCont.triSurfaceMesh.y-y_ref)
-    i_ref= np.argmin(r_list)
-    x=tCont.triSurfaceMesh.x[i_ref]
-    y=tCont.triSurfaceMesh.y[i_ref]
-    return i_ref,(x,y)
+    return tCont.triSurfaceMesh.getIndex(x_ref,y_ref)
+
+def getComponentMatrix(tContList,field,comp=0,idx=None,chunkSize=1000):
+    '''
+    Gather the component comp of a field of all the time steps in one
+    matrix of shape (T,N) (or (T,len(idx)) if idx is given).
+    
+    Arguments:
+        *tContList*: list of TriSurfaceContainer or TriSurfaceTimeSeries.
+        
+        *field*: string, key to the field
+        
+        *comp*: int
+        component to use
+        
+        *idx*: list of int
+        indices of the points to gather. All the points if None.
+        
+        *chunkSize*: int
+        number of time steps of a TriSurfaceTimeSeries read at once.
+        
+    Returns:
+        *data*: numpy array of shape (T,N)
+    '''
+    if hasattr(tContList,'fields'):
+        # TriSurfaceTimeSeries: slice the (T,N) or (T,N,d) array
+        values = tContList.fields[field]
+        cols = slice(None) if idx is None else np.asarray(idx)
+        nCols = values.shape[1] if idx is None else len(cols)
+        data = np.empty((values.shape[0],nCols))
+        for start in range(0,values.shape[0],chunkSize):
+            chunk = np.asarray(values[start:start+chunkSize])
+            if chunk.ndim==3:
+                chunk = chunk[:,:,comp]
+            data[start:start+chunkSize] = chunk[:,cols]
+        return data
+    
+    nCols = len(tContList[0].triSurfaceMesh.x) if idx is None else len(idx)
+    data = np.empty((len(tContList),nCols))
+    for i,tc in enumerate(tContList):
+        values = np.asarray(tc[field](comp))
+        data[i] = values if idx is None else values[idx]
+    return data
+
+def twoPointCorrMatrix(data,refCols,cols=None,chunkSize=1000):
+    '''
+    Normalized two point correlation (same as TurbulenceTools.twoPointCorr
+    with subtractMean=True and norm=True) between the columns refCols and
+    the columns cols of a matrix of shape (T,M), for all the pairs at once.
+    The products of the fluctuations are accumulated with one matrix product
+    per chunk of chunkSize time steps.
+    
+    Arguments:
+        *data*: numpy array of shape (T,M), see getComponentMatrix
+        
+        *refCols*: list of int
+        columns of the reference points
+        
+        *cols*: list of int
+        columns of the points where the correlation is computed. All the
+        columns if None.
+        
+        *chunkSize*: int
+        
+    Returns:
+        *CCorr*: numpy array of shape (len(refCols),len(cols))
+    '''
+    refCols = np.atleast_1d(refCols)
+    if cols is None:
+        cols = slice(None)
+    mean = np.mean(data,axis=0)
+    meanRef = mean[refCols]
+    meanCols = mean[cols]
+    
+    cov = 0.0
+    varRef = 0.0
+    varCols = 0.0
+    for start in range(0,data.shape[0],chunkSize):
+        chunk = data[start:start+chunkSize]
+        xRef = chunk[:,refCols]-meanRef
+        xCols = chunk[:,cols]-meanCols
+        cov = cov+np.dot(xRef.T,xCols)
+        varRef = varRef+np.sum(xRef**2,axis=0)
+        varCols = varCols+np.sum(xCols**2,axis=0)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return cov/np.sqrt(np.outer(varRef,varCols))
 
 def twoPointCorr(tContList,field,x_ref,y_ref,comp=0,idx_lst=[]):
     '''
     Given a list of TriSurfaceContainers, computes the two point correleation wrt to a reference position x_ref,y_ref.
     
     Arguments:
-        *tContList*: list of TriSurfaceContainer
+        *tContList*: list of TriSurfaceContainer (or TriSurfaceTimeSeries)
         
         *field*: string, key to field to compute cross correlation on
         
@@ -760,63 +964,37 @@ def twoPointCorr(tContList,field,x_ref,y_ref,comp=0,idx_lst=[]):
     tCont=tContList[0]
     i_ref,(x,y)=getIndex(tCont,x_ref,y_ref)
     
-    
-    U_ref=[tc[field](comp)[i_ref] for tc in tContList]
-    CCorr_u=[]
-    
     if len(idx_lst)<1:
-        idx_lst=range(len(tCont.triSurfaceMesh.x))
+        idx_lst=np.arange(len(tCont.triSurfaceMesh.x))
     if i_ref not in idx_lst:
         raise ValueError('i_ref not in list')
     
-    for i in idx_lst:
-        U_i=[tc[field](comp)[i] for tc in tContList]
-        cc=pyFlowStat.TurbulenceTools.twoPointCorr(U_ref,U_i,subtractMean=True,norm=True)
-        CCorr_u.append(cc)
-    CCorr_u=np.array(CCorr_u)
+    CCorr_u=_pointsCorr(tContList,field,comp,[i_ref],[idx_lst])[0]
     return CCorr_u,i_ref,x,y
     
     
-def getCCorrHorizontal(tContList,comp,x_ref,y_ref):
-    tCont=tContList[0]
-
-    i_ref,(x,y)=tCont.triSurfaceMesh.getIndex(x_ref,y_ref)
-    x_pos,idx_x=tCont.triSurfaceMesh.getHorizontalLine(x_ref,y_ref)
+def getCCorrHorizontal(tContList,comp,x_ref,y_ref,field='U'):
+    tsm=tContList[0].triSurfaceMesh
+    line=_getLine(tsm,x_ref,y_ref,'horizontal')
+    ccorr=_pointsCorr(tContList,field,comp,[line[0]],[line[2]])[0]
+    return _splitLine(line,ccorr,'horizontal')
+
+def getMeanCCorrHorizontal(tContList,comp,x_ref_list,y_ref,doPlot=False,field='U'):
+    tsm=tContList[0].triSurfaceMesh
+    lines=[_getLine(tsm,x_ref,y_ref,'horizontal') for x_ref in x_ref_list]
+    ccorrs=_pointsCorr(tContList,field,comp,[l[0] for l in lines],[l[2] for l in lines])
     
-    idx_x_r=idx_x[x_pos>=x]
-    idx_x_l=idx_x[x_pos<=x]
-    x_pos_r=tCont.triSurfaceMesh.x[idx_x_r]
-    x_pos_l=tCont.triSurfaceMesh.x[idx_x_l]
-    
-    ccorr_x_r,_,_,_=twoPointCorr(tContList,'U',x_ref,y_ref,comp=comp,idx_lst=idx_x_r)
-    ccorr_x_l,_,_,_=twoPointCorr(tContList,'U',x_ref,y_ref,comp=comp,idx_lst=idx_x_l)
-    #ccorr_y,idx,x,y=twoPointCorr(tContList,'U',x_ref,y_ref,comp=comp,idx_lst=idx_y)
-
-    x_r=np.abs(x_pos_r-x)
-    x_l=np.abs(x_pos_l[::-1]-x)
-    #x_r=x_pos[len(x_pos)//2:]-x_ref
-    #x_l=x_pos[:len(x_pos)//2+1][::-1]-x_ref
-    #ccorr_x_r=ccorr_x[len(ccorr_x)//2:]
-    #ccorr_x_l=ccorr_x[:len(ccorr_x)//2+1][::-1]
-    return x_l,ccorr_x_l[::-1],x_r,ccorr_x_r
-
-def getMeanCCorrHorizontal(tContList,comp,x_ref_list,y_ref,doPlot=False):
     x_l_lst=[]
     ccorr_x_l_lst=[]
     x_r_lst=[]
     ccorr_x_r_lst=[]
-    for x_ref in x_ref_list:
-        x_l,ccorr_x_l,x_r,ccorr_x_r=getCCorrHorizontal(tContList,comp,x_ref,y_ref)
+    for line,ccorr in zip(lines,ccorrs):
+        x_l,ccorr_x_l,x_r,ccorr_x_r=_splitLine(line,ccorr,'horizontal')
         
         x_l_lst.append(x_l)
         ccorr_x_l_lst.append(ccorr_x_l)
         x_r_lst.append(x_r)
         ccorr_x_r_lst.append(ccorr_x_r)
-
-    x_l_lst=np.array(x_l_lst)
-    ccorr_x_l_lst=np.array(ccorr_x_l_lst)
-    x_r_lst=np.array(x_r_lst)
-    ccorr_x_r_lst=np.array(ccorr_x_r_lst)
     
     minidx_l=np.min([len(x) for x in x_l_lst])
     minidx_r=np.min([len(x) for x in x_r_lst])
@@ -861,44 +1039,28 @@ def getMeanHorizontalScale(tContList,comp,x_lst,ylist):
     plt.tight_layout()
     return Lz
     
-def getCCorrVertical(tContList,comp,x_ref,y_ref):
-    tCont=tContList[0]
-    
-    i_ref,(x,y)=tCont.triSurfaceMesh.getIndex(x_ref,y_ref)
-    y_pos,idx_y=tCont.triSurfaceMesh.getVerticalLine(x_ref,y_ref)
-    
-    idx_y_up=idx_y[y_pos>=y]
-    idx_y_down=idx_y[(y_pos<=y) & (y_pos>0)]
-    
-    y_pos_up=y_pos[y_pos>=y]
-    y_pos_down=y_pos[(y_pos<=y) & (y_pos>0)]
-    
-    ccorr_y_up,_,_,_=twoPointCorr(tContList,'U',x_ref,y_ref,comp=comp,idx_lst=idx_y_up)
-    ccorr_y_down,_,_,_=twoPointCorr(tContList,'U',x_ref,y_ref,comp=comp,idx_lst=idx_y_down)
-    #ccorr_y,idx,x,y=twoPointCorr(tContList,'U',x_ref,y_ref,comp=comp,idx_lst=idx_y)
+def getCCorrVertical(tContList,comp,x_ref,y_ref,field='U'):
+    tsm=tContList[0].triSurfaceMesh
+    line=_getLine(tsm,x_ref,y_ref,'vertical')
+    ccorr=_pointsCorr(tContList,field,comp,[line[0]],[line[2]])[0]
+    return _splitLine(line,ccorr,'vertical')
+
+def getMeanCCorrVertical(tContList,comp,x_ref_list,y_ref,doPlot=False,field='U'):
+    tsm=tContList[0].triSurfaceMesh
+    lines=[_getLine(tsm,x_ref,y_ref,'vertical') for x_ref in x_ref_list]
+    ccorrs=_pointsCorr(tContList,field,comp,[l[0] for l in lines],[l[2] for l in lines])
     
-    y_up=np.abs(y_pos_up-y)
-    y_down=np.abs(y_pos_down[::-1]-y)
-    
-    return y_down,ccorr_y_down[::-1],y_up,ccorr_y_up
-
-def getMeanCCorrVertical(tContList,comp,x_ref_list,y_ref,doPlot=False):
     x_l_lst=[]
     ccorr_x_l_lst=[]
     x_r_lst=[]
     ccorr_x_r_lst=[]
-    for x_ref in x_ref_list:
-        x_l,ccorr_x_l,x_r,ccorr_x_r=getCCorrVertical(tContList,comp,x_ref,y_ref)
+    for line,ccorr in zip(lines,ccorrs):
+        x_l,ccorr_x_l,x_r,ccorr_x_r=_splitLine(line,ccorr,'vertical')
         
         x_l_lst.append(x_l)
         ccorr_x_l_lst.append(ccorr_x_l)
         x_r_lst.append(x_r)
         ccorr_x_r_lst.append(ccorr_x_r)
-
-    x_l_lst=np.array(x_l_lst)
-    ccorr_x_l_lst=np.array(ccorr_x_l_lst)
-    x_r_lst=np.array(x_r_lst)
-    ccorr_x_r_lst=np.array(ccorr_x_r_lst)
     
     minidx_l=np.min([len(x) for x in x_l_lst])
     minidx_r=np.min([len(x) for x in x_r_lst])
@@ -928,6 +1090,46 @@ def getMeanCCorrVertical(tContList,comp,x_ref_list,y_ref,doPlot=False):
 
     return x_m_down,ccorr_m_down,x_m_up,ccorr_m_up
 
+def _pointsCorr(tContList,field,comp,refs,idxLists):
+    '''
+    Two point correlations of the reference points refs[k] with the points
+    idxLists[k], for all k. The component matrix of the union of the points
+    is gathered once and all the correlations come from one call of
+    twoPointCorrMatrix. Returns a list of numpy arrays.
+    '''
+    cols=np.unique(np.concatenate([np.asarray(refs,dtype=int)]+[np.asarray(idx,dtype=int) for idx in idxLists]))
+    data=getComponentMatrix(tContList,field,comp=comp,idx=cols)
+    ccorr=twoPointCorrMatrix(data,np.searchsorted(cols,refs))
+    return [ccorr[k,np.searchsorted(cols,idx)] for k,idx in enumerate(idxLists)]
+
+def _getLine(tsm,x_ref,y_ref,direction):
+    '''
+    Index of the reference point, its position and the indices and positions
+    of the horizontal or vertical line through it.
+    '''
+    i_ref,(x,y)=tsm.getIndex(x_ref,y_ref)
+    if direction=='horizontal':
+        pos,idx=tsm.getHorizontalLine(x_ref,y_ref)
+        return i_ref,x,idx,pos
+    pos,idx=tsm.getVerticalLine(x_ref,y_ref)
+    return i_ref,y,idx,pos
+
+def _splitLine(line,ccorr,direction):
+    '''
+    Split the correlation along a line in the parts before (left or down)
+    and after (right or up) the reference point, as functions of the
+    distance to the reference point.
+    '''
+    i_ref,ref,idx,pos=line
+    after=pos>=ref
+    if direction=='horizontal':
+        before=pos<=ref
+    else:
+        before=(pos<=ref) & (pos>0)
+    d_after=np.abs(pos[after]-ref)
+    d_before=np.abs(pos[before][::-1]-ref)
+    return d_before,ccorr[before][::-1],d_after,ccorr[after]
+
 def getMeanVerticalScale(tContList,comp,x_lst,ylist):
     #cmap=Plotting.getColorMap(ylist[0],ylist[-1],'parula')
     Ly=[]
@@ -958,31 +1160,21 @@ def getMeanVerticalLine(tContList):
     tCont=tContList[0]
     tsm=tCont.triSurfaceMesh
     x_pos_top,_=tsm.getHorizontalLine(0,np.max(tsm.y))
-
-    U_lst=[]
-    cov_list=[]
     y_pos,idx_y=tsm.getVerticalLine(0,0)
-    for y in y_pos:
-        U_lst_t=[]
-        for x in x_pos_top:
-            j,_=tsm.getIndex(x,y)
-            Ux=np.array([tc['U'](0)[j] for tc in tContList])
-            Uy=np.array([tc['U'](1)[j] for tc in tContList])
-            Uz=np.array([tc['U'](2)[j] for tc in tContList])
-            U=np.vstack([Ux,Uy,Uz]).T
-            U_lst_t.append(U)
-        U_lst_t=np.array(U_lst_t)
-        U_lst_t=U_lst_t.reshape((U_lst_t.shape[0]*U_lst_t.shape[1],U_lst_t.shape[2]))
-
-        c_tmp=np.cov(U_lst_t.T)
-        cov_list.append([c_tmp[0,0],c_tmp[0,1],c_tmp[0,2],c_tmp[1,1],c_tmp[1,2],c_tmp[2,2]])
-        #cov_list_t=np.array(cov_list_t)
-
-        #cov_list.extend(cov_list_t)
-        U_lst.append(U_lst_t)
-    U_lst=np.array(U_lst)
-    cov_list=np.array(cov_list)
+    
+    # indices of the points of all the (x,y) pairs, shape (ny,nx)
+    X,Y=np.meshgrid(x_pos_top,y_pos)
+    idx=tsm.getIndices(X,Y)
+    
+    # samples of each y position: all x positions and time steps
+    U=np.array([getComponentMatrix(tContList,'U',comp=c,idx=idx.ravel()) for c in range(3)])
+    U_lst=U.reshape((3,U.shape[1])+idx.shape).transpose((2,3,1,0))
+    U_lst=U_lst.reshape((idx.shape[0],idx.shape[1]*U.shape[1],3))
     
     UMean=np.mean(U_lst,axis=1)
     
+    fluct=U_lst-UMean[:,np.newaxis,:]
+    cov=np.einsum('nki,nkj->nij',fluct,fluct)/(U_lst.shape[1]-1)
+    cov_list=cov[:,[0,0,0,1,1,2],[0,1,2,1,2,2]]
+    
     return y_pos,UMean,cov_list
\ No newline at end of file
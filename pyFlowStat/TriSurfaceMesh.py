@@ -3,12 +3,19 @@ TriSurfaceMesh.py
 '''
 
 #import re
+import os
+import hashlib
+from collections import OrderedDict
 
 import numpy as np
 import matplotlib.tri as tri
+import matplotlib.path as mplPath
+from scipy.spatial import cKDTree
 
 import pyFlowStat.ParserFunctions as ParserFunctions
 import pyFlowStat.TriSurface as TriSurface
+import pyFlowStat.TriGridResampler as TriGridResampler
+from pyFlowStat.TriInterpolation import TriInterpolationContext
 
 class TriSurfaceMesh(object):
     
@@ -32,6 +39,18 @@ class TriSurfaceMesh(object):
         
         self.__affTrans = affTrans
         self.__linTrans = linTrans
+        
+        # spatial index of the points, built on the first query
+        self.__pointIndex = None
+        
+        # interpolation contexts, key (interpolation,kind)
+        self.__interpolationContexts = dict()
+        
+        # sparse gradient operators (Gx,Gy), built on the first use
+        self.__gradientOperators = None
+        
+        # sub meshes of getSubMesh, key (poly,op,mode)
+        self.__subMeshes = OrderedDict()
     
     @classmethod
     def createFromPlane(cls,x,y,z,xViewBasis,yViewBasis=None,viewAnchor=(0,0,0),
@@ -195,7 +214,9 @@ class TriSurfaceMesh(object):
                     yViewBasis,
                     srcBasisSrc=[[1,0,0],[0,1,0],[0,0,1]]):
         '''
-        Construct from a surface saved by OpenFOAM in VTK format.
+        Construct from a surface saved by OpenFOAM in VTK format. The file
+        is cached by ParserFunctions.parseVTK_sampledSurface: the fields of
+        the same file are then read without parsing it again.
         '''
         afftrans, lintrans = TriSurface.getTransformation(viewAnchor,
                                                           xViewBasis,
@@ -203,12 +224,10 @@ class TriSurfaceMesh(object):
                                                           srcBasisSrc)
        
         # read VTK file
-        ptsSrc, triangles, vecsSrc = ParserFunctions.parseVTK_ugly_sampledSurface(vtkFile)
+        ptsSrc, triangles, pointData, cellData = ParserFunctions.parseVTK_sampledSurface(vtkFile)
         
         # Transform the points
-        ptsTgt = np.zeros((ptsSrc.shape[0],ptsSrc.shape[1]))
-        for i in range(ptsSrc.shape[0]):
-            ptsTgt[i,:] = afftrans.srcToTgt(ptsSrc[i,:])
+        ptsTgt = afftrans.srcToTgtArray(ptsSrc)
 
         # update class member variables
         return cls(x=ptsTgt[:,0],
@@ -256,6 +275,33 @@ class TriSurfaceMesh(object):
         '''
         return self.__linTrans
         
+    @property
+    def pointIndex(self):
+        '''
+        Get the spatial index of the grid points (TriSurfacePointIndex). It
+        is built on the first access.
+        '''
+        if self.__pointIndex is None:
+            self.__pointIndex = TriSurfacePointIndex(self.x,self.y)
+        return self.__pointIndex
+        
+    @property
+    def gradientOperators(self):
+        '''
+        Get the sparse gradient operators (Gx,Gy) of the grid (see
+        getGradientOperators). They are built on the first access.
+        '''
+        if self.__gradientOperators is None:
+            self.__gradientOperators = getGradientOperators(self.triangulation)
+        return self.__gradientOperators
+        
+    @property
+    def isStructured(self):
+        '''
+        True if the grid points are the nodes of a structured lattice.
+        '''
+        return self.pointIndex.isStructured
+        
         
     # class methods #
     #---------------#
@@ -268,10 +314,7 @@ class TriSurfaceMesh(object):
             *rawPoints*: numpy array of shape (N,3)
         '''
         surfacePoints = np.vstack((self.x,self.y,self.__z)).T
-        rawPoints = np.zeros((surfacePoints.shape[0],surfacePoints.shape[1]))
-        for i in range(surfacePoints.shape[0]):
-            rawPoints[i,:] = self.affTrans.tgtToSrc(surfacePoints[i,:])
-        return rawPoints
+        return self.affTrans.tgtToSrcArray(surfacePoints)
 
 
     def area(self):
@@ -296,16 +339,160 @@ class TriSurfaceMesh(object):
                             +(xtri[:,2]+xtri[:,1])*(ytri[:,2]-ytri[:,1])
                             +(xtri[:,0]+xtri[:,2])*(ytri[:,0]-ytri[:,2])) )
     
+    def gradient(self,values):
+        '''
+        Gradient at the grid points of one or several fields, with the P1
+        gradient operators (see getGradientOperators). All the fields are
+        derived with one sparse matrix product per direction.
+        
+        Arguments:
+            *values*: numpy array of shape (N,) or (N,...), for example
+             (N,3) for a vector or (N,T) for a time series.
+             
+        Returns:
+            *dvdx*, *dvdy*: numpy arrays of the shape of values.
+        '''
+        values = np.asarray(values,dtype=float)
+        values2D = values.reshape((values.shape[0],-1))
+        Gx,Gy = self.gradientOperators
+        return (Gx*values2D).reshape(values.shape),(Gy*values2D).reshape(values.shape)
+    
+    def getSubMesh(self,poly,op='in',mode='mid'):
+        '''
+        Return the sub TriSurfaceMesh made of the triangles inside or
+        outside a polygon, and the index maps to extract the fields. The
+        result is cached: the same region of several fields (or time steps)
+        is extracted with one fancy indexing per field, field[points].
+        
+        Arguments:
+            *poly*: numpy array of shape (N,2)
+             list of N points of the polygon. If the polygon is a rectangle
+             aligned with the axes, a bounding box test is used (points on
+             the border are inside).
+             
+            *op*: python string ('in' or 'out'). Default='in'
+             Keep the triangles inside or outside the polygon
+             
+            *mode*: python string ('mid' or 'each'). Default='mid'
+             A triangle is inside if its center is inside ('mid') or if one
+             of its points is inside ('each').
+             
+        Returns:
+            *subTsm*: TriSurfaceMesh object.
+            
+            *points*: numpy array of int. Indices of the points of subTsm
+             in this mesh (field of subTsm = field[points]).
+             
+            *node_renum*: numpy array of int of shape (N,). Index of each
+             point in subTsm, -1 if the point is not in subTsm.
+        '''
+        if op not in ['in','out']:
+            raise ValueError('Argument "op" must be "in" or "out".')
+        if mode not in ['each','mid']:
+            raise ValueError('Argument "mode" must be "each" or "mid".')
+        poly = np.asarray(poly,dtype=float)
+        key = (poly.shape,poly.tobytes(),op,mode)
+        if key in self.__subMeshes:
+            res = self.__subMeshes.pop(key)
+            self.__subMeshes[key] = res
+            return res
+        
+        triangles = self.triangles
+        if mode=='each':
+            inside = pointsInPolygon(self.x,self.y,poly)[triangles].any(axis=1)
+        else:
+            xmid = self.x[triangles].mean(axis=1)
+            ymid = self.y[triangles].mean(axis=1)
+            inside = pointsInPolygon(xmid,ymid,poly)
+        if op=='in':
+            keep = inside
+        else:
+            keep = ~inside
+        
+        # the points of the kept triangles, in the order of this mesh
+        subTriangles = triangles[keep]
+        valid = np.bincount(subTriangles.ravel(),minlength=len(self.x))>0
+        points = np.where(valid)[0]
+        node_renum = -np.ones(len(self.x),dtype=int)
+        node_renum[points] = np.arange(len(points))
+        
+        subTsm = TriSurfaceMesh(x=self.x[points],
+                                y=self.y[points],
+                                z=self.__z[points],
+                                triangles=node_renum[subTriangles],
+                                mask=None,
+                                affTrans=self.affTrans,
+                                linTrans=self.linTrans)
+        res = (subTsm,points,node_renum)
+        self.__subMeshes[key] = res
+        while len(self.__subMeshes)>8:
+            self.__subMeshes.popitem(last=False)
+        return res
+    
+    def getInterpolationContext(self,interpolation='cubic',kind='geom'):
+        '''
+        Return the TriInterpolationContext of the mesh for the given
+        interpolation type. It is created on the first call and shared by
+        all the fields (and time steps) on this mesh.
+        
+        Arguments:
+            *interpolation*: python string. "cubic" or "linear".
+            
+            *kind*: python string. "geom" or "min_E" (cubic only).
+        '''
+        if interpolation=='linear':
+            kind = None
+        key = (interpolation,kind)
+        if key not in self.__interpolationContexts:
+            self.__interpolationContexts[key] = TriInterpolationContext(self.triangulation,
+                                                                        interpolation=interpolation,
+                                                                        kind=kind)
+        return self.__interpolationContexts[key]
+    
+    def buildPointIndex(self,tol=None):
+        '''
+        (Re)build the spatial index of the grid points with the tolerance
+        tol for the grouping of the points in rows and columns (see
+        TriSurfacePointIndex).
+        '''
+        self.__pointIndex = TriSurfacePointIndex(self.x,self.y,tol=tol)
+        return self.__pointIndex
+    
     def getIndex(self,x_ref,y_ref):
-        r_list=np.abs(self.x-x_ref)+np.abs(self.y-y_ref)
-        i_ref= np.argmin(r_list)
+        '''
+        get the index and the position of the grid point nearest to
+        x_ref,y_ref (distance |dx|+|dy|).
+        
+        Returns
+            i_ref,(x,y)
+        '''
+        i_ref=int(self.pointIndex.nearest(x_ref,y_ref))
         x=self.x[i_ref]
         y=self.y[i_ref]
         return i_ref,(x,y)
+        
+    def getIndices(self,x_ref,y_ref):
+        '''
+        Vectorized getIndex: indices of the grid points nearest to the
+        positions x_ref,y_ref (arrays of the same shape).
+        
+        Returns
+            idx, numpy array of int of the shape of x_ref
+        '''
+        return self.pointIndex.nearest(x_ref,y_ref)
+        
+    def getPointsInRadius(self,x_ref,y_ref,r):
+        '''
+        get the indices of the grid points at a distance smaller than r of
+        x_ref,y_ref (euclidean distance), sorted.
+        '''
+        return self.pointIndex.inRadius(x_ref,y_ref,r)
     
     def getHorizontalLine(self,x_ref,y_ref):
         '''
-        get the position and indices of a horizontal line through x_ref,y_ref
+        get the position and indices of a horizontal line through x_ref,y_ref.
+        The line holds the points of the row of the point nearest to
+        x_ref,y_ref (same y within the tolerance of pointIndex).
         
         Returns
             x_pos,idx_x
@@ -313,26 +500,263 @@ class TriSurfaceMesh(object):
 
         i_ref,(x,y)=self.getIndex(x_ref,y_ref)
         
-        idx_x=np.arange(len(self.y))[(self.y-y)==0]
+        idx_x=self.pointIndex.getRow(i_ref)
         x_pos=self.x[idx_x]
         
         return x_pos,idx_x
 
     def getVerticalLine(self,x_ref,y_ref):
         '''
-        get the position and indices of a vertical line through x_ref,y_ref
+        get the position and indices of a vertical line through x_ref,y_ref.
+        The line holds the points of the column of the point nearest to
+        x_ref,y_ref (same x within the tolerance of pointIndex).
         
         Returns
             y_pos,idx_y
         '''
         i_ref,(x,y)=self.getIndex(x_ref,y_ref)
         
-        idx_y=np.arange(len(self.x))[(self.x-x)==0]
+        idx_y=self.pointIndex.getColumn(i_ref)
 
         y_pos=self.y[idx_y]
 
         return y_pos,idx_y
 
+
+class TriSurfacePointIndex(object):
+    '''
+    Spatial index of the points of a TriSurfaceMesh.
+    
+    The points are grouped in rows (same y) and columns (same x): two
+    coordinates belong to the same group if they differ by less than tol
+    (default: 1e-6 times the extent of the points). The indices of the
+    points of each row and column are stored once, so that the extraction
+    of a line is a lookup.
+    
+    If each (row,column) pair holds exactly one point, the points are the
+    nodes of a structured lattice: the grid of the point indices
+    (gridIndex, shape (nRows,nColumns), rows sorted by y and columns by x)
+    is stored and the nearest point is found with a binary search in the
+    row and column coordinates. Otherwise a scipy.spatial.cKDTree is built
+    on the first query.
+    
+    Usage:
+        >>> tsm.pointIndex.isStructured
+        True
+        >>> idx = tsm.getIndices(xArray,yArray)
+    '''
+    
+    # constructors #
+    #--------------#
+    def __init__(self,x,y,tol=None):
+        '''
+        base constructor.
+        
+        Arguments:
+            *x*, *y*: numpy arrays of shape (N).
+             Coordinates of the points.
+            
+            *tol*: python float.
+             Tolerance of the grouping in rows and columns. If None, 1e-6
+             times the extent of the points. Default=None.
+        '''
+        self.x = np.asarray(x,dtype=float)
+        self.y = np.asarray(y,dtype=float)
+        if tol==None:
+            extent = max(np.ptp(self.x),np.ptp(self.y)) if len(self.x)>0 else 0.0
+            tol = 1e-6*extent
+        self.tol = tol
+        self.__tree = None
+        
+        self.rowValues,self.rowOf,self.rowStarts,self.rowPoints = _groupCoordinates(self.y,tol)
+        self.colValues,self.colOf,self.colStarts,self.colPoints = _groupCoordinates(self.x,tol)
+        
+        self.gridIndex = None
+        nRows = len(self.rowValues)
+        nCols = len(self.colValues)
+        if nRows*nCols==len(self.x) and len(self.x)>0:
+            gridIndex = -np.ones((nRows,nCols),dtype=int)
+            gridIndex[self.rowOf,self.colOf] = np.arange(len(self.x))
+            if np.all(gridIndex>=0):
+                self.gridIndex = gridIndex
+                
+                
+    # getters #
+    #---------#
+    @property
+    def isStructured(self):
+        '''
+        True if the points are the nodes of a structured lattice.
+        '''
+        return self.gridIndex is not None
+        
+    @property
+    def tree(self):
+        '''
+        cKDTree of the points, built on the first access.
+        '''
+        if self.__tree is None:
+            self.__tree = cKDTree(np.vstack((self.x,self.y)).T)
+        return self.__tree
+        
+        
+    # class methods #
+    #---------------#
+    def nearest(self,x_ref,y_ref):
+        '''
+        Indices of the points nearest to x_ref,y_ref (scalars or arrays of
+        the same shape), for the distance |dx|+|dy|.
+        '''
+        x_ref = np.asarray(x_ref,dtype=float)
+        y_ref = np.asarray(y_ref,dtype=float)
+        if self.isStructured:
+            # the distance is separable on a lattice
+            row = _nearestValue(self.rowValues,y_ref)
+            col = _nearestValue(self.colValues,x_ref)
+            return self.gridIndex[row,col]
+        _,idx = self.tree.query(np.vstack((x_ref.ravel(),y_ref.ravel())).T,p=1)
+        return idx.reshape(x_ref.shape)
+        
+    def inRadius(self,x_ref,y_ref,r):
+        '''
+        Sorted indices of the points at a distance smaller than r of
+        x_ref,y_ref.
+        '''
+        return np.array(sorted(self.tree.query_ball_point([x_ref,y_ref],r)),dtype=int)
+        
+    def getRow(self,i):
+        '''
+        Indices (ascending) of the points of the row of the point i.
+        '''
+        r = self.rowOf[i]
+        return self.rowPoints[self.rowStarts[r]:self.rowStarts[r+1]]
+        
+    def getColumn(self,i):
+        '''
+        Indices (ascending) of the points of the column of the point i.
+        '''
+        c = self.colOf[i]
+        return self.colPoints[self.colStarts[c]:self.colStarts[c+1]]
+
+
+class TriSurfaceMeshCache(object):
+    '''
+    Cache of TriSurfaceMesh objects read from foamFiles. The sampled
+    surfaces of OpenFOAM are written in one folder per time step, but the
+    points and the faces rarely change: the meshes are identified by the
+    content (sha1) of the points and faces files and by the view basis, so
+    that all the time steps share the same TriSurfaceMesh object (and the
+    same matplotlib Triangulation). The content of a file is hashed only
+    once as long as its path, size and modification time are unchanged.
+    
+    The cache holds at most maxSize meshes. The least recently used mesh is
+    evicted first. Use remove() or clear() to free the memory explicitly.
+    
+    Usage:
+        >>> tsm = meshCache.readFromFoamFile('0.1/plane/points','0.1/plane/faces',xViewBasis=[1,0,0])
+        >>> tsm is meshCache.readFromFoamFile('0.2/plane/points','0.2/plane/faces',xViewBasis=[1,0,0])
+        True
+    '''
+    
+    # constructors #
+    #--------------#
+    def __init__(self,maxSize=8):
+        '''
+        base constructor.
+        
+        Arguments:
+            *maxSize*: python int.
+             Maximal number of meshes in the cache. Default=8.
+        '''
+        self.maxSize = maxSize
+        self.meshes = OrderedDict()
+        # sha1 of the files, key (path,size,mtime)
+        self.digests = OrderedDict()
+        
+        
+    # getters #
+    #---------#
+    def __len__(self):
+        return len(self.meshes)
+        
+        
+    # class methods #
+    #---------------#
+    def readFromFoamFile(self,
+                         pointsFile,
+                         facesFile,
+                         xViewBasis,
+                         yViewBasis=None,
+                         viewAnchor=(0,0,0),
+                         srcBasisSrc=[[1,0,0],[0,1,0],[0,0,1]]):
+        '''
+        Same as TriSurfaceMesh.readFromFoamFile, but returns the cached
+        TriSurfaceMesh if a mesh with the same points, faces and view basis
+        is in the cache.
+        '''
+        key = (self.getDigest(pointsFile),
+               self.getDigest(facesFile),
+               _basisKey(xViewBasis),
+               _basisKey(yViewBasis),
+               _basisKey(viewAnchor),
+               _basisKey(srcBasisSrc))
+        if key in self.meshes:
+            tsm = self.meshes.pop(key)
+        else:
+            tsm = TriSurfaceMesh.readFromFoamFile(pointsFile=pointsFile,
+                                                  facesFile=facesFile,
+                                                  xViewBasis=xViewBasis,
+                                                  yViewBasis=yViewBasis,
+                                                  viewAnchor=viewAnchor,
+                                                  srcBasisSrc=srcBasisSrc)
+        self.meshes[key] = tsm
+        while len(self.meshes)>max(self.maxSize,0):
+            self.meshes.popitem(last=False)
+        return tsm
+        
+    def getDigest(self,fname):
+        '''
+        sha1 of the content of the file fname (None if fname is None).
+        '''
+        if fname==None:
+            return None
+        st = os.stat(fname)
+        fileKey = (os.path.abspath(fname),st.st_size,st.st_mtime)
+        if fileKey in self.digests:
+            return self.digests[fileKey]
+        sha = hashlib.sha1()
+        istream = open(fname,'rb')
+        try:
+            block = istream.read(1<<20)
+            while len(block)>0:
+                sha.update(block)
+                block = istream.read(1<<20)
+        finally:
+            istream.close()
+        digest = sha.hexdigest()
+        self.digests[fileKey] = digest
+        while len(self.digests)>64*max(self.maxSize,1):
+            self.digests.popitem(last=False)
+        return digest
+        
+    def remove(self,tsm):
+        '''
+        Remove the TriSurfaceMesh tsm from the cache.
+        '''
+        for key in [k for k,v in self.meshes.items() if v is tsm]:
+            del self.meshes[key]
+            
+    def clear(self):
+        '''
+        Remove all the meshes from the cache.
+        '''
+        self.meshes.clear()
+        self.digests.clear()
+
+
+# cache shared by the TriSurfaceContainers
+meshCache = TriSurfaceMeshCache()
+
                             
 # helper functions #
 #------------------#      
@@ -413,8 +837,101 @@ def transformPoints(ptsSrc,
                                           srcBasisSrc)
     
     # transform the points from the source basis to the target basis
-    ptsTgt = np.zeros((ptsSrc.shape[0],ptsSrc.shape[1]))
-    for i in range(ptsSrc.shape[0]):
-        ptsTgt[i,:] = afftrans.srcToTgt(ptsSrc[i,:])
+    ptsTgt = afftrans.srcToTgtArray(ptsSrc)
         
-    return ptsTgt,afftrans,lintrans
\ No newline at end of file
+    return ptsTgt,afftrans,lintrans
+
+
+def pointsInPolygon(x,y,poly):
+    '''
+    Test which points (x,y) are inside the polygon poly (numpy array of
+    shape (N,2)), with one call of matplotlib.path.Path.contains_points. If
+    the polygon is a rectangle aligned with the axes, a bounding box test
+    is used instead (points on the border are inside).
+    
+    Returns:
+        *inside*: numpy bool array of the shape of x.
+    '''
+    x = np.asarray(x,dtype=float)
+    y = np.asarray(y,dtype=float)
+    poly = np.asarray(poly,dtype=float)
+    if _isRectangle(poly):
+        xmin,ymin = poly.min(axis=0)
+        xmax,ymax = poly.max(axis=0)
+        return (x>=xmin) & (x<=xmax) & (y>=ymin) & (y<=ymax)
+    path = mplPath.Path(poly)
+    return path.contains_points(np.vstack((x.ravel(),y.ravel())).T).reshape(x.shape)
+
+def _isRectangle(poly):
+    '''
+    True if the polygon poly is a rectangle aligned with the axes (4
+    corners, optionally closed by a 5th point equal to the first one).
+    '''
+    if poly.ndim!=2 or poly.shape[1]!=2:
+        return False
+    if len(poly)==5 and np.all(poly[0]==poly[-1]):
+        poly = poly[:-1]
+    if len(poly)!=4:
+        return False
+    # consecutive corners share their x or their y coordinate
+    nxt = np.roll(poly,-1,axis=0)
+    edgesOk = np.all((poly[:,0]==nxt[:,0]) ^ (poly[:,1]==nxt[:,1]))
+    return bool(edgesOk) and len(np.unique(poly[:,0]))==2 and len(np.unique(poly[:,1]))==2
+
+def getGradientOperators(triangulation):
+    '''
+    Sparse gradient operators Gx, Gy (csr matrices of shape (N,N)) of a
+    triangulation: the gradient of the linear (P1) interpolation of each
+    triangle, averaged at the nodes with the area of the triangles as
+    weight (see TriGridResampler.nodalGradientOperators). The gradient of a
+    field f at the nodes is (Gx*f,Gy*f).
+    
+    Arguments:
+        *triangulation*: matplotlib.tri.Triangulation object.
+        
+    Returns:
+        *Gx*, *Gy*: scipy.sparse.csr_matrix
+    '''
+    triangles = triangulation.get_masked_triangles()
+    x = triangulation.x[triangles]
+    y = triangulation.y[triangles]
+    area = 0.5*np.abs((x[:,1]-x[:,0])*(y[:,2]-y[:,0])-(x[:,2]-x[:,0])*(y[:,1]-y[:,0]))
+    return TriGridResampler.nodalGradientOperators(triangulation,np.repeat(area[:,np.newaxis],3,axis=1))
+
+def _groupCoordinates(values,tol):
+    '''
+    Group the sorted coordinates values which differ by less than tol.
+    
+    Returns
+        groupValues: mean coordinate of each group (ascending)
+        groupOf: group of each point
+        starts: the points of group g are points[starts[g]:starts[g+1]]
+        points: indices of the points, by group and ascending in a group
+    '''
+    order = np.argsort(values,kind='mergesort')
+    sortedValues = values[order]
+    newGroup = np.concatenate(([0],(np.diff(sortedValues)>tol).astype(int)))
+    groupOf = np.empty(len(values),dtype=int)
+    groupOf[order] = np.cumsum(newGroup)
+    nGroups = groupOf.max()+1 if len(values)>0 else 0
+    counts = np.bincount(groupOf,minlength=nGroups)
+    groupValues = np.bincount(groupOf,weights=values,minlength=nGroups)/np.maximum(counts,1)
+    points = np.lexsort((np.arange(len(values)),groupOf))
+    starts = np.concatenate(([0],np.cumsum(counts)))
+    return groupValues,groupOf,starts,points
+
+def _nearestValue(values,v):
+    '''
+    Index of the nearest entry of the sorted array values for each v.
+    '''
+    i = np.clip(np.searchsorted(values,v),1,max(len(values)-1,1))
+    i0 = i-1
+    return np.where(np.abs(v-values[i0])<=np.abs(values[np.minimum(i,len(values)-1)]-v),i0,np.minimum(i,len(values)-1))
+
+def _basisKey(vec):
+    '''
+    Hashable key of a basis vector or matrix (None if vec is None).
+    '''
+    if vec is None:
+        return None
+    return tuple(np.asarray(vec,dtype=float).ravel())
@@ -5,7 +5,6 @@ TriSurfaceVector.py
 #import re
 
 import numpy as np
-import matplotlib.tri as tri
 
 import pyFlowStat.TriSurface as TriSurface
 import pyFlowStat.ParserFunctions as ParserFunctions
@@ -137,7 +136,8 @@ class TriSurfaceScalar(TriSurface.TriSurface):
                     vtkFile,
                     triSurfaceMesh,
                     time,
-                    projectedField=False):
+                    projectedField=False,
+                    varName=None):
         '''
         Construct from a surface saved by OpenFOAM in VTK format.
         
@@ -155,9 +155,14 @@ class TriSurfaceScalar(TriSurface.TriSurface):
             *projectedField* python bool (default=False)
              Defines if the data fields has to be projected in the basis of the
              surface. 
+             
+            *varName*: python string.
+             Name of the POINT_DATA array of the vtk-file. If None, the first
+             array is used. Default=None.
         '''     
         # read VTK file
-        ptsSrc, triangles, slrsTgt = ParserFunctions.parseVTK_ugly_sampledSurface(vtkFile)
+        ptsSrc, triangles, pointData, cellData = ParserFunctions.parseVTK_sampledSurface(vtkFile)
+        slrsTgt = ParserFunctions.getVTKField(pointData,varName)
 
 
         # update class member variables
@@ -244,18 +249,18 @@ class TriSurfaceScalar(TriSurface.TriSurface):
         '''
         self.interType = interpolation
         self.interKind = kind
-        if self.interType=='cubic':
-            self.s_i = tri.CubicTriInterpolator(self.triangulation, self.s, kind=self.interKind)
-        elif self.interType=='linear':
-            self.s_i = tri.LinearTriInterpolator(self.triangulation, self.s)
+        if self.interType=='cubic' or self.interType=='linear':
+            context = self.triSurfaceMesh.getInterpolationContext(self.interType,self.interKind)
+            self.s_i = context.createInterpolator(self.s)
         else:
             raise ValueError('Interpolation must be "cubic" or "linear".')
             
 
     def addGradient(self):
         '''
-        Calculate and save the gradient at all point of the grid.
+        Calculate and save the gradient at all point of the grid, with the
+        sparse gradient operators of the mesh (TriSurfaceMesh.gradient).
         '''   
-        dsdx, dsdy = self.gradientxy(self.x,self.y)
+        dsdx, dsdy = self.triSurfaceMesh.gradient(self.s)
         self.data['dsdx'] = dsdx
         self.data['dsdy'] = dsdy
\ No newline at end of file
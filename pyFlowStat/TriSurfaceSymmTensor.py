@@ -5,7 +5,6 @@ TriSurfaceSymmTensor.py
 #import re
 
 import numpy as np
-import matplotlib.tri as tri
 import pyFlowStat.TriSurface as TriSurface
 import pyFlowStat.ParserFunctions as ParserFunctions
 
@@ -131,11 +130,8 @@ class TriSurfaceSymmTensor(TriSurface.TriSurface):
 
         #get scalars
         stensSrc = ParserFunctions.parseFoamFile_sampledSurface(varsFile)
-        stensTgt = np.zeros((stensSrc.shape[0],stensSrc.shape[1]))
         if projectedField==True:
-            for i in range(stensSrc.shape[0]):
-                stenAsMat = TriSurface.mat(stensSrc[i,:])
-                stensTgt[i,:] = triSurfaceMesh.linTrans.srcToTgt(stenAsMat)
+            stensTgt = TriSurface.projectField(stensSrc,triSurfaceMesh.linTrans)
         else:
             stensTgt = stensSrc
 
@@ -164,11 +160,8 @@ class TriSurfaceSymmTensor(TriSurface.TriSurface):
         '''
         time = hdf5Parser[key]['time'].value
         stensSrc = hdf5Parser[key][varName].value
-        stensTgt = np.zeros((stensSrc.shape[0],stensSrc.shape[1]))
         if projectedField==True:
-            for i in range(stensSrc.shape[0]):
-                stenAsMat = TriSurface.mat(stensSrc[i,:])
-                stensTgt[i,:] = triSurfaceMesh.linTrans.srcToTgt(stenAsMat)
+            stensTgt = TriSurface.projectField(stensSrc,triSurfaceMesh.linTrans)
         else:
             stensTgt = stensSrc
         
@@ -323,20 +316,11 @@ class TriSurfaceSymmTensor(TriSurface.TriSurface):
         '''
         self.interType = interpolation
         self.interKind = kind
-        if self.interType=='cubic':
-            self.txx_i = tri.CubicTriInterpolator(self.triangulation, self.txx, kind=self.interKind)
-            self.txy_i = tri.CubicTriInterpolator(self.triangulation, self.txy, kind=self.interKind)
-            self.txz_i = tri.CubicTriInterpolator(self.triangulation, self.txz, kind=self.interKind)
-            self.tyy_i = tri.CubicTriInterpolator(self.triangulation, self.tyy, kind=self.interKind)
-            self.tyz_i = tri.CubicTriInterpolator(self.triangulation, self.tyz, kind=self.interKind)
-            self.tzz_i = tri.CubicTriInterpolator(self.triangulation, self.tzz, kind=self.interKind)
-        elif self.interType=='linear':
-            self.txx_i = tri.LinearTriInterpolator(self.triangulation, self.txx)
-            self.txy_i = tri.LinearTriInterpolator(self.triangulation, self.txy)
-            self.txz_i = tri.LinearTriInterpolator(self.triangulation, self.txz)
-            self.tyy_i = tri.LinearTriInterpolator(self.triangulation, self.tyy)
-            self.tyz_i = tri.LinearTriInterpolator(self.triangulation, self.tyz)
-            self.tzz_i = tri.LinearTriInterpolator(self.triangulation, self.tzz)
+        if self.interType=='cubic' or self.interType=='linear':
+            context = self.triSurfaceMesh.getInterpolationContext(self.interType,self.interKind)
+            (self.txx_i,self.txy_i,self.txz_i,
+             self.tyy_i,self.tyz_i,self.tzz_i) = context.createInterpolators([self.txx,self.txy,self.txz,
+                                                                            self.tyy,self.tyz,self.tzz])
         else:
             raise ValueError('Interpolation must be "cubic" or "linear".')
 #            
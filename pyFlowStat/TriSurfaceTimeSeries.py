@@ -0,0 +1,626 @@
+'''
+TriSurfaceTimeSeries.py
+
+Time series of fields on a triangulated surface (TriSurfaceMesh). All the
+time steps share one TriSurfaceMesh and each field is stored in one
+contiguous array of shape (T,N) for a scalar and (T,N,d) for a vector (d=3)
+or a symmTensor (d=6), with T the number of time steps and N the number of
+points. The time statistics are then computed along the first axis of the
+arrays, without loop over the time steps or the points.
+
+The field arrays can be numpy arrays, numpy memmaps (see toMemmap) or h5py
+datasets (see readFromHdf5 with inMemory=False). The statistics are computed
+by chunks of time steps, so that the fields do not need to fit in memory.
+'''
+
+#=============================================================================#
+# load modules
+#=============================================================================#
+import os
+import h5py
+
+#scientific modules
+import numpy as np
+
+import pyFlowStat.Surface as sr
+import pyFlowStat.TriSurfaceMesh as TriSurfaceMesh
+import pyFlowStat.TriSurfaceScalar as TriSurfaceScalar
+import pyFlowStat.TriSurfaceVector as TriSurfaceVector
+import pyFlowStat.TriSurfaceSymmTensor as TriSurfaceSymmTensor
+import pyFlowStat.TriSurfaceContainer as TriSurfaceContainer
+import pyFlowStat.TriSurfaceFunctions as TriSurfaceFunctions
+
+
+# derived fields of computeDerivedField, functions of dudx,dudy,dvdx,dvdy
+_derivedFields = {'VortZ':lambda dudx,dudy,dvdx,dvdy: dvdx-dudy,
+                  'Div2D':lambda dudx,dudy,dvdx,dvdy: dudx+dvdy,
+                  'Q':lambda dudx,dudy,dvdx,dvdy: 0.5*(-2.0*dudy*dvdx-dudx**2-dvdy**2),
+                  'lambda2':sr.lambda2}
+
+# member variables of the TriSurface<type> objects holding the components
+_componentNames = {1:['s'],
+                   3:['vx','vy','vz'],
+                   6:['txx','txy','txz','tyy','tyz','tzz']}
+
+
+class TriSurfaceTimeSeries(object):
+    '''
+    class TriSurfaceTimeSeries.
+
+    Time series of scalar, vector and symmTensor fields on one
+    TriSurfaceMesh. The fields are stored in the dict "fields": an array of
+    shape (T,N) or (T,N,d) per field name.
+
+    Usage:
+        >>> tss = TriSurfaceTimeSeries.createFromFoamFolder('postProcessing/surfaces','planeXY',xViewBasis=[1,0,0],nProcs=4)
+        >>> Umean = tss.mean('U')
+        >>> Urms = tss.rms('U')
+        >>> tscList = tss[100:200].toContainerList()
+    '''
+
+    # constructors #
+    #--------------#
+    def __init__(self,triSurfaceMesh,t,projectedField=False):
+        '''
+        base constructor.
+
+        Arguments:
+            *triSurfaceMesh*: TriSurfaceMesh object.
+             Mesh shared by all the time steps.
+
+            *t*: numpy array of shape (T,).
+             Time of the time steps.
+
+            *projectedField*: python bool.
+             Defines if the vector and symmTensor fields are projected in the
+             basis of the surface. Default=False.
+        '''
+        self.triSurfaceMesh = triSurfaceMesh
+        self.t = np.asarray(t,dtype=float)
+        self.projectedField = projectedField
+        self.fields = dict()
+        self.data = dict()
+
+    @classmethod
+    def createFromFoamFolder(cls,
+                             surfacesPath,
+                             surfaceName,
+                             xViewBasis,
+                             yViewBasis=None,
+                             viewAnchor=(0,0,0),
+                             srcBasisSrc=[[1,0,0],[0,1,0],[0,0,1]],
+                             names=[],
+                             projectedField=False,
+                             minVal=None,maxVal=None,step=None,
+                             nProcs=1,
+                             verbose=False):
+        '''
+        Load the time steps of an OpenFOAM sampled surface
+        (postProcessing/surfaces/<time>/<surfaceName>/). See
+        TriSurfaceFunctions.loadFoamSurfaceTimeSeries for the arguments. The
+        timings of the loader are stored in data['timings'].
+        '''
+        tsm,t,fields,timings = TriSurfaceFunctions.loadFoamSurfaceTimeSeries(surfacesPath,
+                                                                            surfaceName,
+                                                                            xViewBasis=xViewBasis,
+                                                                            yViewBasis=yViewBasis,
+                                                                            viewAnchor=viewAnchor,
+                                                                            srcBasisSrc=srcBasisSrc,
+                                                                            names=names,
+                                                                            projectedField=projectedField,
+                                                                            minVal=minVal,maxVal=maxVal,step=step,
+                                                                            nProcs=nProcs,
+                                                                            verbose=verbose)
+        tss = cls(tsm,t,projectedField=projectedField)
+        tss.fields.update(fields)
+        tss.data['timings'] = timings
+        return tss
+
+    @classmethod
+    def createFromContainerList(cls,tscList,names=[]):
+        '''
+        Create a TriSurfaceTimeSeries from a list of TriSurfaceContainer
+        objects. All the containers must share the same TriSurfaceMesh
+        object.
+
+        Arguments:
+            *tscList*: python list of TriSurfaceContainer objects.
+
+            *names*: python list of strings.
+             Fields to copy. All the fields of the first container if empty.
+             Default=[].
+        '''
+        tsc0 = tscList[0]
+        tsm = tsc0.triSurfaceMesh
+        for tsc in tscList:
+            if tsc.triSurfaceMesh is not tsm:
+                raise ValueError("triSurfaceMesh is not identical")
+        if len(names)==0:
+            names = list(tsc0.fields.keys())
+        if len(names)==0:
+            raise ValueError('the containers hold no field.')
+
+        t = np.array([tsc[names[0]].time for tsc in tscList])
+        tss = cls(tsm,t,projectedField=tsc0[names[0]].projectedField)
+        nPoints = len(tsm.x)
+        for name in names:
+            nComp = getNumberOfComponents(tsc0[name])
+            if nComp==1:
+                field = np.empty((len(tscList),nPoints))
+            else:
+                field = np.empty((len(tscList),nPoints,nComp))
+            for i,tsc in enumerate(tscList):
+                field[i] = getComponents(tsc[name])
+            tss.fields[name] = field
+        return tss
+
+    @classmethod
+    def readFromHdf5(cls,
+                     hdf5file,
+                     xViewBasis,
+                     yViewBasis=None,
+                     viewAnchor=(0,0,0),
+                     srcBasisSrc=[[1,0,0],[0,1,0],[0,0,1]],
+                     names=[],
+                     inMemory=True):
+        '''
+        Read a TriSurfaceTimeSeries saved with saveToHdf5.
+
+        Arguments:
+            *hdf5file*: python string.
+             Path to the hdf5 file.
+
+            *xViewBasis*, *yViewBasis*, *viewAnchor*, *srcBasisSrc*: see
+             TriSurfaceMesh.readFromHdf5.
+
+            *names*: python list of strings.
+             Fields to read. All the fields if empty. Default=[].
+
+            *inMemory*: python bool.
+             If True, the fields are read in numpy arrays and the file is
+             closed. If False, the fields are the h5py datasets of the file,
+             which stays open (data['hdf5Parser']) until close() is called.
+             Default=True.
+        '''
+        f = h5py.File(hdf5file,'r')
+        try:
+            tsm = TriSurfaceMesh.TriSurfaceMesh.readFromHdf5(hdf5Parser=f,
+                                                             xViewBasis=xViewBasis,
+                                                             yViewBasis=yViewBasis,
+                                                             viewAnchor=viewAnchor,
+                                                             srcBasisSrc=srcBasisSrc)
+            tss = cls(tsm,f['t'][()],projectedField=bool(f.attrs['projectedField']))
+            if len(names)==0:
+                names = list(f['fields'].keys())
+            for name in names:
+                if inMemory==True:
+                    tss.fields[name] = f['fields'][name][()]
+                else:
+                    tss.fields[name] = f['fields'][name]
+        except:
+            f.close()
+            raise
+        if inMemory==True:
+            f.close()
+        else:
+            tss.data['hdf5Parser'] = f
+        return tss
+
+
+    # getters #
+    #---------#
+    @property
+    def x(self):
+        return self.triSurfaceMesh.x
+
+    @property
+    def y(self):
+        return self.triSurfaceMesh.y
+
+    @property
+    def triangulation(self):
+        return self.triSurfaceMesh.triangulation
+
+    @property
+    def triangles(self):
+        return self.triSurfaceMesh.triangles
+
+    @property
+    def affTrans(self):
+        return self.triSurfaceMesh.affTrans
+
+    @property
+    def linTrans(self):
+        return self.triSurfaceMesh.linTrans
+
+    @property
+    def nTimes(self):
+        '''
+        Number of time steps T.
+        '''
+        return len(self.t)
+
+    @property
+    def nPoints(self):
+        '''
+        Number of points N of the mesh.
+        '''
+        return len(self.triSurfaceMesh.x)
+
+    def __len__(self):
+        return self.nTimes
+
+    def __getitem__(self, key):
+        '''
+        Field "key" if key is a string. Otherwise, TriSurfaceTimeSeries of
+        the time steps "key" (see getTimeSlice).
+        '''
+        if isinstance(key,(str,type(u''))):
+            return self.fields[key]
+        return self.getTimeSlice(key)
+
+
+    # setters #
+    #---------#
+    def __setitem__(self, key, item):
+        '''
+        Add the field "item" of shape (T,N) or (T,N,d) as "key".
+        '''
+        self.addField(item,key)
+
+    def addField(self,field,name):
+        '''
+        Add a field of shape (T,N) or (T,N,d). The field is stored as given
+        (no copy, no projection).
+        '''
+        if len(field.shape)<2 or field.shape[0]!=self.nTimes or field.shape[1]!=self.nPoints:
+            raise ValueError('field "'+name+'" has the shape '+str(field.shape)+
+                             ', expected ('+str(self.nTimes)+','+str(self.nPoints)+',...).')
+        self.fields[name] = field
+
+
+    # class methods #
+    #---------------#
+    def mean(self,name,chunkSize=1000):
+        '''
+        Time average of the field "name", computed by chunks of chunkSize
+        time steps.
+
+        Returns:
+            *mean*: numpy array of shape (N,) or (N,d).
+        '''
+        field = self.fields[name]
+        res = np.zeros(field.shape[1:])
+        for start in range(0,self.nTimes,chunkSize):
+            res += np.sum(field[start:start+chunkSize],axis=0,dtype=float)
+        return res/self.nTimes
+
+    def fluctuation(self,name,mean=None,frames=slice(None)):
+        '''
+        Fluctuation of the field "name" around its time average, for the
+        time steps "frames".
+
+        Arguments:
+            *mean*: numpy array of shape (N,) or (N,d).
+             Time average of the field. Computed if None. Default=None.
+
+            *frames*: python slice or numpy array of indices.
+             Default=slice(None) (all the time steps).
+
+        Returns:
+            *fluct*: numpy array of shape (T,N) or (T,N,d).
+        '''
+        if mean is None:
+            mean = self.mean(name)
+        return np.asarray(self.fields[name][frames],dtype=float)-mean
+
+    def rms(self,name,mean=None,chunkSize=1000):
+        '''
+        Root mean square of the fluctuation of the field "name", computed by
+        chunks of chunkSize time steps.
+
+        Returns:
+            *rms*: numpy array of shape (N,) or (N,d).
+        '''
+        if mean is None:
+            mean = self.mean(name,chunkSize=chunkSize)
+        field = self.fields[name]
+        res = np.zeros(field.shape[1:])
+        for start in range(0,self.nTimes,chunkSize):
+            res += np.sum((np.asarray(field[start:start+chunkSize],dtype=float)-mean)**2,axis=0)
+        return np.sqrt(res/self.nTimes)
+
+    def gradient(self,name,frames=slice(None)):
+        '''
+        Gradient at the grid points of the field "name" for the time steps
+        "frames", with the sparse gradient operators of the mesh: all the
+        time steps and components are derived with one sparse matrix
+        product per direction.
+
+        Returns:
+            *dfdx*, *dfdy*: numpy arrays of shape (T,N) or (T,N,d).
+        '''
+        field = np.asarray(self.fields[name][frames],dtype=float)
+        # (N,T,...) stack for TriSurfaceMesh.gradient
+        dfdx,dfdy = self.triSurfaceMesh.gradient(np.swapaxes(field,0,1))
+        return np.swapaxes(dfdx,0,1),np.swapaxes(dfdy,0,1)
+
+    def computeDerivedField(self,key,name='U',chunkSize=100):
+        '''
+        Derived field of the in-plane velocity gradient of the vector field
+        "name", for all the time steps. The gradient is computed by chunks
+        of chunkSize time steps (see gradient).
+
+        Arguments:
+            *key*: python string.
+             "VortZ" (dvdx-dudy), "Div2D" (dudx+dvdy), "Q" (truncated Q, see
+             TriSurfaceVector.Q) or "lambda2" (see Surface.lambda2).
+
+            *name*: python string.
+             Name of a vector field. Default="U".
+
+            *chunkSize*: python int.
+             Number of time steps computed at once. Default=100.
+
+        Returns:
+            *res*: numpy array of shape (T,N).
+        '''
+        if key not in _derivedFields:
+            raise ValueError('derived field "'+str(key)+'" is not one of '+str(sorted(_derivedFields.keys()))+'.')
+        field = self.fields[name]
+        if field.ndim!=3:
+            raise ValueError('field "'+name+'" is not a vector field.')
+        res = np.empty((self.nTimes,self.nPoints))
+        for start in range(0,self.nTimes,chunkSize):
+            uv = np.asarray(field[start:start+chunkSize,:,0:2],dtype=float)
+            dfdx,dfdy = self.triSurfaceMesh.gradient(np.swapaxes(uv,0,1))
+            res[start:start+chunkSize] = _derivedFields[key](dfdx[:,:,0].T,
+                                                             dfdy[:,:,0].T,
+                                                             dfdx[:,:,1].T,
+                                                             dfdy[:,:,1].T)
+        return res
+
+    def getTimeSlice(self,frames):
+        '''
+        TriSurfaceTimeSeries of the time steps "frames" (python slice, array
+        of indices or boolean mask). The numpy fields of a slice are views
+        (no copy). The mesh is shared.
+        '''
+        if isinstance(frames,(int,np.integer)):
+            frames = slice(frames,frames+1 if frames!=-1 else None)
+        tss = TriSurfaceTimeSeries(self.triSurfaceMesh,self.t[frames],projectedField=self.projectedField)
+        for name,field in self.fields.items():
+            tss.fields[name] = _takeFrames(field,frames)
+        return tss
+
+    def getTimeIndex(self,minVal=None,maxVal=None):
+        '''
+        Indices of the time steps with minVal<=t<=maxVal (no limit if None).
+        '''
+        keep = np.ones(self.nTimes,dtype=bool)
+        if minVal is not None:
+            keep = keep & (self.t>=minVal)
+        if maxVal is not None:
+            keep = keep & (self.t<=maxVal)
+        return np.where(keep)[0]
+
+    def selectPoints(self,points,triSurfaceMesh=None):
+        '''
+        TriSurfaceTimeSeries of a subset of points.
+
+        Arguments:
+            *points*: numpy array of int or bool.
+             Indices (or mask) of the points to keep.
+
+            *triSurfaceMesh*: TriSurfaceMesh object.
+             Mesh of the selected points, in the order of "points". If None,
+             it is created with the triangles whose three points are
+             selected. Default=None.
+
+        Returns:
+            *tss*: TriSurfaceTimeSeries object.
+        '''
+        points = np.asarray(points)
+        if points.dtype==bool:
+            points = np.where(points)[0]
+        if triSurfaceMesh is None:
+            triSurfaceMesh = getSubMesh(self.triSurfaceMesh,points)
+        tss = TriSurfaceTimeSeries(triSurfaceMesh,self.t,projectedField=self.projectedField)
+        for name,field in self.fields.items():
+            tss.fields[name] = np.asarray(field[:])[:,points]
+        return tss
+
+    def getSubTimeSeries(self,poly,op='in',mode='mid'):
+        '''
+        TriSurfaceTimeSeries of the part of the surface inside or outside
+        of a polygon. See TriSurfaceFunctions.getSubTriSurfaceMesh for the
+        arguments.
+        '''
+        subTsm,points,node_renum = self.triSurfaceMesh.getSubMesh(poly,op=op,mode=mode)
+        return self.selectPoints(points,triSurfaceMesh=subTsm)
+
+    def toContainerList(self,names=[]):
+        '''
+        Convert to a list of TriSurfaceContainer objects (one per time step)
+        sharing the mesh. The components of the TriSurface<type> objects are
+        views of the fields (no copy) if the fields are numpy arrays.
+
+        Arguments:
+            *names*: python list of strings.
+             Fields to convert. All the fields if empty. Default=[].
+        '''
+        if len(names)==0:
+            names = list(self.fields.keys())
+        tscList = []
+        for i in range(self.nTimes):
+            tsc = TriSurfaceContainer.TriSurfaceContainer(self.triSurfaceMesh)
+            tsc.time = self.t[i]
+            for name in names:
+                tsc.fields[name] = createTriSurface(self.fields[name][i],
+                                                    self.t[i],
+                                                    self.triSurfaceMesh,
+                                                    self.projectedField)
+            tscList.append(tsc)
+        return tscList
+
+    def saveToHdf5(self,hdf5file,compression='gzip',chunkSize=100):
+        '''
+        Save the mesh, the time and the fields in a hdf5 file:
+            mesh/points, mesh/faces: raw points and triangles (see
+            TriSurfaceMesh.readFromHdf5)
+            t: time, shape (T,)
+            fields/<name>: field, shape (T,N) or (T,N,d), chunked by
+            chunkSize time steps.
+
+        Arguments:
+            *hdf5file*: python string.
+             Path to the target file.
+
+            *compression*: python string.
+             Compression filter of the fields. Default='gzip'.
+
+            *chunkSize*: python int.
+             Number of time steps of a chunk. Default=100.
+        '''
+        f = h5py.File(hdf5file,'w')
+        try:
+            gMesh = f.create_group('mesh')
+            gMesh.create_dataset('points',data=self.triSurfaceMesh.rawPoints())
+            gMesh.create_dataset('faces',data=self.triSurfaceMesh.triangles)
+            f.create_dataset('t',data=self.t)
+            f.attrs['projectedField'] = self.projectedField
+            gFields = f.create_group('fields')
+            for name,field in self.fields.items():
+                chunks = (max(min(chunkSize,self.nTimes),1),)+tuple(field.shape[1:])
+                dset = gFields.create_dataset(name,
+                                              shape=field.shape,
+                                              dtype=field.dtype,
+                                              chunks=chunks,
+                                              compression=compression)
+                for start in range(0,self.nTimes,chunkSize):
+                    dset[start:start+chunkSize] = field[start:start+chunkSize]
+        finally:
+            f.close()
+
+    def toMemmap(self,directory,names=[]):
+        '''
+        Move the fields to memory-mapped .npy files (directory/<name>.npy),
+        so that long time series do not need to fit in memory. The fields
+        are replaced by the numpy memmaps. Reopen them with
+        numpy.load(fname,mmap_mode='r').
+
+        Arguments:
+            *directory*: python string.
+             Existing directory of the .npy files.
+
+            *names*: python list of strings.
+             Fields to move. All the fields if empty. Default=[].
+        '''
+        if len(names)==0:
+            names = list(self.fields.keys())
+        for name in names:
+            field = self.fields[name]
+            mm = np.lib.format.open_memmap(os.path.join(directory,name+'.npy'),
+                                           mode='w+',
+                                           dtype=field.dtype,
+                                           shape=field.shape)
+            for start in range(0,self.nTimes,1000):
+                mm[start:start+1000] = field[start:start+1000]
+            mm.flush()
+            self.fields[name] = mm
+
+    def close(self):
+        '''
+        Close the hdf5 file of the fields read with inMemory=False.
+        '''
+        if 'hdf5Parser' in self.data:
+            self.data['hdf5Parser'].close()
+            del self.data['hdf5Parser']
+
+
+#=============================================================================#
+# functions
+#=============================================================================#
+def getNumberOfComponents(triSurface):
+    '''
+    Number of components of a TriSurfaceScalar (1), TriSurfaceVector (3) or
+    TriSurfaceSymmTensor (6).
+    '''
+    if isinstance(triSurface,TriSurfaceScalar.TriSurfaceScalar):
+        return 1
+    elif isinstance(triSurface,TriSurfaceVector.TriSurfaceVector):
+        return 3
+    elif isinstance(triSurface,TriSurfaceSymmTensor.TriSurfaceSymmTensor):
+        return 6
+    else:
+        raise TypeError('unsupported TriSurface type '+str(type(triSurface)))
+
+def getComponents(triSurface):
+    '''
+    Components of a TriSurface<type> as an array of shape (N,) or (N,d).
+    '''
+    names = _componentNames[getNumberOfComponents(triSurface)]
+    if len(names)==1:
+        return getattr(triSurface,names[0])
+    return np.array([getattr(triSurface,n) for n in names]).T
+
+def createTriSurface(values,time,triSurfaceMesh,projectedField=False):
+    '''
+    Create a TriSurfaceScalar, TriSurfaceVector or TriSurfaceSymmTensor
+    from the values of one time step, of shape (N,), (N,3) or (N,6).
+    '''
+    if values.ndim==1:
+        return TriSurfaceScalar.TriSurfaceScalar(s=values,
+                                                 time=time,
+                                                 triSurfaceMesh=triSurfaceMesh,
+                                                 projectedField=projectedField)
+    nComp = values.shape[1]
+    if nComp not in _componentNames:
+        raise ValueError('unsupported number of components '+str(nComp))
+    kwargs = dict()
+    for i,n in enumerate(_componentNames[nComp]):
+        kwargs[n] = values[:,i]
+    if nComp==3:
+        return TriSurfaceVector.TriSurfaceVector(time=time,
+                                                 triSurfaceMesh=triSurfaceMesh,
+                                                 projectedField=projectedField,
+                                                 **kwargs)
+    return TriSurfaceSymmTensor.TriSurfaceSymmTensor(time=time,
+                                                     triSurfaceMesh=triSurfaceMesh,
+                                                     projectedField=projectedField,
+                                                     **kwargs)
+
+def getSubMesh(tsm,points):
+    '''
+    TriSurfaceMesh of the points "points" (array of indices) of tsm, with
+    the triangles whose three points are selected, renumbered in the order
+    of "points".
+    '''
+    renum = -np.ones(len(tsm.x),dtype=int)
+    renum[points] = np.arange(len(points))
+    triangles = renum[tsm.triangles]
+    triangles = triangles[np.all(triangles>=0,axis=1)]
+    return TriSurfaceMesh.TriSurfaceMesh(x=tsm.x[points],
+                                         y=tsm.y[points],
+                                         z=tsm._TriSurfaceMesh__z[points],
+                                         triangles=triangles,
+                                         mask=None,
+                                         affTrans=tsm.affTrans,
+                                         linTrans=tsm.linTrans)
+
+def _takeFrames(field,frames):
+    '''
+    Time steps "frames" of a field. A h5py dataset is read in memory.
+    '''
+    if isinstance(field,np.ndarray):
+        return field[frames]
+    if isinstance(frames,slice):
+        return field[frames]
+    frames = np.asarray(frames)
+    if frames.dtype==bool:
+        frames = np.where(frames)[0]
+    # h5py needs increasing indices
+    order = np.argsort(frames)
+    res = np.empty((len(frames),)+tuple(field.shape[1:]),dtype=field.dtype)
+    res[order] = field[list(frames[order])]
+    return res
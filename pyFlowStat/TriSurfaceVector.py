@@ -5,7 +5,6 @@ TriSurfaceVector.py
 #import re
 
 import numpy as np
-import matplotlib.tri as tri
 
 import pyFlowStat.TriSurface as TriSurface
 import pyFlowStat.ParserFunctions as ParserFunctions
@@ -37,11 +36,11 @@ class TriSurfaceVector(TriSurface.TriSurface):
         
         *vz*: numpy array of shape (N,)
         
-        *vx_i*: CubicTriInterpolator or LinearTriInterpolation object
+        *vx_i*: TriContextInterpolator object
         
-        *vy_i*: CubicTriInterpolator or LinearTriInterpolation object
+        *vy_i*: TriContextInterpolator object
         
-        *vz_i*: CubicTriInterpolator or LinearTriInterpolation object
+        *vz_i*: TriContextInterpolator object
         
         *data*: python dict
         
@@ -137,10 +136,8 @@ class TriSurfaceVector(TriSurface.TriSurface):
 
         #get vectors (in vecsTgt)
         vecsSrc = ParserFunctions.parseFoamFile_sampledSurface(varsFile)
-        vecsTgt = np.zeros((vecsSrc.shape[0],vecsSrc.shape[1]))
         if projectedField==True:
-            for i in range(vecsSrc.shape[0]):
-                vecsTgt[i,:] = triSurfaceMesh.linTrans.srcToTgt(vecsSrc[i,:])
+            vecsTgt = TriSurface.projectField(vecsSrc,triSurfaceMesh.linTrans)
         else:
             vecsTgt = vecsSrc
 
@@ -165,10 +162,8 @@ class TriSurfaceVector(TriSurface.TriSurface):
         '''
         time = hdf5Parser[key]['time'].value
         vecsSrc = hdf5Parser[key][varName].value
-        vecsTgt = np.zeros((vecsSrc.shape[0],vecsSrc.shape[1]))  
         if projectedField==True:
-            for i in range(vecsSrc.shape[0]):
-                vecsTgt[i,:] = triSurfaceMesh.linTrans.srcToTgt(vecsSrc[i,:])
+            vecsTgt = TriSurface.projectField(vecsSrc,triSurfaceMesh.linTrans)
         else:
             vecsTgt = vecsSrc
         
@@ -189,7 +184,8 @@ class TriSurfaceVector(TriSurface.TriSurface):
                     vtkFile,
                     triSurfaceMesh,
                     time,
-                    projectedField=False):
+                    projectedField=False,
+                    varName=None):
         '''
         Construct from a surface saved by OpenFOAM in VTK format.
         
@@ -207,15 +203,18 @@ class TriSurfaceVector(TriSurface.TriSurface):
             *projectedField* python bool (default=False)
              Defines if the data fields has to be projected in the basis of the
              surface. 
+             
+            *varName*: python string.
+             Name of the POINT_DATA array of the vtk-file. If None, the first
+             array is used. Default=None.
         '''     
         # read VTK file
-        ptsSrc, triangles, vecsSrc = ParserFunctions.parseVTK_ugly_sampledSurface(vtkFile)
+        ptsSrc, triangles, pointData, cellData = ParserFunctions.parseVTK_sampledSurface(vtkFile)
+        vecsSrc = ParserFunctions.getVTKField(pointData,varName)
             
         # transform the data
-        vecsTgt = np.zeros((vecsSrc.shape[0],vecsSrc.shape[1]))
         if projectedField==True:
-            for i in range(vecsSrc.shape[0]):
-                vecsTgt[i,:] = triSurfaceMesh.linTrans.srcToTgt(vecsSrc[i,:])
+            vecsTgt = TriSurface.projectField(vecsSrc,triSurfaceMesh.linTrans)
         else:
             vecsTgt = vecsSrc
 
@@ -270,10 +269,8 @@ class TriSurfaceVector(TriSurface.TriSurface):
             *rawData*: numpy array of shape (N,3)
         '''
         surfaceData = self.surfaceVars()
-        rawData = np.zeros((surfaceData.shape[0],surfaceData.shape[1]))
         if self.projectedField==True:
-            for i in range(surfaceData.shape[0]):
-                rawData[i,:] = self.linTrans.tgtToSrc(surfaceData[i,:])
+            rawData = self.linTrans.tgtToSrcArray(surfaceData)
         else:
             rawData = surfaceData
         return rawData
@@ -294,20 +291,20 @@ class TriSurfaceVector(TriSurface.TriSurface):
       
      
     def VortZ(self):
-        if self.vx_i!=None:  
-            VortZ = None
-            if (self.data.has_key('dvydx')==True and self.data.has_key('dvydx')==True):
-                VortZ = self.data['dvydx']-self.data['dvydx']
-            else:
-                dvydx,dvydy = self.vy_i.gradient(self.x,self.y)
-                dvxdx,dvxdy = self.vx_i.gradient(self.x,self.y)
-                VortZ = dvydx-dvydx
-            
-            return VortZ
-            
+        '''
+        Evaluate the z component of the vorticity, dvydx-dvxdy, at the grid
+        points. The gradient saved by addGradient is used if available, else
+        it is computed with the gradient operators of the mesh.
+        
+        Returns:
+            *VortZ*: numpy array of shape (N,).
+        '''
+        if ('dvydx' in self.data and 'dvxdy' in self.data):
+            VortZ = self.data['dvydx']-self.data['dvxdy']
         else:
-            raise ValueError('this method needs interpolators. Please run',
-                             'method "addInterpolator" first.')
+            dvxdx,dvxdy,dvydx,dvydy = self._gradient2D()
+            VortZ = dvydx-dvxdy
+        return VortZ
     
     def Q(self):
         '''
@@ -320,20 +317,32 @@ class TriSurfaceVector(TriSurface.TriSurface):
         Returns:
             *Q*: numpy array of shape (N,).
         '''
-        if self.vx_i!=None:
-            Q = None
-            if (self.data.has_key('dvydx')==True and self.data.has_key('dvydx')==True):
-                Q = 0.5*(-2.0*self['dvxdy']*self['dvydx']-self['dvxdx']**2-self['dvydy']**2)
-            else:
-                dvydx,dvydy = self.vy_i.gradient(self.x,self.y)
-                dvxdx,dvxdy = self.vx_i.gradient(self.x,self.y)
-                Q = 0.5*(-2.0*dvxdy*dvydx-dvxdx**2-dvydy**2)
-            
-            return Q
+        if ('dvxdx' in self.data and 'dvxdy' in self.data and
+            'dvydx' in self.data and 'dvydy' in self.data):
+            Q = 0.5*(-2.0*self.data['dvxdy']*self.data['dvydx']-self.data['dvxdx']**2-self.data['dvydy']**2)
         else:
-            raise ValueError('this method needs interpolators. Please run',
-                             'method "addInterpolator" first.')
+            dvxdx,dvxdy,dvydx,dvydy = self._gradient2D()
+            Q = 0.5*(-2.0*dvxdy*dvydx-dvxdx**2-dvydy**2)
+        return Q
 
+    def gradient(self):
+        '''
+        Calculate the gradient at all the grid points with the sparse
+        gradient operators of the mesh (TriSurfaceMesh.gradient). No
+        interpolator is needed.
+        
+        Returns:
+            *dvxdx, dvxdy, dvydx, dvydy, dvzdx, dvzdy *: python tuple of six numpy array of shape (N,).
+        '''
+        dvdx,dvdy = self.triSurfaceMesh.gradient(self.surfaceVars())
+        return dvdx[:,0],dvdy[:,0],dvdx[:,1],dvdy[:,1],dvdx[:,2],dvdy[:,2]
+        
+    def _gradient2D(self):
+        '''
+        In-plane gradient dvxdx,dvxdy,dvydx,dvydy at the grid points.
+        '''
+        dvdx,dvdy = self.triSurfaceMesh.gradient(np.vstack((self.vx,self.vy)).T)
+        return dvdx[:,0],dvdy[:,0],dvdx[:,1],dvdy[:,1]
 
     def gradientxy(self,x,y):
         '''
@@ -372,24 +381,20 @@ class TriSurfaceVector(TriSurface.TriSurface):
         '''
         self.interType = interpolation
         self.interKind = kind
-        if self.interType=='cubic':
-            self.vx_i = tri.CubicTriInterpolator(self.triangulation, self.vx, kind=self.interKind)
-            self.vy_i = tri.CubicTriInterpolator(self.triangulation, self.vy, kind=self.interKind)
-            self.vz_i = tri.CubicTriInterpolator(self.triangulation, self.vz, kind=self.interKind)
-        elif self.interType=='linear':
-            self.vx_i = tri.LinearTriInterpolator(self.triangulation, self.vx)
-            self.vy_i = tri.LinearTriInterpolator(self.triangulation, self.vy)
-            self.vz_i = tri.LinearTriInterpolator(self.triangulation, self.vz)
+        if self.interType=='cubic' or self.interType=='linear':
+            # the interpolation context is shared by all fields on the mesh
+            context = self.triSurfaceMesh.getInterpolationContext(self.interType,self.interKind)
+            self.vx_i,self.vy_i,self.vz_i = context.createInterpolators([self.vx,self.vy,self.vz])
         else:
             raise ValueError('Interpolation must be "cubic" or "linear".')
             
 
     def addGradient(self):
         '''
-        Calculate and save the gradient at all point of the grid. As expected,
-        the dvidz does not exist.
+        Calculate and save the gradient at all point of the grid (see
+        gradient). As expected, the dvidz does not exist.
         '''   
-        dvxdx, dvxdy, dvydx, dvydy, dvzdx, dvzdy = self.gradientxy(self.x,self.y)
+        dvxdx, dvxdy, dvydx, dvydy, dvzdx, dvzdy = self.gradient()
         self.data['dvxdx'] = dvxdx
         self.data['dvxdy'] = dvxdy
         
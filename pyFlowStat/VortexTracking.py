@@ -0,0 +1,276 @@
+'''
+VortexTracking.py
+
+Detection of the vortices of a SurfaceTimeSeries with a vortex criterion
+(lambda2, Q or Q_sign, see Surface.generateFields) and tracking of the
+vortices from frame to frame.
+
+The frames are processed by chunks: the criterion of a whole chunk is
+computed with the vectorized derived fields of Surface, the vortices of all
+the frames of the chunk are labeled with one call of scipy.ndimage.label and
+their properties are computed with ndimage reductions. The vortices of two
+consecutive frames are linked with a nearest neighbour search (cKDTree) of
+their centroids.
+
+The vortices are returned as a numpy structured array (the "track table")
+with one row per vortex and per frame, see VortexTracker.dtype.
+'''
+
+#=============================================================================#
+# load modules
+#=============================================================================#
+from multiprocessing.pool import ThreadPool
+
+#scientific modules
+import numpy as np
+import scipy.ndimage as ndimage
+from scipy.spatial import cKDTree
+
+import pyFlowStat.Surface as sr
+
+
+class VortexTracker(object):
+    '''
+    Vortex detection and tracking in a SurfaceTimeSeries.
+
+    A pixel belongs to a vortex if its criterion is larger than threshold:
+        * "lambda2": -lambda2 (Surface convention, positive in vortices)
+        * "Q": Q criterion
+        * "Q_sign": |Q_sign|, the sign of Q_sign gives the rotation
+    Connected pixels of a frame form a vortex. Vortices smaller than minArea
+    are ignored.
+
+    For each vortex, the track table holds the centroid (x,y) weighted by the
+    criterion, the area (unit of dx*dy), the circulation (integral of VortZ,
+    in m^2/s with dx and dy in mm, as the Surface gradients) and the peak
+    value of the criterion.
+
+    Usage:
+        >>> vt = VortexTracker(criterion='lambda2',threshold=100.0,maxDistance=5.0)
+        >>> table = vt.track(sts)
+        >>> longest = vt.getTrack(table,np.bincount(table['track']).argmax())
+        >>> plt.plot(longest['x'],longest['y'])
+    '''
+
+    # structure of the track table
+    dtype = np.dtype([('track',np.int32),
+                      ('frame',np.int32),
+                      ('t',np.float64),
+                      ('x',np.float32),
+                      ('y',np.float32),
+                      ('area',np.float32),
+                      ('circulation',np.float32),
+                      ('peak',np.float32)])
+
+    # constructors #
+    #--------------#
+    def __init__(self,
+                 criterion='lambda2',
+                 threshold=0.0,
+                 minArea=0.0,
+                 connectivity=2,
+                 maxDistance=None,
+                 chunkSize=100,
+                 nThreads=1):
+        '''
+        base constructor.
+
+        Arguments:
+            *criterion*: python string.
+             "lambda2", "Q" or "Q_sign". Default="lambda2".
+
+            *threshold*: python float.
+             Threshold of the criterion. Default=0.0.
+
+            *minArea*: python float.
+             Minimal area of a vortex, in the unit of dx*dy. Default=0.0.
+
+            *connectivity*: python int.
+             1 (4 neighbours) or 2 (8 neighbours). Default=2.
+
+            *maxDistance*: python float.
+             Maximal displacement of a vortex centroid between two frames,
+             in the unit of x and y. If None, 5*max(dx,dy). Default=None.
+
+            *chunkSize*: python int.
+             Number of frames processed at once. Default=100.
+
+            *nThreads*: python int.
+             Number of threads processing the chunks. Default=1.
+        '''
+        if criterion not in ['lambda2','Q','Q_sign']:
+            raise ValueError('criterion "'+str(criterion)+'" is not "lambda2", "Q" or "Q_sign".')
+        self.criterion = criterion
+        self.threshold = threshold
+        self.minArea = minArea
+        self.maxDistance = maxDistance
+        self.chunkSize = chunkSize
+        self.nThreads = nThreads
+
+        # no connection between the frames of a chunk
+        self.structure = np.zeros((3,3,3),dtype=bool)
+        self.structure[1] = ndimage.generate_binary_structure(2,connectivity)
+
+
+    # class methods #
+    #---------------#
+    def track(self,sts):
+        '''
+        Detect and link the vortices of sts. Returns the track table.
+        '''
+        return self.link(self.detect(sts),sts.dx,sts.dy)
+
+    def detect(self,sts):
+        '''
+        Detect the vortices of each frame of sts.
+
+        Arguments:
+            *sts*: SurfaceTimeSeries object.
+
+        Returns:
+            *table*: numpy structured array of dtype VortexTracker.dtype,
+             sorted by frame. The column 'track' is -1.
+        '''
+        nFrames = len(sts.vx)
+        starts = range(0,nFrames,self.chunkSize)
+        work = lambda start: self._detectChunk(sts,start,min(start+self.chunkSize,nFrames))
+        if self.nThreads>1:
+            pool = ThreadPool(self.nThreads)
+            try:
+                tables = pool.map(work,starts)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            tables = [work(start) for start in starts]
+        if len(tables)==0:
+            return np.zeros(0,dtype=self.dtype)
+        return np.concatenate(tables)
+
+    def _detectChunk(self,sts,start,stop):
+        '''
+        Detect the vortices of the frames start:stop of sts.
+        '''
+        crit,vortZ = getCriterion(sts.vx[start:stop],sts.vy[start:stop],sts.dx,sts.dy,self.criterion)
+        if self.criterion=='Q_sign':
+            mask = np.abs(crit)>self.threshold
+        else:
+            mask = crit>self.threshold
+        labels,n = ndimage.label(mask,structure=self.structure)
+        if n==0:
+            return np.zeros(0,dtype=self.dtype)
+
+        index = np.arange(1,n+1)
+        cellArea = sts.dx*sts.dy
+        weight = np.abs(crit)
+        area = ndimage.sum(np.ones(mask.shape),labels,index)*cellArea
+        circulation = ndimage.sum(np.nan_to_num(vortZ),labels,index)*cellArea*1.0e-6
+        peak = ndimage.maximum(weight,labels,index)
+        # centroids weighted by the criterion, in (frame,row,col) indices
+        center = np.array(ndimage.center_of_mass(weight,labels,index)).reshape(n,3)
+
+        table = np.zeros(n,dtype=self.dtype)
+        table['track'] = -1
+        table['frame'] = start+np.round(center[:,0]).astype(int)
+        table['x'] = sts.minX+center[:,2]*sts.dx
+        table['y'] = sts.maxY-center[:,1]*sts.dy
+        table['area'] = area
+        table['circulation'] = circulation
+        table['peak'] = peak
+        if len(sts.t)==len(sts.vx):
+            table['t'] = np.asarray(sts.t)[table['frame']]
+        table = table[area>=self.minArea]
+        return table[np.argsort(table['frame'],kind='mergesort')]
+
+    def link(self,table,dx=1.0,dy=1.0):
+        '''
+        Link the vortices of consecutive frames. A vortex of frame i+1 gets
+        the track number of the nearest vortex of frame i with the same
+        sense of rotation, if their distance is smaller than maxDistance. If
+        several vortices of frame i+1 compete for the same vortex, the
+        nearest one continues the track. The other vortices start new tracks.
+
+        Arguments:
+            *table*: numpy structured array returned by detect().
+
+            *dx*, *dy*: python float.
+             Grid spacing, used for the default maxDistance.
+
+        Returns:
+            *table*: the track table with the column 'track' filled.
+        '''
+        maxDistance = self.maxDistance
+        if maxDistance==None:
+            maxDistance = 5.0*max(dx,dy)
+        table = table.copy()
+        nextTrack = 0
+        bounds = np.searchsorted(table['frame'],np.arange(table['frame'].min(),table['frame'].max()+2)) if len(table)>0 else []
+        prev = None
+        prevFrame = None
+        for b0,b1 in zip(bounds[:-1],bounds[1:]):
+            if b1==b0:
+                prev = None
+                continue
+            cur = np.arange(b0,b1)
+            frame = table['frame'][b0]
+            if prev is not None and frame==prevFrame+1:
+                for sign in [1,-1]:
+                    p = prev[np.sign(table['circulation'][prev])==sign]
+                    c = cur[np.sign(table['circulation'][cur])==sign]
+                    if len(p)==0 or len(c)==0:
+                        continue
+                    src,tgt = matchNearest(np.array([table['x'][p],table['y'][p]]).T,
+                                           np.array([table['x'][c],table['y'][c]]).T,
+                                           maxDistance)
+                    table['track'][c[tgt]] = table['track'][p[src]]
+            new = cur[table['track'][cur]==-1]
+            table['track'][new] = np.arange(nextTrack,nextTrack+len(new))
+            nextTrack = nextTrack+len(new)
+            prev = cur
+            prevFrame = frame
+        return table
+
+    def getTrack(self,table,track):
+        '''
+        Returns the rows of the track number "track" of the track table.
+        '''
+        return table[table['track']==track]
+
+
+#=============================================================================#
+# functions
+#=============================================================================#
+def getCriterion(vx,vy,dx,dy,criterion='lambda2'):
+    '''
+    Vortex criterion and vorticity of a frame (ny,nx) or a stack of frames
+    (T,ny,nx), computed with the derived fields of Surface.
+
+    Returns:
+        *crit*, *vortZ*: numpy arrays of the shape of vx.
+    '''
+    data = {'Ux':np.asarray(vx,dtype=float),'Uy':np.asarray(vy,dtype=float),'dx':dx,'dy':dy}
+    sr.computeDerivedField(data,criterion)
+    sr.computeDerivedField(data,'VortZ')
+    return data[criterion],data['VortZ']
+
+def matchNearest(src,tgt,maxDistance):
+    '''
+    One to one matching of the points tgt with their nearest point of src,
+    closer than maxDistance. A point of src is matched at most once, with
+    its nearest point of tgt.
+
+    Arguments:
+        *src*, *tgt*: numpy arrays of shape (n,2) and (m,2).
+
+        *maxDistance*: python float.
+
+    Returns:
+        *srcIdx*, *tgtIdx*: numpy arrays of int, indices of the matched pairs.
+    '''
+    tree = cKDTree(src)
+    dist,idx = tree.query(tgt,k=1,distance_upper_bound=maxDistance)
+    found = np.where(np.isfinite(dist))[0]
+    # nearest pairs first, keep the first pair of each point of src
+    found = found[np.argsort(dist[found],kind='mergesort')]
+    srcIdx,first = np.unique(idx[found],return_index=True)
+    return srcIdx,found[first]